@@ -0,0 +1,212 @@
+import os
+import re
+import math
+import time
+import json
+from collections import Counter
+from cache import TTLCache
+import auth
+
+# 准入控制：按用户/IP 的令牌桶限流 + 按路由分组的并发上限 + 过载时按优先级降级
+# - 限流超出返回 429，并发上限/过载返回 503，都带 Retry-After
+# - 过载 (本进程在途请求数超过阈值) 时先放弃低优先级的工作：匿名读最先被降级，
+#   其中帖子列表/详情、用户主页改为返回 (可能稍旧的) 缓存响应，没有缓存才返回 503；
+#   登录和写操作只受总并发上限约束，最后才会被拒绝
+# - 计数和令牌桶都在进程内，多 worker 时每个 worker 各自计算 (有效限额约为 worker 数倍)
+# ADMISSION_CONTROL=1 时启用
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "0") == "1"
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "64"))
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "100000"))
+# 只有来自这些地址的请求才信任 X-Real-IP (Nginx 反向代理)
+TRUSTED_PROXIES = set(os.getenv("ADMISSION_TRUSTED_PROXIES", "127.0.0.1,::1").split(","))
+# 登录/注册按 IP 限流；学校、公司等共用出口 IP 的场景可适当调大
+LOGIN_RATE = float(os.getenv("ADMISSION_LOGIN_RATE", "0.5"))
+LOGIN_BURST = int(os.getenv("ADMISSION_LOGIN_BURST", "10"))
+RETRY_AFTER_BUSY = 1
+
+# 优先级：在途请求数达到 ADMISSION_MAX_INFLIGHT 的对应比例后开始拒绝该优先级
+LOW, READ, WRITE, CRITICAL = "low", "read", "write", "critical"
+SHED_AT = {LOW: 0.5, READ: 0.75, WRITE: 1.0, CRITICAL: 1.0}
+
+class Rule:
+    # rate/burst: 每个用户 (匿名按 IP) 的令牌桶，None 表示不限流；concurrency: 本组同时处理的请求上限
+    # by_ip: 始终按 IP 限流 (登录/注册时还没有身份)；cacheable: 匿名请求过载时可以退回缓存响应
+    def __init__(self, name, methods, pattern, priority, rate=None, burst=None, concurrency=None,
+                 by_ip=False, cacheable=False):
+        self.name = name
+        self.methods = methods
+        self.pattern = re.compile(pattern)
+        self.priority = priority
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.by_ip = by_ip
+        self.cacheable = cacheable
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# 按顺序匹配，第一条命中的生效
+RULES = [
+    Rule("login", {"POST"}, r"/api/(token|register)", CRITICAL, rate=LOGIN_RATE, burst=LOGIN_BURST, by_ip=True),
+    Rule("upload", {"POST"}, r"/api/upload", WRITE, rate=0.2, burst=10, concurrency=4),
+    Rule("toggle", {"POST"}, r"/api/(posts/\d+/(like|collect)|users/\d+/follow|toggles)", WRITE, rate=2, burst=30),
+    Rule("write", WRITE_METHODS, r"/api/.*", WRITE, rate=2, burst=30),
+    Rule("export", {"GET"}, r"/api/admin/export/.*", READ, concurrency=2),
+    Rule("search", {"GET"}, r"/api/search", READ, rate=5, burst=30, concurrency=8),
+    Rule("feed", {"GET"}, r"/api/(posts/(\d+)?|users/\d+)", READ, rate=20, burst=100, cacheable=True),
+    Rule("read", {"GET"}, r"/api/.*", READ, rate=20, burst=100),
+]
+
+# 不参与准入控制：监控抓取、SSE 长连接 (连接期间几乎不占资源)
+EXEMPT = re.compile(r"/api/(metrics|notifications/stream)")
+
+def match(method: str, path: str):
+    if not path.startswith("/api/") or EXEMPT.fullmatch(path):
+        return None
+    for rule in RULES:
+        if method in rule.methods and rule.pattern.fullmatch(path):
+            return rule
+    return None
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, rate: float, burst: float, now: float) -> float:
+        # 取到令牌返回 0，否则返回需要等待的秒数
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate
+
+class AdmissionController:
+    # 只在事件循环线程里调用，不需要加锁
+    def __init__(self, max_inflight: int = ADMISSION_MAX_INFLIGHT):
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.group_inflight = Counter()
+        self.counts = Counter() # (分组, 结果) -> 次数
+        # 空闲超过 ttl 的桶早已回满，直接丢弃即可
+        self.buckets = TTLCache(maxsize=ADMISSION_MAX_CLIENTS, ttl=600)
+
+    def _rate_limit(self, rule: Rule, identity: str) -> float:
+        key = (rule.name, identity)
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(rule.burst, now)
+        wait = bucket.take(rule.rate, rule.burst, now)
+        self.buckets.set(key, bucket)
+        return wait
+
+    def admit(self, rule: Rule, identity: str, anonymous: bool):
+        # 返回 (状态码, Retry-After)：状态码 200 表示放行，None 表示放行但降级为只读缓存
+        if rule.rate is not None:
+            wait = self._rate_limit(rule, identity)
+            if wait > 0:
+                self.counts[(rule.name, "rate_limited")] += 1
+                return 429, math.ceil(wait)
+        if rule.concurrency is not None and self.group_inflight[rule.name] >= rule.concurrency:
+            self.counts[(rule.name, "capped")] += 1
+            return 503, RETRY_AFTER_BUSY
+        priority = LOW if anonymous and rule.priority == READ else rule.priority
+        if self.inflight >= self.max_inflight * SHED_AT[priority]:
+            if priority == LOW and rule.cacheable:
+                self.counts[(rule.name, "degraded")] += 1
+                return None, 0
+            self.counts[(rule.name, "shed")] += 1
+            return 503, RETRY_AFTER_BUSY
+        self.counts[(rule.name, "admitted")] += 1
+        return 200, 0
+
+    def enter(self, rule: Rule):
+        self.inflight += 1
+        self.group_inflight[rule.name] += 1
+
+    def leave(self, rule: Rule):
+        self.inflight -= 1
+        self.group_inflight[rule.name] -= 1
+
+    def stats(self) -> dict:
+        groups = {}
+        for (name, outcome), count in self.counts.items():
+            groups.setdefault(name, {})[outcome] = count
+        for name, count in self.group_inflight.items():
+            groups.setdefault(name, {})["inflight"] = count
+        return {"enabled": ADMISSION_CONTROL, "max_inflight": self.max_inflight, "inflight": self.inflight,
+                "clients": self.buckets.stats()["size"], "groups": groups}
+
+    def render(self) -> str:
+        # Prometheus 格式，附加在 /api/metrics 后面
+        lines = ["# HELP admission_requests_total Admission decisions by route group and outcome.",
+                 "# TYPE admission_requests_total counter"]
+        for (name, outcome), count in sorted(self.counts.items()):
+            lines.append(f'admission_requests_total{{group="{name}",outcome="{outcome}"}} {count}')
+        lines += ["# HELP admission_inflight Requests currently being processed.", "# TYPE admission_inflight gauge",
+                  f"admission_inflight {self.inflight}"]
+        return "\n".join(lines) + "\n"
+
+controller = AdmissionController()
+
+def client_ip(scope) -> str:
+    ip = scope["client"][0] if scope.get("client") else "unknown"
+    if ip in TRUSTED_PROXIES:
+        for name, value in scope["headers"]:
+            if name == b"x-real-ip":
+                return value.decode("latin-1")
+    return ip
+
+def identity(scope, rule: Rule):
+    # 返回 (限流键, 是否匿名)；token 解析结果有缓存，代价很小
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                subject = auth.decode_token_subject(token)
+                if subject:
+                    return (client_ip(scope) if rule.by_ip else "user:" + subject), False
+            break
+    return client_ip(scope), True
+
+def shedding(request) -> bool:
+    # 路由里判断当前请求是否被降级为只读缓存
+    return getattr(request.state, "admission_shed", False)
+
+async def _reject(send, status: int, retry_after: int):
+    detail = "Too many requests" if status == 429 else "Server busy, please retry"
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"), (b"retry-after", str(retry_after).encode())]})
+    await send({"type": "http.response.body", "body": json.dumps({"detail": detail}).encode()})
+
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        rule = match(scope["method"], scope["path"])
+        if rule is None:
+            return await self.app(scope, receive, send)
+        key, anonymous = identity(scope, rule)
+        status, retry_after = controller.admit(rule, key, anonymous)
+        if status is None:
+            scope.setdefault("state", {})["admission_shed"] = True
+        elif status != 200:
+            return await _reject(send, status, retry_after)
+        controller.enter(rule)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            controller.leave(rule)
+
+def install(app):
+    # 在 main.py 中于 CORS 之前调用，使 429/503 响应也带上 CORS 头；未开启时什么都不注册
+    if ADMISSION_CONTROL:
+        app.add_middleware(AdmissionMiddleware)
@@ -1,19 +1,21 @@
+import os
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi.security import OAuth2PasswordBearer
 from fastapi import Depends, HTTPException, status
 from sqlalchemy.orm import Session
-import models, schemas, database
+import models, schemas, database, hashing
+from cache import TTLCache
+from event_bus import bus
 
 # 密钥配置 (生产环境应该从环境变量获取)
 SECRET_KEY = "your-secret-key-keep-it-secret"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# 使用 pbkdf2_sha256 替代 bcrypt，避免长度限制和依赖问题
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# 密码哈希配置与进程池见 hashing.py
+pwd_context = hashing.pwd_context
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/token") # update tokenUrl to match api
 oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="/api/token", auto_error=False)
 
@@ -33,35 +35,81 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# 认证缓存：已验签的 token 和解析出的用户身份，避免每个请求都做 HMAC 校验和用户查询
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+principal_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+def invalidate_principal(username: str):
+    # 用户资料、启用状态或管理员权限变化后调用
+    principal_cache.delete(username)
+    bus.publish("principal", {"username": username})
+
+# 其它 worker 上改了用户状态 (禁用、降权) 时同步删除本进程的缓存
+bus.subscribe("principal", lambda payload: principal_cache.delete(payload["username"]))
+bus.on_reset(principal_cache.clear)
+
+def auth_cache_stats():
+    return {"tokens": token_cache.stats(), "principals": principal_cache.stats()}
+
+def decode_token_subject(token: str) -> Optional[str]:
+    payload = token_cache.get(token)
+    if payload is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            return None
+        # 缓存时间不超过 token 本身的剩余有效期
+        remaining = payload.get("exp", 0) - datetime.utcnow().timestamp()
+        token_cache.set(token, payload, ttl=min(AUTH_CACHE_TTL, remaining))
+    return payload.get("sub")
+
+def query_principal(db: Session, username: str) -> Optional[schemas.Principal]:
+    row = db.query(models.User.id, models.User.username, models.User.is_superuser, models.User.is_active) \
+        .filter(models.User.username == username).first()
+    # 立即结束这个只读事务把连接还给连接池：只读接口的认证会话 (get_db) 与查询会话 (get_read_db)
+    # 不是同一个，否则每个请求会同时占住两个连接，并发数接近连接池大小时互相等待直至超时
+    db.rollback()
+    if row is None:
+        return None
+    return schemas.Principal(
+        id=row.id, username=row.username,
+        is_superuser=bool(row.is_superuser), is_active=row.is_active is not False,
+    )
+
+async def load_principal(db: Session, username: str) -> Optional[schemas.Principal]:
+    principal = principal_cache.get(username)
+    if principal is None:
+        principal = await database.run(db, query_principal, username)
+        if principal is None:
+            return None
+        principal_cache.set(username, principal)
+    return principal
+
 async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = schemas.TokenData(username=username)
-    except JWTError:
+    username = decode_token_subject(token)
+    if username is None:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
+    user = await load_principal(db, username)
     if user is None:
         raise credentials_exception
+    if not user.is_active:
+        raise HTTPException(status_code=403, detail="Inactive user")
     return user
 
 async def get_current_user_optional(token: str = Depends(oauth2_scheme_optional), db: Session = Depends(database.get_db)):
     if not token:
         return None
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
-        token_data = schemas.TokenData(username=username)
-    except JWTError:
+    username = decode_token_subject(token)
+    if username is None:
+        return None
+    user = await load_principal(db, username)
+    if user is None or not user.is_active:
         return None
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
     return user
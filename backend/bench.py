@@ -0,0 +1,337 @@
+import os
+import sys
+import json
+import time
+import bisect
+import random
+import asyncio
+import argparse
+import itertools
+import contextvars
+import contextlib
+from datetime import datetime, timedelta
+
+# 性能基准：生成一个合成论坛数据库，在进程内通过 ASGI 直接驱动 main.app 做并发压测，
+# 并对 CRUD 层做微基准，输出每个场景的吞吐、p50/p95/p99 延迟和每请求 SQL 条数 (JSON)
+#   python bench.py --users 500 --posts 5000 --output baseline.json
+#   python bench.py --baseline baseline.json   # 与基线对比
+#   FAST_JSON=1 python bench.py --parity        # 校验并压测快速序列化路径
+# 默认使用独立的 SQLite 文件；--database-url 可指向本地 MySQL 测试库 (会清空其中的表!)
+
+parser = argparse.ArgumentParser(description="论坛 API / CRUD 性能基准")
+parser.add_argument("--database-url", default="sqlite:///./bench.db")
+parser.add_argument("--users", type=int, default=200)
+parser.add_argument("--posts", type=int, default=2000)
+parser.add_argument("--comments", type=int, default=5000)
+parser.add_argument("--likes", type=int, default=20000)
+parser.add_argument("--follows", type=int, default=5000)
+parser.add_argument("--requests", type=int, default=500, help="每个 HTTP 场景的请求数")
+parser.add_argument("--concurrency", type=int, default=16)
+parser.add_argument("--iterations", type=int, default=200, help="每个 CRUD 微基准的调用次数")
+parser.add_argument("--seed", type=int, default=42)
+parser.add_argument("--skip-seed", action="store_true", help="复用已有的基准数据库")
+parser.add_argument("--parity", action="store_true", help="压测前校验 FAST_JSON 输出与 Pydantic 输出逐字段一致")
+parser.add_argument("--only", help="只运行名称包含该字符串的场景")
+parser.add_argument("--output", help="结果写入文件 (默认输出到 stdout)")
+parser.add_argument("--baseline", help="与之前保存的结果对比")
+args = parser.parse_args()
+
+# 必须在导入 database 之前设置
+os.environ["DATABASE_URL"] = args.database_url
+
+import httpx
+from sqlalchemy import event, insert
+import models, database, post_crud, ranking, reconcile_counters, tag_crud, timeline, fast_json
+from migrate import upgrade_schema
+from auth import pwd_context
+
+PASSWORD = "bench-password"
+WORDS = ("今天 我们 讨论 一下 关于 数据库 索引 的 优化 问题 前端 框架 后端 接口 性能 缓存 分页 "
+         "服务器 部署 经验 分享 学习 笔记 总结 生活 记录 旅行 美食 摄影 读书 电影 音乐 周末 "
+         "工作 效率 工具 推荐 开源 项目 代码 重构 测试 并发 异步 线程 进程 网络 安全 算法").split()
+CATEGORIES = ["技术", "生活", "读书", "旅行", None]
+TAGS = ["Python", "数据库", "前端", "随笔", "摄影", "FastAPI", "Vue", "性能"]
+
+# --- SQL 计数：每个请求在自己的上下文里累加 (线程池和 run_sync 都会继承 contextvars) ---
+
+query_count = contextvars.ContextVar("query_count", default=None)
+
+def _count_query(*_):
+    counter = query_count.get()
+    if counter is not None:
+        counter[0] += 1
+
+event.listen(database.engine, "before_cursor_execute", _count_query)
+if database.replica_engine is not database.engine:
+    event.listen(database.replica_engine, "before_cursor_execute", _count_query)
+if database.DB_ASYNC:
+    event.listen(database.async_engine.sync_engine, "before_cursor_execute", _count_query)
+    if database.async_replica_engine is not database.async_engine:
+        event.listen(database.async_replica_engine.sync_engine, "before_cursor_execute", _count_query)
+
+# --- 数据生成 ---
+
+def zipf_picker(rng: random.Random, n: int, s: float = 1.1):
+    # 按幂律分布挑选 [1, n] 中的 id：少数热门用户/帖子占据大部分互动
+    cum, total = [], 0.0
+    for rank in range(1, n + 1):
+        total += 1 / rank ** s
+        cum.append(total)
+    ids = list(range(1, n + 1))
+    rng.shuffle(ids)
+    return lambda k=1: [ids[i] for i in _choices(rng, cum, k)]
+
+def _choices(rng, cum, k):
+    return [bisect.bisect_left(cum, rng.random() * cum[-1]) for _ in range(k)]
+
+def sentence(rng: random.Random, n: int) -> str:
+    return "".join(rng.choice(WORDS) for _ in range(n))
+
+def content_url(rng: random.Random) -> str:
+    # 与 uploads.py 内容寻址存储相同的 URL 形式 (文件本身并不存在)
+    digest = f"{rng.getrandbits(256):064x}"
+    return f"/uploads/{digest[:2]}/{digest[2:4]}/{digest}.jpg"
+
+def _pairs(pick_a, pick_b, count, exclude_self=False):
+    pairs = set()
+    for a, b in zip(pick_a(count * 2), pick_b(count * 2)):
+        if exclude_self and a == b:
+            continue
+        pairs.add((a, b))
+        if len(pairs) >= count:
+            break
+    return pairs
+
+def seed():
+    rng = random.Random(args.seed)
+    models.Base.metadata.drop_all(bind=database.engine)
+    with contextlib.redirect_stdout(sys.stderr):
+        upgrade_schema()
+    started = time.perf_counter()
+    # 所有用户共用一个密码哈希，避免生成数据时把时间都花在 pbkdf2_sha256 上
+    hashed = pwd_context.hash(PASSWORD)
+    now = datetime.utcnow()
+    with database.engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"id": i, "username": f"user{i}", "email": f"user{i}@bench.local", "hashed_password": hashed,
+             "is_active": True, "is_superuser": False, "bio": sentence(rng, 4)}
+            for i in range(1, args.users + 1)])
+        author = zipf_picker(rng, args.users)
+        conn.execute(insert(models.Post), [
+            {"id": i, "title": sentence(rng, 5), "content": sentence(rng, rng.randint(20, 200)),
+             "owner_id": author()[0], "category": rng.choice(CATEGORIES), "views": rng.randint(0, 5000),
+             "created_at": now - timedelta(minutes=rng.randint(0, 60 * 24 * 90)),
+             "is_pinned": i <= 3, "is_original": rng.random() < 0.8,
+             "tags": ",".join(rng.sample(TAGS, rng.randint(0, 3))) or None,
+             "image_url": content_url(rng) if rng.random() < 0.2 else None}
+            for i in range(1, args.posts + 1)])
+        user, post = zipf_picker(rng, args.users), zipf_picker(rng, args.posts)
+        conn.execute(insert(models.Comment), [
+            {"content": sentence(rng, rng.randint(3, 30)), "post_id": post()[0], "owner_id": user()[0],
+             "created_at": now - timedelta(minutes=rng.randint(0, 60 * 24 * 30))}
+            for _ in range(args.comments)])
+        uniform = lambda k=1: [rng.randint(1, args.users) for _ in range(k)]
+        likes = _pairs(uniform, post, args.likes)
+        if likes:
+            conn.execute(insert(models.post_likes), [{"user_id": u, "post_id": p} for u, p in likes])
+        follows = _pairs(uniform, user, args.follows, exclude_self=True)
+        if follows:
+            conn.execute(insert(models.user_follows), [{"follower_id": a, "followed_id": b} for a, b in follows])
+    # 计数重建会打印进度，不要混进 stdout 的 JSON 结果
+    with contextlib.redirect_stdout(sys.stderr):
+        reconcile_counters.reconcile_counters()
+        db = database.SessionLocal()
+        try:
+            tag_crud.backfill(db)
+        finally:
+            db.close()
+    ranking.rebuild()
+    print(f"基准数据生成完成，用时 {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+# --- 统计 ---
+
+def summarize(latencies: list, queries: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+    def pct(p):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": pct(0.50),
+        "p95_ms": pct(0.95),
+        "p99_ms": pct(0.99),
+        "queries_per_request": round(sum(queries) / len(queries), 2) if queries else None,
+        "max_queries": max(queries) if queries else None,
+    }
+
+# --- HTTP 场景 ---
+
+async def run_scenario(client, make_request, total: int, concurrency: int) -> dict:
+    latencies, queries, errors = [], [], [0]
+    counter = itertools.count()
+
+    async def worker():
+        while next(counter) < total:
+            method, url, kwargs = make_request()
+            query_count.set([0])
+            started = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - started)
+            queries.append(query_count.get()[0])
+            if response.status_code >= 400:
+                errors[0] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, queries, errors[0], time.perf_counter() - started)
+
+async def http_benchmarks() -> dict:
+    import main
+    rng = random.Random(args.seed + 1)
+    post = zipf_picker(rng, args.posts)
+    user = lambda: rng.randint(1, args.users)
+    transport = httpx.ASGITransport(app=main.app)
+    results = {}
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            tokens = {}
+            for uid in range(1, min(args.users, args.concurrency * 2) + 1):
+                r = await client.post("/api/token", data={"username": f"user{uid}", "password": PASSWORD})
+                tokens[uid] = {"Authorization": f"Bearer {r.json()['access_token']}"}
+            auth = lambda: tokens[rng.choice(list(tokens))]
+            if args.parity:
+                problems = await check_parity(client, tokens[1])
+                if problems:
+                    print("\n".join(problems), file=sys.stderr)
+                    raise SystemExit("FAST_JSON 输出与 Pydantic 不一致")
+
+            scenarios = {
+                "http.feed.anonymous": lambda: ("GET", "/api/posts/", {"params": {"limit": 20}}),
+                "http.feed.authenticated": lambda: ("GET", "/api/posts/", {"params": {"limit": 20}, "headers": auth()}),
+                "http.feed.hot": lambda: ("GET", "/api/posts/", {"params": {"limit": 20, "sort": "hot"}, "headers": auth()}),
+                "http.post.anonymous": lambda: ("GET", f"/api/posts/{post()[0]}", {}),
+                "http.post.authenticated": lambda: ("GET", f"/api/posts/{post()[0]}", {"headers": auth()}),
+                "http.token": lambda: ("POST", "/api/token", {"data": {"username": f"user{user()}", "password": PASSWORD}}),
+                "http.like": lambda: ("POST", f"/api/posts/{post()[0]}/like", {"headers": auth()}),
+                "http.toggles": lambda: ("POST", "/api/toggles", {"headers": auth(), "json": {"actions": [
+                    {"type": "like", "target_id": post()[0]}, {"type": "collect", "target_id": post()[0]},
+                    {"type": "follow", "target_id": user()}]}}),
+            }
+            for name, make_request in scenarios.items():
+                if args.only and args.only not in name:
+                    continue
+                # 密码哈希 (pbkdf2_sha256) 故意很慢，登录场景少跑一些
+                total = max(args.requests // 10, args.concurrency) if name == "http.token" else args.requests
+                results[name] = await run_scenario(client, make_request, total, args.concurrency)
+                print(f"{name}: {results[name]}", file=sys.stderr)
+    return results
+
+# --- FAST_JSON 一致性校验 ---
+
+async def check_parity(client, headers) -> list:
+    # 同一请求分别走 Pydantic 和 fast_json 两条路径，逐字段比较输出
+    from response_cache import response_cache
+    pull_threshold = timeline.FANOUT_THRESHOLD
+    timeline.FANOUT_THRESHOLD = -1 # 关注动态全部走拉取，保证有数据可比
+    urls = [
+        ("/api/posts/", {"limit": 100}), ("/api/posts/", {"limit": 100, "sort": "hot"}),
+        ("/api/posts/", {"limit": 50, "category": CATEGORIES[0]}), ("/api/users/me/posts", {}),
+        ("/api/feed/following", {"limit": 100}), (f"/api/tags/{TAGS[0]}/posts", {"limit": 100}),
+    ]
+    problems = []
+    enabled = fast_json.ENABLED
+    try:
+        for url, params in urls:
+            for auth in (headers, {}):
+                if url in ("/api/users/me/posts", "/api/feed/following") and not auth:
+                    continue
+                bodies = []
+                for mode in (False, True):
+                    fast_json.ENABLED = mode
+                    response_cache.invalidate("feed")
+                    r = await client.get(url, params=params, headers=auth)
+                    bodies.append((r.content, r.headers.get("x-next-cursor")))
+                (expected, cursor_a), (actual, cursor_b) = bodies
+                label = f"{url} {params} {'auth' if auth else 'anonymous'}"
+                found = fast_json.diff(expected, actual)
+                if cursor_a != cursor_b:
+                    found.append(f"X-Next-Cursor: {cursor_a} != {cursor_b}")
+                problems += [f"{label} {p}" for p in found[:10]]
+                print(f"parity {label}: {'OK' if not found else '不一致'} ({len(expected)} bytes)", file=sys.stderr)
+    finally:
+        fast_json.ENABLED = enabled
+        timeline.FANOUT_THRESHOLD = pull_threshold
+    return problems
+
+# --- CRUD 微基准 (单线程，直接调用，不经过 HTTP) ---
+
+def crud_benchmarks() -> dict:
+    rng = random.Random(args.seed + 2)
+    post = zipf_picker(rng, args.posts)
+    benchmarks = {
+        "crud.get_posts": lambda db: post_crud.get_posts(db, limit=20, current_user_id=rng.randint(1, args.users)),
+        "crud.get_hot_posts": lambda db: post_crud.get_hot_posts(db, limit=20),
+        "crud.get_post": lambda db: post_crud.get_post(db, post()[0], rng.randint(1, args.users)),
+        "crud.get_posts_by_user": lambda db: post_crud.get_posts_by_user(db, rng.randint(1, args.users), limit=20),
+    }
+    results = {}
+    for name, fn in benchmarks.items():
+        if args.only and args.only not in name:
+            continue
+        latencies, queries = [], []
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            db = database.SessionLocal()
+            try:
+                query_count.set([0])
+                t = time.perf_counter()
+                fn(db)
+                latencies.append(time.perf_counter() - t)
+                queries.append(query_count.get()[0])
+            finally:
+                db.close()
+        results[name] = summarize(latencies, queries, 0, time.perf_counter() - started)
+        print(f"{name}: {results[name]}", file=sys.stderr)
+    return results
+
+def compare(results: dict, baseline: dict):
+    # 以基线为 1.0 输出比值：延迟/SQL 条数 > 1 变差，吞吐 < 1 变差
+    for name, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        ratios = {key: round(current[key] / base[key], 2)
+                  for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "queries_per_request")
+                  if current.get(key) is not None and base.get(key)}
+        print(f"{name}: {ratios}", file=sys.stderr)
+
+def main():
+    if not args.skip_seed:
+        seed()
+    # 压测期间不让后台线程的写回影响计时
+    ranking.hot_ranker.interval = 3600
+    scenarios = {}
+    scenarios.update(crud_benchmarks())
+    scenarios.update(asyncio.run(http_benchmarks()))
+    results = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        "db_async": database.DB_ASYNC,
+        "fast_json": fast_json.ENABLED,
+        "timestamp": datetime.utcnow().isoformat(),
+        "scenarios": scenarios,
+    }
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+if __name__ == "__main__":
+    main()
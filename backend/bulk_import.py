@@ -0,0 +1,251 @@
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime, timezone
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from sqlalchemy import DateTime, insert, select
+from sqlalchemy.exc import IntegrityError
+import models, database, hashing, reconcile_counters, tag_crud, ranking, search_index, timeline
+from migrate import upgrade_schema
+
+# 批量导入 / 造数据：流式读取 JSONL，每行一条记录，按 type 写入对应的表
+#   {"type": "user", "id": 1, "username": "alice", "email": "a@x.com", "password": "明文"}  (或直接给 hashed_password)
+#   {"type": "post", "id": 10, "owner_id": 1, "title": "...", "content": "...", "created_at": "2020-01-01T08:00:00"}
+#   {"type": "comment", "id": 5, "post_id": 10, "owner_id": 1, "content": "...", "parent_id": null}
+#   {"type": "like", "user_id": 1, "post_id": 10}      collection 同理
+#   {"type": "follow", "follower_id": 1, "followed_id": 2}
+# 用户/帖子/评论必须带 id (沿用旧系统的主键，关联记录直接引用)，被引用的记录需出现在引用它的记录之前。
+# - 每种记录攒够 --batch-size 条后，按依赖顺序一次事务写入 (INSERT ... VALUES 多行)
+# - 明文密码在进程池中并行哈希，与登录使用同一套 pbkdf2 参数
+# - 每次提交后把已处理到的文件偏移写入状态文件，中断后重新运行同一命令即可续传；
+#   提交与写状态之间中断导致的重复行按主键冲突跳过。用户/帖子/评论冲突时会核对已有行
+#   (用户名、作者+标题、帖子+作者)，不一致说明目标库里已有无关数据占用了这个 id，
+#   继续导入会把关联记录挂到错误的行上，此时中止并回滚当前批次
+# - 带时区的时间转换为 UTC 存储 (与应用写入的 utcnow() 一致)，不带时区的按 UTC 处理
+# - 冗余计数、标签、热度分、搜索索引、关注时间线在全部导入后统一重建 (--skip-rebuild 跳过，分多次导入时最后一次再建)
+#   python bulk_import.py users.jsonl posts.jsonl relations.jsonl --batch-size 2000
+
+TABLES = {
+    "user": models.User.__table__,
+    "post": models.Post.__table__,
+    "comment": models.Comment.__table__,
+    "like": models.post_likes,
+    "collection": models.post_collections,
+    "follow": models.user_follows,
+}
+ORDER = list(TABLES) # 写入顺序 = 外键依赖顺序
+REQUIRES_ID = {"user", "post", "comment"}
+# 主键冲突时用来判断已有行是否就是这条记录 (续传重放) 的字段
+IDENTITY = {"user": ("username",), "post": ("owner_id", "title"), "comment": ("post_id", "owner_id")}
+MAX_REPORTED_ERRORS = 20
+
+class ImportConflict(Exception):
+    pass
+
+def _datetime_columns(table):
+    return {c.name for c in table.columns if isinstance(c.type, DateTime)}
+
+DATETIME_COLUMNS = {kind: _datetime_columns(table) for kind, table in TABLES.items()}
+COLUMNS = {kind: {c.name for c in table.columns} for kind, table in TABLES.items()}
+
+def parse_record(line: bytes):
+    # 返回 (类型, 行 dict)；无效记录抛出 ValueError
+    try:
+        record = json.loads(line)
+    except ValueError:
+        raise ValueError("不是合法的 JSON")
+    if not isinstance(record, dict):
+        raise ValueError("不是 JSON 对象")
+    kind = record.pop("type", None)
+    if kind not in TABLES:
+        raise ValueError(f"未知的记录类型: {kind}")
+    if kind in REQUIRES_ID and record.get("id") is None:
+        raise ValueError(f"{kind} 记录缺少 id")
+    password = record.pop("password", None) if kind == "user" else None
+    row = {k: v for k, v in record.items() if k in COLUMNS[kind]}
+    for name in DATETIME_COLUMNS[kind] & row.keys():
+        if isinstance(row[name], str):
+            value = datetime.fromisoformat(row[name].replace("Z", "+00:00"))
+            if value.tzinfo is not None:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            row[name] = value
+    if kind == "user" and not row.get("hashed_password"):
+        if not password:
+            raise ValueError("user 记录缺少 password 或 hashed_password")
+        row["_password"] = password # 提交前整批并行哈希，见 Importer._hash_passwords
+    return kind, row
+
+def _check_existing(conn, table, row, identity):
+    existing = conn.execute(select(*(table.c[name] for name in identity)).where(table.c.id == row["id"])).first()
+    if existing is None or tuple(existing) != tuple(row.get(name) for name in identity):
+        found = dict(existing._mapping) if existing is not None else "不存在 (与其它行的唯一字段冲突)"
+        raise ImportConflict(f"{table.name} id={row['id']} 无法导入：库中已有行 {found}，"
+                             f"与导入记录 {dict((name, row.get(name)) for name in identity)} 不一致")
+
+def _insert_rows(conn, table, rows, identity=None) -> int:
+    # 批量里有已存在的行 (续传时重放的最后一批、重复记录) 或引用不存在时，对半拆分重试，
+    # 只有冲突行本身被跳过；k 个坏行约需 k*log(批量) 条语句，不必整批退回逐条插入
+    try:
+        with conn.begin_nested():
+            conn.execute(insert(table), rows)
+        return len(rows)
+    except IntegrityError:
+        if len(rows) == 1:
+            if identity:
+                _check_existing(conn, table, rows[0], identity)
+            return 0
+        mid = len(rows) // 2
+        return _insert_rows(conn, table, rows[:mid], identity) + _insert_rows(conn, table, rows[mid:], identity)
+
+def _insert(conn, kind, rows) -> int:
+    # 字段不同的行不能放进同一条多行 INSERT，按字段集合分组；缺省字段交给列默认值
+    groups = defaultdict(list)
+    for row in rows:
+        groups[tuple(sorted(row))].append(row)
+    return sum(_insert_rows(conn, TABLES[kind], group, IDENTITY.get(kind)) for group in groups.values())
+
+class Importer:
+    def __init__(self, batch_size: int, hash_workers: int, state_path: str):
+        self.batch_size = batch_size
+        self.hash_workers = hash_workers
+        self.state_path = state_path
+        self.buffers = defaultdict(list)
+        self.pool = None
+        self.state = {"offsets": {}, "inserted": {}, "skipped": {}, "invalid": 0}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+        self.inserted = defaultdict(int, self.state["inserted"])
+        self.skipped = defaultdict(int, self.state["skipped"])
+        self.invalid = self.state["invalid"]
+        self.lines = 0
+        self.started = time.perf_counter()
+        self.last_report = self.started
+
+    def _hash_passwords(self, rows):
+        plain = [row for row in rows if "_password" in row]
+        if not plain:
+            return
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.hash_workers)
+        passwords = [row.pop("_password") for row in plain]
+        chunksize = max(1, len(plain) // (self.hash_workers * 4))
+        for row, hashed in zip(plain, self.pool.map(hashing.hash_password, passwords, chunksize=chunksize)):
+            row["hashed_password"] = hashed
+
+    def add(self, kind: str, row: dict) -> bool:
+        # 返回是否需要提交
+        self.buffers[kind].append(row)
+        return len(self.buffers[kind]) >= self.batch_size
+
+    def flush(self, conn, path: str, offset: int):
+        self._hash_passwords(self.buffers.get("user", ()))
+        with conn.begin():
+            for kind in ORDER:
+                rows = self.buffers.pop(kind, None)
+                if rows:
+                    count = _insert(conn, kind, rows)
+                    self.inserted[kind] += count
+                    self.skipped[kind] += len(rows) - count
+        self.state.update(inserted=self.inserted, skipped=self.skipped, invalid=self.invalid)
+        self.state["offsets"][path] = offset
+        # 先写临时文件再改名，中断时状态文件不会只写了一半
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def report(self, path: str, offset: int, size: int, force: bool = False):
+        now = time.perf_counter()
+        if not force and now - self.last_report < 5:
+            return
+        self.last_report = now
+        elapsed = now - self.started
+        counts = "，".join(f"{kind} {self.inserted[kind]}" for kind in ORDER if self.inserted[kind])
+        percent = f"{offset * 100 / size:.1f}%" if size else "-"
+        print(f"[{os.path.basename(path)} {percent}] 本次读取 {self.lines} 行 ({self.lines / elapsed:.0f} 行/秒)，"
+              f"已写入: {counts or '无'}", file=sys.stderr)
+
+    def run_file(self, conn, path: str):
+        size = os.path.getsize(path)
+        offset = self.state["offsets"].get(path, 0)
+        if offset >= size:
+            print(f"{path} 已导入完成，跳过", file=sys.stderr)
+            return
+        if offset:
+            print(f"{path} 从偏移 {offset} 处继续导入", file=sys.stderr)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                offset += len(line)
+                self.lines += 1
+                if not line.strip():
+                    continue
+                try:
+                    kind, row = parse_record(line)
+                except ValueError as e:
+                    self.invalid += 1
+                    if self.invalid <= MAX_REPORTED_ERRORS:
+                        print(f"跳过无效记录 ({path} 偏移 {offset - len(line)}): {e}", file=sys.stderr)
+                    continue
+                if self.add(kind, row):
+                    self.flush(conn, path, offset)
+                    self.report(path, offset, size)
+            self.flush(conn, path, offset)
+            self.report(path, offset, size, force=True)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+def rebuild_derived():
+    # 导入的行没有经过业务写路径，冗余数据需要全量重建
+    reconcile_counters.reconcile_counters()
+    db = database.SessionLocal()
+    try:
+        tag_crud.backfill(db)
+    finally:
+        db.close()
+    print(f"已计算 {ranking.rebuild()} 篇帖子的热度分")
+    print(f"已索引 {search_index.rebuild()} 个搜索文档")
+    print(f"已回填 {timeline.backfill()} 条关注时间线")
+
+def main():
+    parser = argparse.ArgumentParser(description="从 JSONL 批量导入用户、帖子、评论、点赞、收藏和关注")
+    parser.add_argument("files", nargs="+", help="JSONL 文件，按顺序导入")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每种记录攒够多少条提交一次")
+    parser.add_argument("--hash-workers", type=int, default=hashing.HASH_WORKERS, help="密码哈希进程数")
+    parser.add_argument("--state", default="bulk_import.state.json", help="续传状态文件")
+    parser.add_argument("--restart", action="store_true", help="忽略已有的续传状态，从头导入")
+    parser.add_argument("--skip-rebuild", action="store_true", help="不重建计数/标签/热度/搜索索引/时间线")
+    args = parser.parse_args()
+
+    if args.restart and os.path.exists(args.state):
+        os.remove(args.state)
+    upgrade_schema()
+    importer = Importer(args.batch_size, args.hash_workers, args.state)
+    try:
+        with database.engine.connect() as conn:
+            for path in args.files:
+                importer.run_file(conn, os.path.abspath(path))
+    except ImportConflict as e:
+        print(f"导入中止: {e}", file=sys.stderr)
+        print("已提交的批次保留，续传状态停在出错的批次之前；请核对目标库后再重新运行", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        importer.close()
+    elapsed = time.perf_counter() - importer.started
+    print(f"导入完成，用时 {elapsed:.1f}s")
+    for kind in ORDER:
+        if importer.inserted[kind] or importer.skipped[kind]:
+            print(f"  {kind}: 写入 {importer.inserted[kind]}，跳过 (已存在或引用无效) {importer.skipped[kind]}")
+    if importer.invalid:
+        print(f"  无效记录: {importer.invalid}")
+    if not args.skip_rebuild:
+        rebuild_derived()
+    print("全部完成。")
+
+if __name__ == "__main__":
+    main()
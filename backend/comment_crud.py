@@ -1,12 +1,80 @@
+from datetime import datetime
+from sqlalchemy import delete
 from sqlalchemy.orm import Session
-import models, schemas
+import models, schemas, crud, search_index, pagination, notification_crud
+from response_cache import response_cache
+from ranking import hot_ranker
 
-def get_comments_by_post(db: Session, post_id: int, skip: int = 0, limit: int = 100):
-    return db.query(models.Comment).filter(models.Comment.post_id == post_id).offset(skip).limit(limit).all()
+def _with_authors(query):
+    # 一次关联查询带出作者用户名和头像，不再逐条懒加载 comment.owner
+    return query.add_columns(models.User.username, models.User.avatar_url) \
+        .outerjoin(models.User, models.User.id == models.Comment.owner_id)
+
+def _hydrate(rows):
+    comments = []
+    for comment, username, avatar_url in rows:
+        comment.owner_username = username
+        comment.owner_avatar = avatar_url
+        comments.append(comment)
+    return comments
+
+def get_comments_by_post(db: Session, post_id: int, parent_id: int = None, cursor: str = None, limit: int = 50):
+    # 返回 (评论列表, 下一页游标)；parent_id 为空时列出顶层评论，否则列出该评论的回复
+    # 按 (created_at, id) 升序走 ix_comments_thread 索引翻页，热门帖子翻到任意位置代价相同
+    columns = (models.Comment.created_at, models.Comment.id)
+    query = _with_authors(db.query(models.Comment)).filter(
+        models.Comment.post_id == post_id, models.Comment.parent_id == parent_id)
+    if cursor:
+        query = query.filter(pagination.after(columns, pagination.decode_cursor(cursor, datetime, int), descending=False))
+    comments = _hydrate(query.order_by(*columns).limit(limit).all())
+    return comments, pagination.next_cursor(comments, limit, lambda c: (c.created_at, c.id))
+
+def get_comment(db: Session, comment_id: int):
+    return db.query(models.Comment).filter(models.Comment.id == comment_id).first()
 
 def create_comment(db: Session, comment: schemas.CommentCreate, user_id: int, post_id: int):
-    db_comment = models.Comment(**comment.dict(), owner_id=user_id, post_id=post_id)
+    parent_id = comment.parent_id
+    if parent_id is not None:
+        parent = db.query(models.Comment.id, models.Comment.post_id, models.Comment.parent_id, models.Comment.owner_id) \
+            .filter(models.Comment.id == parent_id).first()
+        if parent is None or parent.post_id != post_id:
+            raise ValueError("Parent comment not found")
+        # 只保留一层回复
+        parent_id = parent.parent_id or parent.id
+    post_owner_id = db.query(models.Post.owner_id).filter(models.Post.id == post_id).scalar()
+    db_comment = models.Comment(content=comment.content, owner_id=user_id, post_id=post_id, parent_id=parent_id)
     db.add(db_comment)
+    crud.bump_counter(db, models.Post, post_id, models.Post.comments_count, 1)
+    if parent_id is not None:
+        crud.bump_counter(db, models.Comment, parent_id, models.Comment.reply_count, 1)
+    db.flush()
+    search_index.index_comment(db, db_comment)
+    # 回复通知被回复的人，帖子作者另外收到评论通知 (同一人只通知一次)
+    replied_to = parent.owner_id if comment.parent_id is not None else None
+    notification_crud.notify(db, replied_to, "reply", user_id, post_id=post_id, comment_id=db_comment.id)
+    if post_owner_id != replied_to:
+        notification_crud.notify(db, post_owner_id, "comment", user_id, post_id=post_id, comment_id=db_comment.id)
     db.commit()
     db.refresh(db_comment)
-    return db_comment
+    response_cache.invalidate(f"post:{post_id}")
+    hot_ranker.mark(post_id)
+    return _hydrate(_with_authors(db.query(models.Comment)).filter(models.Comment.id == db_comment.id).all())[0]
+
+def delete_comment(db: Session, comment_id: int):
+    # 删除顶层评论时连同其回复一起删除，并同步扣减帖子评论数
+    comment = get_comment(db, comment_id)
+    if not comment:
+        return False
+    ids = [comment.id]
+    if comment.parent_id is None:
+        ids += [row.id for row in db.query(models.Comment.id).filter(models.Comment.parent_id == comment.id)]
+    else:
+        crud.bump_counter(db, models.Comment, comment.parent_id, models.Comment.reply_count, -1)
+    for doc_id in ids:
+        search_index.remove_comment(db, doc_id)
+    db.execute(delete(models.Comment).where(models.Comment.id.in_(ids)))
+    crud.bump_counter(db, models.Post, comment.post_id, models.Post.comments_count, -len(ids))
+    db.commit()
+    response_cache.invalidate(f"post:{comment.post_id}")
+    hot_ranker.mark(comment.post_id)
+    return True
@@ -1,38 +1,95 @@
-from sqlalchemy.orm import Session
-import models, schemas, auth
+from sqlalchemy import select, insert, delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+import models, schemas, auth, database, media, timeline, notification_crud, pagination
+from response_cache import response_cache
 
 def enrich_user(user, current_user_id: int = None):
     if not user: return
-    user.followers_count = len(user.followers)
-    user.following_count = len(user.following)
+    user.avatar_variants = media.variant_urls(user.avatar_url, "avatar")
+    # followers_count/following_count 是持久化列，这里只需判断当前用户是否已关注
     if current_user_id:
-        user.is_following = any(u.id == current_user_id for u in user.followers)
+        db = object_session(user)
+        user.is_following = db.query(models.user_follows.c.follower_id).filter(
+            models.user_follows.c.follower_id == current_user_id,
+            models.user_follows.c.followed_id == user.id).first() is not None
     else:
         user.is_following = False
 
+def bump_counter(db: Session, model, obj_id: int, column, delta: int):
+    # 在数据库侧原子增减计数列，避免读-改-写竞争；与调用方在同一事务中提交
+    db.query(model).filter(model.id == obj_id).update(
+        {column: column + delta}, synchronize_session=False)
+
+def toggle_link(db: Session, table, keys: dict, counters, commit: bool = True):
+    # 直接对关联表做单行存在性检查 + INSERT/DELETE，代价与已有关联数量无关
+    # counters: [(model, obj_id, column), ...]，状态真正变化时才增减
+    # 返回 (切换后的状态, 本次是否改变了状态)：状态 True 表示已建立关联；
+    # 并发请求抢先完成了同一切换时状态不变，调用方据此跳过通知等副作用
+    condition = [table.c[name] == value for name, value in keys.items()]
+    exists = db.execute(select(*table.primary_key.columns).where(*condition)).first() is not None
+    if not exists:
+        try:
+            with db.begin_nested():
+                db.execute(insert(table).values(**keys))
+        except IntegrityError:
+            # 并发双击：另一个请求已插入同一行 (主键冲突)，结果同样是"已关联"
+            if commit:
+                db.commit()
+            return True, False
+        delta = 1
+    else:
+        result = db.execute(delete(table).where(*condition))
+        if result.rowcount == 0:
+            # 并发取消：另一个请求已删除该行，计数已由对方扣减
+            if commit:
+                db.commit()
+            return False, False
+        delta = -1
+    for model, obj_id, column in counters:
+        bump_counter(db, model, obj_id, column, delta)
+    if commit:
+        db.commit()
+    return delta > 0, True
+
 def get_user(db: Session, user_id: int):
     return db.query(models.User).filter(models.User.id == user_id).first()
 
+def get_user_profile(db: Session, user_id: int, current_user_id: int = None):
+    user = get_user(db, user_id)
+    enrich_user(user, current_user_id)
+    return user
+
 def get_user_by_username(db: Session, username: str):
     return db.query(models.User).filter(models.User.username == username).first()
 
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = auth.get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, hashed_password: str = None):
+    # 路由层会先在哈希进程池里算好 hashed_password；脚本调用时这里同步计算
+    if hashed_password is None:
+        hashed_password = auth.get_password_hash(user.password)
     db_user = models.User(email=user.email, username=user.username, hashed_password=hashed_password)
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
     return db_user
 
+def update_password_hash(db: Session, user_id: int, hashed_password: str):
+    db.query(models.User).filter(models.User.id == user_id).update(
+        {models.User.hashed_password: hashed_password}, synchronize_session=False)
+    db.commit()
+
 def update_user_avatar(db: Session, user_id: int, avatar_url: str):
     db_user = get_user(db, user_id)
     if db_user:
         db_user.avatar_url = avatar_url
         db.commit()
         db.refresh(db_user)
+        auth.invalidate_principal(db_user.username)
+        # 头像也出现在帖子列表的作者信息里
+        response_cache.invalidate(f"user:{user_id}", "feed")
     return db_user
 
 def update_user_profile(db: Session, user_id: int, profile: schemas.UserUpdate):
@@ -43,21 +100,70 @@ def update_user_profile(db: Session, user_id: int, profile: schemas.UserUpdate):
             setattr(db_user, key, value)
         db.commit()
         db.refresh(db_user)
+        auth.invalidate_principal(db_user.username)
+        response_cache.invalidate(f"user:{user_id}", "feed")
+    return db_user
+
+def admin_update_user(db: Session, user_id: int, update: schemas.AdminUserUpdate):
+    # 管理员启用/停用账号或调整管理员权限，立即使认证缓存失效
+    db_user = get_user(db, user_id)
+    if db_user:
+        for key, value in update.dict(exclude_unset=True).items():
+            setattr(db_user, key, value)
+        db.commit()
+        db.refresh(db_user)
+        auth.invalidate_principal(db_user.username)
+        response_cache.invalidate(f"user:{user_id}")
     return db_user
 
-def follow_user(db: Session, follower_id: int, followed_id: int):
-    follower = get_user(db, follower_id)
-    followed = get_user(db, followed_id)
-    if follower and followed:
-        if followed not in follower.following:
-            follower.following.append(followed)
-            db.commit()
-            return True
-        else:
-            follower.following.remove(followed)
-            db.commit()
-            return False # Unfollowed
-    return None
-
-def get_all_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
+def follow_user(db: Session, follower_id: int, followed_id: int, commit: bool = True):
+    if db.query(models.User.id).filter(models.User.id == followed_id).first() is None:
+        return None
+    state, changed = toggle_link(
+        db, models.user_follows,
+        {"follower_id": follower_id, "followed_id": followed_id},
+        [(models.User, follower_id, models.User.following_count),
+         (models.User, followed_id, models.User.followers_count)],
+        commit=False,
+    )
+    if state and changed:
+        notification_crud.notify(db, followed_id, "follow", follower_id)
+    database.on_commit(db, response_cache.invalidate, f"user:{follower_id}", f"user:{followed_id}")
+    if changed:
+        # 并发请求抢先完成同一切换时，时间线任务由对方提交
+        database.on_commit(db, timeline.timeline_worker.submit, "follow" if state else "unfollow", follower_id, followed_id)
+    if commit:
+        db.commit()
+    return state # False 表示取消关注
+
+# 管理员用户列表的排序方式 -> 键集分页的列 (均以唯一列结尾，保证翻页稳定)
+USER_SORTS = {
+    "id": (models.User.id,),
+    "username": (models.User.username, models.User.id),
+}
+
+def filter_users(query, is_active: bool = None, is_superuser: bool = None, username_prefix: str = None):
+    # 管理员列表与导出共用的筛选条件；用户名前缀走 username 唯一索引的范围扫描
+    if is_active is not None:
+        query = query.filter(models.User.is_active == is_active)
+    if is_superuser is not None:
+        query = query.filter(models.User.is_superuser == is_superuser)
+    if username_prefix:
+        escaped = username_prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        query = query.filter(models.User.username.like(escaped + "%", escape="\\"))
+    return query
+
+def get_all_users(db: Session, skip: int = 0, limit: int = 100, cursor: str = None, sort: str = "id",
+                  is_active: bool = None, is_superuser: bool = None, username_prefix: str = None):
+    # 返回 (用户列表, 下一页游标)；skip 仅为兼容旧客户端保留，传 cursor 时忽略
+    columns = USER_SORTS[sort]
+    query = filter_users(db.query(models.User), is_active, is_superuser, username_prefix).order_by(*columns)
+    if cursor:
+        types = (str, int) if sort == "username" else (int,)
+        query = query.filter(pagination.after(columns, pagination.decode_cursor(cursor, *types), descending=False))
+    elif skip:
+        query = query.offset(skip)
+    users = query.limit(limit).all()
+    for user in users:
+        user.avatar_variants = media.variant_urls(user.avatar_url, "avatar")
+    return users, pagination.next_cursor(users, limit, lambda u: tuple(getattr(u, col.key) for col in columns))
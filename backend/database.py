@@ -1,7 +1,15 @@
-from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 import os
+import time
+import logging
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+from sqlalchemy.util.queue import Empty
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
 
 # 获取数据库配置，如果环境变量未设置，则使用默认值
 # 建议在生产环境中使用环境变量设置密码
@@ -10,24 +18,199 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "password123")
 DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_NAME = os.getenv("DB_NAME", "luntan")
 
-# MySQL 连接字符串
-SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}"
+# MySQL 连接字符串 (可用 DATABASE_URL 整体覆盖，例如测试时使用 sqlite:///./luntan.db)
+SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME}")
+
+# 异步模式：DB_ASYNC=1 时请求使用异步引擎 (aiomysql / aiosqlite)，
+# 同步引擎仍保留给脚本和后台线程 (如阅读量写回) 使用
+DB_ASYNC = os.getenv("DB_ASYNC", "0") == "1"
+ASYNC_DRIVERS = {"mysql+pymysql": "mysql+aiomysql", "mysql": "mysql+aiomysql", "sqlite": "sqlite+aiosqlite"}
+
+def to_async_url(url: str) -> str:
+    scheme, rest = url.split("://", 1)
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(SQLALCHEMY_DATABASE_URL))
+
+# 只读副本 (可选)：设置后 feed/资料等读接口走副本，写操作仍走主库
+SQLALCHEMY_REPLICA_URL = os.getenv("DATABASE_REPLICA_URL")
+ASYNC_REPLICA_URL = os.getenv("ASYNC_DATABASE_REPLICA_URL", to_async_url(SQLALCHEMY_REPLICA_URL) if SQLALCHEMY_REPLICA_URL else None)
+
+# 连接池配置：pool_recycle 应小于 MySQL 的 wait_timeout，pre_ping 在取出连接时检测断线
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+
+# 取连接等待时间直方图的桶上界 (秒)
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+class PoolWaitStats:
+    def __init__(self):
+        self.counts = [0] * (len(POOL_WAIT_BUCKETS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+        self.timeouts = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        index = next((i for i, bound in enumerate(POOL_WAIT_BUCKETS) if seconds <= bound), len(POOL_WAIT_BUCKETS))
+        with self._lock:
+            self.counts[index] += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counts = list(self.counts)
+            total, max_seconds, timeouts = self.total, self.max, self.timeouts
+        buckets = {str(bound): count for bound, count in zip(POOL_WAIT_BUCKETS, counts)}
+        buckets["+Inf"] = counts[-1]
+        return {"count": sum(counts), "total_seconds": total, "max_seconds": max_seconds,
+                "timeouts": timeouts, "buckets": buckets}
+
+# 额外的等待时间观察者 (如 request_metrics 按请求累计)，参数为等待秒数
+pool_wait_observers = []
+
+def timed_pool(base):
+    # 在连接池的内部队列上计时：只记录排队等待空闲连接的时间 (不含新建连接的耗时) 和等待超时次数
+    stats = PoolWaitStats()
 
-# SQLite 配置 (已注释)
-# SQLALCHEMY_DATABASE_URL = "sqlite:///./luntan.db"
+    class TimedQueue(base._queue_class):
+        def get(self, block=True, timeout=None):
+            start = time.perf_counter()
+            try:
+                return super().get(block, timeout)
+            except Empty:
+                if block:
+                    stats.timeout() # 连接池已满且等到超时，随后 _do_get 抛出 TimeoutError
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                stats.observe(elapsed)
+                for observer in pool_wait_observers:
+                    observer(elapsed)
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL
-    # SQLite 需要 check_same_thread，MySQL 不需要
-    # connect_args={"check_same_thread": False} 
-)
+    class TimedPool(base):
+        _queue_class = TimedQueue
+        wait_stats = stats
+
+    return TimedPool
+
+def engine_options(url: str, pool_base=QueuePool) -> dict:
+    if url.startswith("sqlite"):
+        # SQLite 需要 check_same_thread，MySQL 不需要
+        return {"connect_args": {"check_same_thread": False}} if "aiosqlite" not in url else {}
+    return {
+        "poolclass": timed_pool(pool_base),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+if SQLALCHEMY_REPLICA_URL:
+    replica_engine = create_engine(SQLALCHEMY_REPLICA_URL, **engine_options(SQLALCHEMY_REPLICA_URL))
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+else:
+    replica_engine = engine
+    ReplicaSessionLocal = SessionLocal
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+if DB_ASYNC:
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+    async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, AsyncAdaptedQueuePool))
+    # 提交后不过期属性，避免在事件循环里序列化 ORM 对象时触发隐式 IO
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    if ASYNC_REPLICA_URL:
+        async_replica_engine = create_async_engine(ASYNC_REPLICA_URL, **engine_options(ASYNC_REPLICA_URL, AsyncAdaptedQueuePool))
+        AsyncReplicaSessionLocal = async_sessionmaker(async_replica_engine, autoflush=False, expire_on_commit=False)
+    else:
+        async_replica_engine = async_engine
+        AsyncReplicaSessionLocal = AsyncSessionLocal
+
+    async def get_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+
+    async def get_read_db():
+        async with AsyncReplicaSessionLocal() as db:
+            yield db
+else:
+    AsyncSession = None
+
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def get_read_db():
+        # 只读接口使用：配置了副本时连副本，否则与 get_db 相同
+        db = ReplicaSessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+def pool_stats() -> dict:
+    engines = {"primary": engine}
+    if replica_engine is not engine:
+        engines["replica"] = replica_engine
+    if DB_ASYNC:
+        engines["async_primary"] = async_engine.sync_engine
+        if async_replica_engine is not async_engine:
+            engines["async_replica"] = async_replica_engine.sync_engine
+    stats = {}
+    for name, eng in engines.items():
+        pool = eng.pool
+        info = {"pool": type(pool).__name__, "status": pool.status()}
+        if isinstance(pool, QueuePool):
+            info.update({"size": pool.size(), "checked_in": pool.checkedin(),
+                         "checked_out": pool.checkedout(), "overflow": pool.overflow()})
+        wait_stats = getattr(pool, "wait_stats", None)
+        if wait_stats is not None:
+            info["wait"] = wait_stats.snapshot()
+        stats[name] = info
+    return stats
+
+def on_commit(db, fn, *args):
+    # 登记在最外层事务提交之后才执行的副作用 (响应缓存失效、热度标记、时间线任务等)：
+    # commit=False 的调用方 (/api/toggles) 最后才提交，提前失效的话其它请求可能把提交前的数据按新版本号重新缓存
+    # 事务回滚时丢弃。异步模式下 db 是 run_sync 传入的同步 Session，同样适用
+    db.info.setdefault("on_commit", []).append((fn, args))
+
+@event.listens_for(Session, "after_commit")
+def _run_on_commit(session):
+    if session.in_nested_transaction():
+        return # 释放保存点，外层事务还没有提交
+    for fn, args in session.info.pop("on_commit", ()):
+        try:
+            fn(*args)
+        except Exception:
+            # 数据已经提交，副作用失败不应让请求报错
+            logger.exception("提交后任务失败: %s", getattr(fn, "__qualname__", fn))
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_on_commit(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("on_commit", None)
+
+async def run(db, fn, *args, **kwargs):
+    # 在请求中执行同步写法的 CRUD 函数 fn(session, ...)：
+    # 异步模式下通过 AsyncSession.run_sync 在异步驱动上执行，同步模式下放到线程池执行
+    if AsyncSession is not None and isinstance(db, AsyncSession):
+        return await db.run_sync(lambda session: fn(session, *args, **kwargs))
+    return await run_in_threadpool(fn, db, *args, **kwargs)
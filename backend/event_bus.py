@@ -0,0 +1,268 @@
+import os
+import json
+import time
+import uuid
+import queue
+import socket
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# 跨 worker 的失效/事件总线：uvicorn 多 worker 部署时，每个进程都有自己的内存缓存
+# (当前用户、匿名响应缓存的命名空间版本号) 和 SSE 连接，写操作需要通知其它进程
+# - EVENT_BUS_URL 未设置：单进程，不发送任何消息
+# - unix:///run/luntan/bus：同一台机器上的 worker 通过 Unix 数据报套接字互相广播
+# - redis://host:6379/0：通过 Redis Stream 广播 (兼容 Redis 协议的服务均可)，可跨机器
+# 投递是尽力而为的，但丢失可以被发现：每条消息带 (来源进程, 序号)，各进程空闲时每隔 EVENT_BUS_HEARTBEAT 秒
+# 广播一次心跳，带上自己最后一条消息的序号。接收方发现某个来源的序号不连续 (中间或最后一条消息丢失、
+# Redis Stream 被截断、发送队列满被丢弃)，或者第一次见到的来源已经发过消息 (新启动的进程在它启动前的消息
+# 不可知) 时，调用 on_reset 注册的处理函数清空本进程的相关缓存。最后一条消息丢失最晚在一个心跳周期后被发现。
+# 处理函数必须是幂等的 (重复收到同一条消息无害)
+# 发送在总线自己的线程里进行 (publish 只入队)，不会在事件循环或请求线程里做阻塞的套接字/网络操作
+
+EVENT_BUS_URL = os.getenv("EVENT_BUS_URL")
+EVENT_BUS_HEARTBEAT = float(os.getenv("EVENT_BUS_HEARTBEAT", "5"))
+MAX_MESSAGE_BYTES = 60000
+SEND_RETRIES = 3
+SEND_QUEUE_SIZE = 10000
+HEARTBEAT = "_heartbeat"
+
+class UnixSocketTransport:
+    # 每个 worker 在目录下绑定一个数据报套接字，发送时逐个 sendto；对方已退出的残留文件顺手删除
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = None
+        self._sock = None
+        self._sender = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, origin: str, callback):
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{os.getpid()}-{origin}.sock")
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        self._sock.settimeout(1.0)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.settimeout(0.1)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(callback,), name="event-bus", daemon=True)
+        self._thread.start()
+
+    def _run(self, callback):
+        while not self._stop.is_set():
+            try:
+                data = self._sock.recv(MAX_MESSAGE_BYTES)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            callback(data)
+
+    def send(self, data: bytes):
+        if self._sender is None:
+            return
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".sock") or path == self.path:
+                continue
+            for attempt in range(SEND_RETRIES):
+                try:
+                    self._sender.sendto(data, path)
+                    break
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # 进程已退出，删除残留的套接字文件
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                    break
+                except (BlockingIOError, socket.timeout):
+                    # 对方接收缓冲区满，稍后重试；仍失败则由对方的序号检查兜底
+                    time.sleep(0.01 * (attempt + 1))
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for sock in (self._sock, self._sender):
+            if sock is not None:
+                sock.close()
+        self._sock = self._sender = None
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+class RedisStreamTransport:
+    # 用 Stream 而不是 Pub/Sub：Pub/Sub 在断线期间的消息会丢失，Stream 可以从上次读到的 id 继续
+    def __init__(self, client, stream: str = "luntan:bus", maxlen: int = 10000):
+        self.client = client
+        self.stream = stream
+        self.maxlen = maxlen
+        self.last_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, origin: str, callback):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(callback,), name="event-bus", daemon=True)
+        self._thread.start()
+
+    def _run(self, callback):
+        while not self._stop.is_set():
+            try:
+                if self.last_id is None:
+                    # 从当前末尾开始读 (启动前的消息与本进程无关)；之后断线重连从上次读到的 id 继续
+                    latest = self.client.xrevrange(self.stream, count=1)
+                    self.last_id = latest[0][0] if latest else "0-0"
+                for _, entries in self.client.xread({self.stream: self.last_id}, count=100, block=1000) or []:
+                    for entry_id, fields in entries:
+                        self.last_id = entry_id
+                        callback(fields[b"m"])
+            except Exception:
+                logger.exception("事件总线读取失败，1 秒后重试")
+                self._stop.wait(1.0)
+
+    def send(self, data: bytes):
+        self.client.xadd(self.stream, {"m": data}, maxlen=self.maxlen, approximate=True)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+class EventBus:
+    def __init__(self, transport=None, heartbeat: float = EVENT_BUS_HEARTBEAT):
+        self.transport = transport
+        self.heartbeat = heartbeat
+        self.origin = uuid.uuid4().hex[:12]
+        self._seq = 0
+        self._seq_lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=SEND_QUEUE_SIZE)
+        self._sender = None
+        self._last_seq = {}
+        self._handlers = defaultdict(list)
+        self._reset_handlers = []
+        self.published = 0
+        self.dropped = 0
+        self.received = 0
+        self.gaps = 0
+
+    def subscribe(self, channel: str, handler):
+        # handler(payload) 在总线的接收线程中执行，用于把其它进程的写操作应用到本进程
+        self._handlers[channel].append(handler)
+
+    def on_reset(self, handler):
+        # 发现消息丢失时调用 handler()，应清空本进程内依赖总线保持一致的缓存
+        self._reset_handlers.append(handler)
+
+    def publish(self, channel: str, payload: dict):
+        # 只通知其它进程；本进程的缓存由调用方自己更新。只入队，由发送线程发出
+        if self.transport is None:
+            return
+        with self._seq_lock:
+            # 序号和入队在同一把锁里，队列中的顺序就是序号顺序
+            self._seq += 1
+            try:
+                self._queue.put_nowait((self._seq, channel, payload))
+            except queue.Full:
+                # 丢弃；该序号不会被发出，接收方从后续消息或心跳发现缺口
+                self.dropped += 1
+                return
+            self.published += 1
+
+    def _send(self, seq: int, channel: str, payload):
+        data = json.dumps({"o": self.origin, "s": seq, "c": channel, "p": payload}, ensure_ascii=False).encode()
+        try:
+            self.transport.send(data)
+        except Exception:
+            # 发送失败不影响写操作本身；接收方会从序号缺口发现并清空缓存
+            logger.exception("事件总线发送失败: %s", channel)
+
+    def _send_loop(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.heartbeat)
+            except queue.Empty:
+                with self._seq_lock:
+                    # 队列为空时，已分配的序号都已发出或被丢弃，心跳里的序号不会跑到消息前面
+                    if not self._queue.empty():
+                        continue
+                    seq = self._seq
+                self._send(seq, HEARTBEAT, None)
+                continue
+            if item is None:
+                break
+            self._send(*item)
+
+    def _receive(self, data: bytes):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return
+        origin, seq = message["o"], message["s"]
+        if origin == self.origin:
+            return
+        heartbeat = message["c"] == HEARTBEAT
+        last = self._last_seq.get(origin, 0)
+        # 心跳应等于已收到的最后一个序号，消息应是下一个序号
+        expected = last if heartbeat else last + 1
+        if seq < expected:
+            return # 重复投递
+        self._last_seq[origin] = seq
+        if seq > expected:
+            self.gaps += 1
+            self._reset()
+        if heartbeat:
+            return
+        self.received += 1
+        for handler in self._handlers.get(message["c"], ()):
+            try:
+                handler(message["p"])
+            except Exception:
+                logger.exception("事件总线处理失败: %s", message["c"])
+
+    def _reset(self):
+        for handler in self._reset_handlers:
+            try:
+                handler()
+            except Exception:
+                logger.exception("事件总线重置缓存失败")
+
+    def start(self):
+        if self.transport is not None:
+            self.transport.start(self.origin, self._receive)
+            self._sender = threading.Thread(target=self._send_loop, name="event-bus-sender", daemon=True)
+            self._sender.start()
+
+    def stop(self):
+        if self.transport is not None:
+            if self._sender is not None:
+                # 发完队列里剩余的消息
+                self._queue.put(None)
+                self._sender.join()
+                self._sender = None
+            self.transport.stop()
+
+    def stats(self) -> dict:
+        return {"transport": type(self.transport).__name__ if self.transport else None, "origin": self.origin,
+                "published": self.published, "dropped": self.dropped, "queued": self._queue.qsize(),
+                "received": self.received, "gaps": self.gaps, "peers": len(self._last_seq)}
+
+def create_transport(url: str = EVENT_BUS_URL):
+    if not url:
+        return None
+    if url.startswith("unix://"):
+        return UnixSocketTransport(url[len("unix://"):])
+    if url.startswith(("redis://", "rediss://")):
+        import redis # 可选依赖，仅在使用 Redis 总线时需要
+        return RedisStreamTransport(redis.Redis.from_url(url))
+    raise ValueError(f"不支持的 EVENT_BUS_URL: {url}")
+
+bus = EventBus(create_transport())
@@ -0,0 +1,72 @@
+import os
+import io
+import csv
+from datetime import datetime
+from sqlalchemy import select
+import models, database, crud, fast_json
+
+# 管理员批量导出 (NDJSON / CSV)：用服务端游标 (yield_per → stream_results) 按固定大小分块读取，
+# 每块编码后立即写给客户端，内存占用与表大小无关。导出使用独立的只读会话，
+# 整个下载期间占用一个连接，不经过请求级会话
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+# 不导出密码哈希
+USER_EXPORT_COLUMNS = (
+    models.User.id, models.User.username, models.User.email, models.User.is_active, models.User.is_superuser,
+    models.User.followers_count, models.User.following_count,
+    models.User.bio, models.User.gender, models.User.location, models.User.website,
+)
+
+POST_EXPORT_COLUMNS = (
+    models.Post.id, models.Post.title, models.Post.content, models.Post.category, models.Post.tags,
+    models.Post.image_url, models.Post.is_original, models.Post.is_pinned, models.Post.owner_id,
+    models.User.username.label("owner_username"), models.Post.created_at,
+    models.Post.views, models.Post.likes_count, models.Post.comments_count, models.Post.collections_count,
+)
+
+def users_query(is_active: bool = None, is_superuser: bool = None, username_prefix: str = None):
+    query = select(*USER_EXPORT_COLUMNS).order_by(models.User.id)
+    return crud.filter_users(query, is_active, is_superuser, username_prefix)
+
+def posts_query(category: str = None, owner_id: int = None):
+    query = select(*POST_EXPORT_COLUMNS).outerjoin(models.User, models.User.id == models.Post.owner_id) \
+        .order_by(models.Post.id)
+    if category:
+        query = query.where(models.Post.category == category)
+    if owner_id is not None:
+        query = query.where(models.Post.owner_id == owner_id)
+    return query
+
+def _csv_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+def _encode_csv(rows) -> bytes:
+    buf = io.StringIO()
+    csv.writer(buf).writerows([_csv_value(v) for v in row] for row in rows)
+    return buf.getvalue().encode()
+
+def _encode_ndjson(fields, rows) -> bytes:
+    return b"".join(fast_json.dumps(dict(zip(fields, row))) + b"\n" for row in rows)
+
+def stream(query, format: str = "ndjson", chunk_size: int = EXPORT_CHUNK_SIZE):
+    # 同步生成器，StreamingResponse 会在线程池中逐块迭代
+    db = database.ReplicaSessionLocal()
+    try:
+        result = db.execute(query.execution_options(yield_per=chunk_size))
+        fields = list(result.keys())
+        if format == "csv":
+            # 带 BOM，Excel 直接打开时中文不乱码
+            yield "\ufeff".encode() + _encode_csv([fields])
+        for rows in result.partitions():
+            yield _encode_csv(rows) if format == "csv" else _encode_ndjson(fields, rows)
+    finally:
+        db.close()
+
+def filename(name: str, format: str) -> str:
+    return f"{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{format}"
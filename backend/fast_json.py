@@ -0,0 +1,54 @@
+import os
+import json
+from datetime import datetime
+from fastapi import Response
+
+# 热点列表接口的快速序列化：CRUD 层直接查询列、拼成与 response_model 字段顺序一致的 dict，
+# 这里编码成 JSON 字节，跳过逐个 ORM 对象的 Pydantic 校验。FAST_JSON=1 时启用；
+# 有 orjson 时用 orjson，否则退回标准库 json (输出与 Pydantic 逐字节一致，只是慢一些)
+# 与 Pydantic 输出的一致性由 tests/test_fast_json.py 逐字节校验 (bench.py --parity 可对线上数据再核对一遍)
+
+ENABLED = os.getenv("FAST_JSON", "0") == "1"
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), default=_default).encode()
+
+def response(value) -> Response:
+    return Response(content=dumps(value), media_type="application/json")
+
+def diff(expected: bytes, actual: bytes) -> list:
+    # 逐字段比较两份 JSON 输出，返回不一致的位置，如 ["[3].owner_avatar: 'a.png' != None"]
+    problems = []
+
+    def walk(path, a, b):
+        if type(a) is not type(b):
+            problems.append(f"{path}: {a!r} != {b!r}")
+        elif isinstance(a, dict):
+            if list(a) != list(b):
+                problems.append(f"{path}: 字段 {list(a)} != {list(b)}")
+            for key in a.keys() & b.keys():
+                walk(f"{path}.{key}", a[key], b[key])
+        elif isinstance(a, list):
+            if len(a) != len(b):
+                problems.append(f"{path}: 长度 {len(a)} != {len(b)}")
+            for i, (x, y) in enumerate(zip(a, b)):
+                walk(f"{path}[{i}]", x, y)
+        elif a != b:
+            problems.append(f"{path}: {a!r} != {b!r}")
+
+    walk("", json.loads(expected), json.loads(actual))
+    if not problems and expected != actual:
+        problems.append("字段一致但字节不同 (编码差异)")
+    return problems
@@ -0,0 +1,91 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from passlib.context import CryptContext
+from process_pool import mp_context
+
+# 密码哈希放在独立的进程池里执行，登录/注册高峰不再占满请求线程池、拖慢其他接口
+# 本模块不依赖数据库，工作进程 (forkserver/spawn 启动，见 process_pool.py) 只需导入 passlib
+
+# pbkdf2 迭代次数；修改后旧哈希会在用户下次登录时自动按新次数重新计算
+PBKDF2_ROUNDS = int(os.getenv("PBKDF2_ROUNDS", "29000"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2)))
+# 同时在进程池中执行的任务数，以及允许排队等待的任务数上限
+HASH_CONCURRENCY = int(os.getenv("HASH_CONCURRENCY", str(HASH_WORKERS)))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "200"))
+
+# 使用 pbkdf2_sha256 替代 bcrypt，避免长度限制和依赖问题
+# min/max 与 default 相同，迭代次数不一致的哈希都会被判定为需要更新
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"], deprecated="auto",
+    pbkdf2_sha256__default_rounds=PBKDF2_ROUNDS,
+    pbkdf2_sha256__min_rounds=PBKDF2_ROUNDS,
+    pbkdf2_sha256__max_rounds=PBKDF2_ROUNDS,
+)
+
+class HashQueueFull(Exception):
+    pass
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def verify_and_update(password: str, hashed_password: str):
+    # 返回 (是否匹配, 新哈希或 None)
+    if not hashed_password:
+        return False, None
+    return pwd_context.verify_and_update(password, hashed_password)
+
+_pool = None
+_semaphore = None
+stats = {"submitted": 0, "completed": 0, "rejected": 0, "active": 0, "waiting": 0,
+         "wait_seconds_total": 0.0, "wait_seconds_max": 0.0, "run_seconds_total": 0.0}
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=HASH_WORKERS, mp_context=mp_context())
+    return _pool
+
+async def _submit(fn, *args):
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(HASH_CONCURRENCY)
+    if stats["waiting"] >= HASH_MAX_QUEUE:
+        stats["rejected"] += 1
+        raise HashQueueFull()
+    stats["submitted"] += 1
+    stats["waiting"] += 1
+    queued_at = time.perf_counter()
+    try:
+        await _semaphore.acquire()
+    finally:
+        stats["waiting"] -= 1
+    waited = time.perf_counter() - queued_at
+    stats["wait_seconds_total"] += waited
+    stats["wait_seconds_max"] = max(stats["wait_seconds_max"], waited)
+    stats["active"] += 1
+    started_at = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_get_pool(), fn, *args)
+    finally:
+        stats["active"] -= 1
+        stats["completed"] += 1
+        stats["run_seconds_total"] += time.perf_counter() - started_at
+        _semaphore.release()
+
+async def hash_password_async(password: str) -> str:
+    return await _submit(hash_password, password)
+
+async def verify_and_update_async(password: str, hashed_password: str):
+    return await _submit(verify_and_update, password, hashed_password)
+
+def pool_stats() -> dict:
+    return {"workers": HASH_WORKERS, "concurrency": HASH_CONCURRENCY, "max_queue": HASH_MAX_QUEUE,
+            "rounds": PBKDF2_ROUNDS, **stats}
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
@@ -1,26 +1,54 @@
 import os
-import shutil
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
-from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from datetime import timedelta
 from typing import Optional
-import models, schemas, database, auth, crud, post_crud, comment_crud
+from pydantic import TypeAdapter
+import models, schemas, database, auth, crud, post_crud, comment_crud, toggle_crud, pagination, hashing, uploads, media, search_index, tag_crud, timeline, ranking, request_metrics, fast_json, notifications, notification_crud, event_bus, export, admission
+from view_counter import view_counter
+from response_cache import response_cache, to_response
 
 # 创建数据库表
 models.Base.metadata.create_all(bind=database.engine)
 
 # 确保上传目录存在
-UPLOAD_DIR = "uploads"
+UPLOAD_DIR = uploads.UPLOAD_DIR
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    view_counter.start()
+    timeline.timeline_worker.start()
+    ranking.hot_ranker.start()
+    notifications.broker.start()
+    event_bus.bus.start()
+    yield
+    # 关闭前把内存中的阅读量写回数据库
+    notifications.broker.stop()
+    view_counter.stop()
+    ranking.hot_ranker.stop()
+    timeline.timeline_worker.stop()
+    # 最后停止总线，上面最后一次写回触发的失效仍能广播出去
+    event_bus.bus.stop()
+    hashing.shutdown()
+    media.shutdown()
 
-# 挂载静态文件目录，用于访问上传的图片
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app = FastAPI(lifespan=lifespan)
+
+# 挂载静态文件目录，用于访问上传的图片 (内容寻址文件带长期缓存头，缩略图缺失时回退原图)
+app.mount("/uploads", media.MediaFiles(directory=UPLOAD_DIR), name="uploads")
+
+# 准入控制 (ADMISSION_CONTROL=1 时启用)，放在 CORS 之内，被拒绝的响应也带 CORS 头
+admission.install(app)
+
+# 上传大小限制：在读取请求体之前/过程中拒绝超大上传
+uploads.install(app)
 
 # 配置 CORS
 origins = [
@@ -34,8 +62,48 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing"],
 )
 
+# 请求级 SQL/耗时埋点 (REQUEST_METRICS=1 时启用)
+request_metrics.install(app)
+
+# 匿名响应缓存使用的序列化器，输出与 response_model 一致
+POST_LIST_JSON = TypeAdapter(list[schemas.Post])
+POST_JSON = TypeAdapter(schemas.Post)
+USER_JSON = TypeAdapter(schemas.User)
+
+def dump_json(adapter: TypeAdapter, value) -> bytes:
+    return request_metrics.time_serialization(lambda: adapter.dump_json(adapter.validate_python(value, from_attributes=True)))
+
+def set_next_cursor(response: Response, cursor: Optional[str]):
+    # 列表接口仍返回数组以兼容旧客户端，下一页游标放在响应头里
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+
+def post_list_response(response: Response, posts, next_cursor: Optional[str]):
+    # FAST_JSON 时 posts 已是按 schemas.Post 字段排好的 dict，直接编码成原始响应，跳过 response_model 校验
+    if fast_json.ENABLED:
+        response = request_metrics.time_serialization(fast_json.response, posts)
+        set_next_cursor(response, next_cursor)
+        return response
+    set_next_cursor(response, next_cursor)
+    return posts
+
+def cached_response(request: Request, cache_key: str) -> Optional[Response]:
+    # 匿名读：命中缓存直接返回；被准入控制降级时退回旧版本缓存，连旧版本也没有则 503
+    entry = response_cache.get(cache_key)
+    if entry is None and admission.shedding(request):
+        entry = response_cache.get_stale(cache_key)
+        if entry is None:
+            raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": str(admission.RETRY_AFTER_BUSY)})
+    return to_response(request, entry) if entry else None
+
+def dump_post_list(posts) -> bytes:
+    if fast_json.ENABLED:
+        return request_metrics.time_serialization(fast_json.dumps, posts)
+    return dump_json(POST_LIST_JSON, posts)
+
 @app.get("/")
 def read_root():
     return {"message": "Hello from FastAPI backend!"}
@@ -54,25 +122,39 @@ def get_info():
 
 # --- 认证路由 ---
 
+async def run_hash(coro):
+    # 哈希队列已满时快速失败，而不是让请求无限排队
+    try:
+        return await coro
+    except hashing.HashQueueFull:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+
 @app.post("/api/register", response_model=schemas.User)
-def register_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
-    db_user = crud.get_user_by_username(db, username=user.username)
+async def register_user(user: schemas.UserCreate, db: Session = Depends(database.get_db)):
+    db_user = await database.run(db, crud.get_user_by_username, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    db_email = crud.get_user_by_email(db, email=user.email)
+    db_email = await database.run(db, crud.get_user_by_email, email=user.email)
     if db_email:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    hashed_password = await run_hash(hashing.hash_password_async(user.password))
+    return await database.run(db, crud.create_user, user=user, hashed_password=hashed_password)
 
 @app.post("/api/token", response_model=schemas.Token)
-def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
-    user = crud.get_user_by_username(db, username=form_data.username)
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(database.get_db)):
+    user = await database.run(db, crud.get_user_by_username, username=form_data.username)
+    verified, new_hash = False, None
+    if user:
+        verified, new_hash = await run_hash(hashing.verify_and_update_async(form_data.password, user.hashed_password))
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if new_hash:
+        # 迭代次数配置变化后，登录成功时透明地重新哈希
+        await database.run(db, crud.update_password_hash, user.id, new_hash)
     access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -80,110 +162,429 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db:
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/api/users/me", response_model=schemas.User)
-def read_users_me(current_user: schemas.User = Depends(auth.get_current_user)):
-    crud.enrich_user(current_user, current_user.id)
-    return current_user
+async def read_users_me(current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    return await database.run(db, crud.get_user_profile, current_user.id, current_user.id)
 
 @app.put("/api/users/me", response_model=schemas.User)
-def update_profile(profile: schemas.UserUpdate, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    updated_user = crud.update_user_profile(db, current_user.id, profile)
-    crud.enrich_user(updated_user, current_user.id)
-    return updated_user
+async def update_profile(profile: schemas.UserUpdate, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    await database.run(db, crud.update_user_profile, current_user.id, profile)
+    return await database.run(db, crud.get_user_profile, current_user.id, current_user.id)
 
 @app.put("/api/users/me/avatar", response_model=schemas.User)
-def update_avatar(avatar_url: str, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    return crud.update_user_avatar(db, current_user.id, avatar_url)
+async def update_avatar(avatar_url: str, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    await database.run(db, crud.update_user_avatar, current_user.id, avatar_url)
+    uploads.ensure_variants(avatar_url, "avatar")
+    return await database.run(db, crud.get_user_profile, current_user.id, current_user.id)
 
 @app.get("/api/users/me/posts", response_model=list[schemas.Post])
-def read_my_posts(current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    return post_crud.get_posts_by_user(db, current_user.id, current_user.id)
+async def read_my_posts(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=pagination.MAX_PAGE_SIZE),
+    current_user: schemas.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_read_db)
+):
+    try:
+        posts, next_cursor = await database.run(db, post_crud.get_posts_by_user, current_user.id, current_user.id, cursor=cursor, limit=limit, as_rows=fast_json.ENABLED)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return post_list_response(response, posts, next_cursor)
 
 @app.get("/api/users/{user_id}", response_model=schemas.User)
-def read_user_profile(user_id: int, current_user: Optional[schemas.User] = Depends(auth.get_current_user_optional), db: Session = Depends(database.get_db)):
-    user = crud.get_user(db, user_id)
+async def read_user_profile(user_id: int, request: Request, current_user: Optional[schemas.User] = Depends(auth.get_current_user_optional), db: Session = Depends(database.get_read_db)):
+    if current_user is None:
+        cache_key = response_cache.make_key("user", [f"user:{user_id}"], id=user_id)
+        cached = cached_response(request, cache_key)
+        if cached:
+            return cached
+    current_user_id = current_user.id if current_user else None
+    user = await database.run(db, crud.get_user_profile, user_id, current_user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    current_user_id = current_user.id if current_user else None
-    crud.enrich_user(user, current_user_id)
+    if current_user is None:
+        return to_response(request, response_cache.store(cache_key, dump_json(USER_JSON, user)))
     return user
 
 @app.post("/api/users/{user_id}/follow")
-def follow_user(user_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+async def follow_user(user_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
     if user_id == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot follow yourself")
-    is_following = crud.follow_user(db, current_user.id, user_id)
+    is_following = await database.run(db, crud.follow_user, current_user.id, user_id)
     if is_following is None:
         raise HTTPException(status_code=404, detail="User not found")
     return {"is_following": is_following}
 
 # --- 管理员路由 ---
 @app.get("/api/admin/users", response_model=list[schemas.User])
-def get_all_users(current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+async def get_all_users(
+    response: Response,
+    skip: int = 0,
+    limit: int = Query(100, ge=1, le=pagination.MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    sort: str = Query("id", pattern="^(id|username)$"),
+    is_active: Optional[bool] = None,
+    is_superuser: Optional[bool] = None,
+    username_prefix: Optional[str] = Query(None, max_length=255),
+    current_user: schemas.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_read_db)
+):
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    try:
+        users, next_cursor = await database.run(db, crud.get_all_users, skip=skip, limit=limit, cursor=cursor, sort=sort,
+                                                is_active=is_active, is_superuser=is_superuser, username_prefix=username_prefix)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    set_next_cursor(response, next_cursor)
+    return users
+
+def export_response(name: str, query, format: str) -> StreamingResponse:
+    return StreamingResponse(export.stream(query, format), media_type=export.FORMATS[format],
+                             headers={"Content-Disposition": f'attachment; filename="{export.filename(name, format)}"'})
+
+@app.get("/api/admin/export/users")
+async def export_users(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    is_active: Optional[bool] = None,
+    is_superuser: Optional[bool] = None,
+    username_prefix: Optional[str] = Query(None, max_length=255),
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return export_response("users", export.users_query(is_active, is_superuser, username_prefix), format)
+
+@app.get("/api/admin/export/posts")
+async def export_posts(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    category: Optional[str] = None,
+    owner_id: Optional[int] = None,
+    current_user: schemas.User = Depends(auth.get_current_user)
+):
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return export_response("posts", export.posts_query(category, owner_id), format)
+
+@app.put("/api/admin/users/{user_id}", response_model=schemas.User)
+async def admin_update_user(user_id: int, update: schemas.AdminUserUpdate, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    user = await database.run(db, crud.admin_update_user, user_id, update)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return await database.run(db, crud.get_user_profile, user_id, current_user.id)
+
+@app.get("/api/admin/auth-cache")
+async def auth_cache_stats(current_user: schemas.User = Depends(auth.get_current_user)):
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return auth.auth_cache_stats()
+
+@app.get("/api/admin/hash-pool")
+async def hash_pool_stats(current_user: schemas.User = Depends(auth.get_current_user)):
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return hashing.pool_stats()
+
+@app.get("/api/admin/response-cache")
+async def response_cache_stats(current_user: schemas.User = Depends(auth.get_current_user)):
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return response_cache.stats()
+
+@app.get("/api/admin/notifications")
+async def notification_broker_stats(current_user: schemas.User = Depends(auth.get_current_user)):
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return notifications.broker.stats()
+
+@app.get("/api/admin/event-bus")
+async def event_bus_stats(current_user: schemas.User = Depends(auth.get_current_user)):
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return event_bus.bus.stats()
+
+@app.get("/api/admin/admission")
+async def admission_stats(current_user: schemas.User = Depends(auth.get_current_user)):
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return admission.controller.stats()
+
+@app.get("/api/admin/db-pool")
+async def db_pool_stats(current_user: schemas.User = Depends(auth.get_current_user)):
     if not current_user.is_superuser:
         raise HTTPException(status_code=403, detail="Not authorized")
-    return crud.get_all_users(db)
+    return database.pool_stats()
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus 抓取端点，不要对公网开放 (Nginx 中只允许内网访问)
+    return PlainTextResponse(request_metrics.registry.render() + admission.controller.render(), media_type="text/plain; version=0.0.4")
 
 # --- 文件上传 ---
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
-    file_location = f"{UPLOAD_DIR}/{file.filename}"
-    with open(file_location, "wb+") as file_object:
-        shutil.copyfileobj(file.file, file_object)
-    # 返回相对路径，假设前端通过 /uploads/filename 访问
+async def upload_file(file: UploadFile = File(...), kind: str = Query("post", pattern="^(post|avatar)$")):
+    # 分块写入在线程池中完成，不阻塞事件循环；按内容哈希存储，重复上传自动去重
+    # kind 决定生成哪些派生版本：post (帖子配图) 或 avatar (头像)
+    try:
+        url = await uploads.save_upload(file, kind)
+    except uploads.UploadTooLarge:
+        raise HTTPException(status_code=413, detail=f"File too large (max {uploads.MAX_UPLOAD_BYTES} bytes)")
+    # 返回相对路径，前端通过 /uploads/... 访问
     # 注意：生产环境应使用完整的 URL 或 CDN
-    return {"url": f"/uploads/{file.filename}"}
+    return {"url": url}
 
 # --- 帖子路由 ---
 
 @app.post("/api/posts/", response_model=schemas.Post)
-def create_post(
+async def create_post(
     post: schemas.PostCreate,
     db: Session = Depends(database.get_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    return post_crud.create_user_post(db=db, post=post, user_id=current_user.id)
+    return await database.run(db, post_crud.create_user_post, post=post, user_id=current_user.id)
 
 @app.get("/api/posts/", response_model=list[schemas.Post])
-def read_posts(
+async def read_posts(
+    request: Request,
+    response: Response,
     skip: int = 0, 
-    limit: int = 100, 
+    limit: int = Query(100, ge=1, le=pagination.MAX_PAGE_SIZE),
     category: Optional[str] = None,
+    cursor: Optional[str] = None,
+    sort: str = Query("new", pattern="^(new|hot)$"),
     current_user: Optional[schemas.User] = Depends(auth.get_current_user_optional),
-    db: Session = Depends(database.get_db)
+    db: Session = Depends(database.get_read_db)
 ):
+    if current_user is None:
+        cache_key = response_cache.make_key("posts", ["feed", "hot"] if sort == "hot" else ["feed"], skip=skip, limit=limit, category=category, cursor=cursor, sort=sort)
+        cached = cached_response(request, cache_key)
+        if cached:
+            return cached
     current_user_id = current_user.id if current_user else None
-    posts = post_crud.get_posts(db, skip=skip, limit=limit, current_user_id=current_user_id, category=category)
-    return posts
+    try:
+        if sort == "hot":
+            posts, next_cursor = await database.run(db, post_crud.get_hot_posts, limit=limit, current_user_id=current_user_id, category=category, cursor=cursor, as_rows=fast_json.ENABLED)
+        else:
+            posts, next_cursor = await database.run(db, post_crud.get_posts, skip=skip, limit=limit, current_user_id=current_user_id, category=category, cursor=cursor, as_rows=fast_json.ENABLED)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if current_user is None:
+        return to_response(request, response_cache.store(cache_key, dump_post_list(posts), next_cursor))
+    return post_list_response(response, posts, next_cursor)
 
 @app.get("/api/posts/{post_id}", response_model=schemas.Post)
-def read_post(post_id: int, current_user: Optional[schemas.User] = Depends(auth.get_current_user_optional), db: Session = Depends(database.get_db)):
+async def read_post(post_id: int, request: Request, current_user: Optional[schemas.User] = Depends(auth.get_current_user_optional), db: Session = Depends(database.get_read_db)):
+    if current_user is None:
+        cache_key = response_cache.make_key("post", [f"post:{post_id}"], id=post_id)
+        cached = cached_response(request, cache_key)
+        if cached:
+            # 命中缓存也要计入阅读量
+            view_counter.incr(post_id)
+            return cached
     current_user_id = current_user.id if current_user else None
-    post = post_crud.get_post(db, post_id, current_user_id)
+    post = await database.run(db, post_crud.get_post, post_id, current_user_id)
     if post is None:
         raise HTTPException(status_code=404, detail="Post not found")
+    if current_user is None:
+        return to_response(request, response_cache.store(cache_key, dump_json(POST_JSON, post)))
     return post
 
+# --- 评论 ---
+
+@app.get("/api/posts/{post_id}/comments/", response_model=list[schemas.Comment])
+async def read_comments(
+    post_id: int,
+    response: Response,
+    parent_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=pagination.MAX_PAGE_SIZE),
+    db: Session = Depends(database.get_read_db)
+):
+    try:
+        comments, next_cursor = await database.run(db, comment_crud.get_comments_by_post, post_id, parent_id=parent_id, cursor=cursor, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    set_next_cursor(response, next_cursor)
+    return comments
+
+@app.post("/api/posts/{post_id}/comments/", response_model=schemas.Comment)
+async def create_comment(
+    post_id: int,
+    comment: schemas.CommentCreate,
+    current_user: schemas.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    if not await database.run(db, post_crud.get_post_owner, post_id):
+        raise HTTPException(status_code=404, detail="Post not found")
+    try:
+        return await database.run(db, comment_crud.create_comment, comment, current_user.id, post_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.delete("/api/comments/{comment_id}")
+async def delete_comment(
+    comment_id: int,
+    current_user: schemas.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    comment = await database.run(db, comment_crud.get_comment, comment_id)
+    if not comment:
+        raise HTTPException(status_code=404, detail="Comment not found")
+    # 评论作者、帖子作者或管理员可以删除
+    post = await database.run(db, post_crud.get_post_owner, comment.post_id)
+    if comment.owner_id != current_user.id and not current_user.is_superuser and (not post or post.owner_id != current_user.id):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    await database.run(db, comment_crud.delete_comment, comment_id)
+    return {"message": "Comment deleted"}
+
+# --- 关注动态 ---
+
+@app.get("/api/feed/following", response_model=list[schemas.Post])
+async def read_following_feed(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=pagination.MAX_PAGE_SIZE),
+    current_user: schemas.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_read_db)
+):
+    try:
+        posts, next_cursor = await database.run(db, post_crud.get_following_feed, current_user.id, cursor=cursor, limit=limit, as_rows=fast_json.ENABLED)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return post_list_response(response, posts, next_cursor)
+
+# --- 通知 ---
+
+@app.get("/api/notifications", response_model=list[schemas.Notification])
+async def read_notifications(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=pagination.MAX_PAGE_SIZE),
+    current_user: schemas.User = Depends(auth.get_current_user),
+    db: Session = Depends(database.get_db)
+):
+    try:
+        items, next_cursor = await database.run(db, notification_crud.get_notifications, current_user.id, cursor=cursor, limit=limit)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    set_next_cursor(response, next_cursor)
+    return items
+
+@app.post("/api/notifications/read")
+async def mark_notifications_read(body: schemas.NotificationRead, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    unread = await database.run(db, notification_crud.mark_read, current_user.id, body.up_to_id)
+    return {"unread": unread}
+
+def with_session(fn, *args):
+    # 长连接接口不能在整个连接期间占用请求级会话，每次查询单独借一个连接
+    db = database.SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+@app.get("/api/notifications/stream")
+async def notification_stream(request: Request, token: Optional[str] = None, last_event_id: Optional[int] = None):
+    # Server-Sent Events。浏览器的 EventSource 不能带 Authorization 头，token 可放在查询参数里；
+    # 断线重连时浏览器自动带上 Last-Event-ID，从该 id 之后补发
+    header = request.headers.get("authorization", "")
+    token = token or (header[7:] if header.lower().startswith("bearer ") else None)
+    username = auth.decode_token_subject(token) if token else None
+    if username is None:
+        raise HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
+    principal = auth.principal_cache.get(username) or await run_in_threadpool(with_session, auth.query_principal, username)
+    if principal is None or not principal.is_active:
+        raise HTTPException(status_code=401, detail="Could not validate credentials")
+
+    resume = request.headers.get("last-event-id")
+    if resume is not None:
+        try:
+            last_event_id = int(resume)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    if last_event_id is None:
+        # 新连接只推送之后的通知，历史通知通过 /api/notifications 查询
+        last_event_id = await run_in_threadpool(with_session, notification_crud.get_latest_id, principal.id)
+
+    async def load_since(last_id: int, limit: int):
+        return await run_in_threadpool(with_session, notification_crud.get_since, principal.id, last_id, limit)
+
+    async def load_unread(up_to_id: int):
+        return await run_in_threadpool(with_session, notification_crud.unread_count, principal.id, up_to_id)
+
+    return StreamingResponse(
+        notifications.stream(principal.id, last_event_id, load_since, request.is_disconnected, load_unread),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# --- 标签 ---
+
+@app.get("/api/tags/popular", response_model=list[schemas.TagCount])
+async def popular_tags(limit: int = Query(20, ge=1, le=tag_crud.POPULAR_TAGS_LIMIT), db: Session = Depends(database.get_read_db)):
+    return await database.run(db, tag_crud.get_popular_tags, limit)
+
+@app.get("/api/tags/{tag}/posts", response_model=list[schemas.Post])
+async def read_tag_posts(
+    tag: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=pagination.MAX_PAGE_SIZE),
+    current_user: Optional[schemas.User] = Depends(auth.get_current_user_optional),
+    db: Session = Depends(database.get_read_db)
+):
+    current_user_id = current_user.id if current_user else None
+    try:
+        posts, next_cursor = await database.run(db, post_crud.get_posts_by_tag, tag, current_user_id, cursor=cursor, limit=limit, as_rows=fast_json.ENABLED)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if posts is None:
+        raise HTTPException(status_code=404, detail="Tag not found")
+    return post_list_response(response, posts, next_cursor)
+
+# --- 搜索 ---
+
+@app.get("/api/search", response_model=list[schemas.SearchHit])
+async def search(
+    q: str = Query(..., min_length=1, max_length=100),
+    type: Optional[str] = Query(None, pattern="^(post|comment)$"),
+    limit: int = Query(20, ge=1, le=50),
+    offset: int = Query(0, ge=0, le=1000),
+    db: Session = Depends(database.get_read_db)
+):
+    return await database.run(db, search_index.search, q, doc_type=type, limit=limit, offset=offset)
+
 @app.post("/api/posts/{post_id}/like")
-def like_post(post_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    result = post_crud.like_post(db, post_id, current_user.id)
+async def like_post(post_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    result = await database.run(db, post_crud.like_post, post_id, current_user.id)
     if result is None:
         raise HTTPException(status_code=404, detail="Post not found")
     return {"is_liked": result}
 
 @app.post("/api/posts/{post_id}/collect")
-def collect_post(post_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
-    result = post_crud.collect_post(db, post_id, current_user.id)
+async def collect_post(post_id: int, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    result = await database.run(db, post_crud.collect_post, post_id, current_user.id)
     if result is None:
         raise HTTPException(status_code=404, detail="Post not found")
     return {"is_collected": result}
 
+# 批量切换点赞/收藏/关注，单次最多 MAX_TOGGLE_BATCH 个操作
+MAX_TOGGLE_BATCH = 100
+
+@app.post("/api/toggles", response_model=list[schemas.ToggleResult])
+async def batch_toggle(batch: schemas.ToggleBatch, current_user: schemas.User = Depends(auth.get_current_user), db: Session = Depends(database.get_db)):
+    if len(batch.actions) > MAX_TOGGLE_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_TOGGLE_BATCH} actions per batch")
+    return await database.run(db, toggle_crud.apply_toggles, batch.actions, current_user.id)
+
 @app.delete("/api/posts/{post_id}")
-def delete_post(
+async def delete_post(
     post_id: int, 
     db: Session = Depends(database.get_db),
     current_user: schemas.User = Depends(auth.get_current_user)
 ):
-    post = db.query(models.Post).filter(models.Post.id == post_id).first()
+    post = await database.run(db, post_crud.get_post_owner, post_id)
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
@@ -191,5 +592,5 @@ def delete_post(
     if post.owner_id != current_user.id and not current_user.is_superuser:
         raise HTTPException(status_code=403, detail="Not authorized")
         
-    post_crud.delete_post(db, post_id)
+    await database.run(db, post_crud.delete_post, post_id)
     return {"message": "Post deleted"}
@@ -0,0 +1,157 @@
+import os
+import re
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from starlette.staticfiles import StaticFiles
+from process_pool import mp_context
+
+try:
+    from PIL import Image, ImageOps
+except ImportError: # Pillow 未安装时只提供原图，不生成缩略图
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# 上传图片的派生版本：上传完成后由后台进程池生成，统一转码为 WebP
+# 名称 -> (最大宽, 最大高, 是否裁剪为正方形)
+VARIANTS = {
+    "thumb": (640, 640, False),   # 首页 feed 预览
+    "large": (1600, 1600, False), # 帖子详情大图
+    "avatar": (200, 200, True),   # 个人主页头像
+    "avatar_sm": (64, 64, True),  # 列表/评论里的小头像
+}
+# 每种用途只生成页面会用到的版本 (头像不需要 1600px 大图，帖子配图不需要正方形裁剪)
+KINDS = {
+    "post": ("thumb", "large"),
+    "avatar": ("avatar", "avatar_sm"),
+}
+WEBP_QUALITY = int(os.getenv("WEBP_QUALITY", "80"))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+
+# 内容寻址的原图路径：/uploads/ab/cd/<sha256>.<ext>
+CONTENT_URL = re.compile(r"^/uploads/([0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64})(\.[a-z0-9]{1,8})?$")
+VARIANT_PATH = re.compile(r"^([0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64})\.([a-z_]+)\.webp$")
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tif", ".tiff"}
+
+def image_path(url: str):
+    # 内容寻址的图片 URL -> 相对 upload_dir 的路径；旧的非内容寻址上传或非图片文件返回 None
+    match = CONTENT_URL.match(url or "")
+    if not match or match.group(2) not in IMAGE_EXTENSIONS:
+        return None
+    return match.group(1) + match.group(2)
+
+def variant_urls(url: str, kind: str):
+    # 由原图 URL 推导该用途各派生版本的 URL
+    rel = image_path(url)
+    if rel is None:
+        return None
+    stem = os.path.splitext(rel)[0]
+    return {name: f"/uploads/{stem}.{name}.webp" for name in KINDS[kind]}
+
+def missing_variants(upload_dir: str, rel: str, kind: str):
+    stem = os.path.join(upload_dir, os.path.splitext(rel)[0])
+    return [name for name in KINDS[kind] if not os.path.exists(f"{stem}.{name}.webp")]
+
+def generate_variants(upload_dir: str, rel: str, names) -> int:
+    # 在工作进程中执行；非图片文件直接跳过
+    if Image is None or not names:
+        return 0
+    source = os.path.join(upload_dir, rel)
+    stem = os.path.join(upload_dir, os.path.splitext(rel)[0])
+    try:
+        with Image.open(source) as original:
+            original = ImageOps.exif_transpose(original)
+            original.load()
+    except Exception:
+        return 0
+    if original.mode not in ("RGB", "RGBA"):
+        original = original.convert("RGBA" if "transparency" in original.info else "RGB")
+    created = 0
+    for name in names:
+        width, height, square = VARIANTS[name]
+        target = f"{stem}.{name}.webp"
+        if os.path.exists(target):
+            continue
+        if square:
+            image = ImageOps.fit(original, (width, height), Image.LANCZOS)
+        else:
+            image = original.copy()
+            image.thumbnail((width, height), Image.LANCZOS)
+        # 同一图片可能被并发提交两次，临时文件按进程区分
+        tmp = f"{target}.{os.getpid()}.tmp"
+        image.save(tmp, "WEBP", quality=WEBP_QUALITY, method=4)
+        os.replace(tmp, target)
+        created += 1
+    return created
+
+_pool = None
+
+def submit(upload_dir: str, rel: str, kind: str):
+    # 只提交该用途还缺少的版本；同一内容被用作不同用途 (配图又设为头像) 时补生成对应版本
+    global _pool
+    if Image is None or os.path.splitext(rel)[1] not in IMAGE_EXTENSIONS:
+        return None
+    names = missing_variants(upload_dir, rel, kind)
+    if not names:
+        return None
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=mp_context())
+    future = _pool.submit(generate_variants, upload_dir, rel, names)
+    future.add_done_callback(_log_failure)
+    return future
+
+def _log_failure(future):
+    if future.exception() is not None:
+        logger.error("生成图片派生版本失败", exc_info=future.exception())
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True)
+        _pool = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+class MediaFiles(StaticFiles):
+    # /uploads 静态目录：内容寻址的文件永不变化，返回长期缓存头；
+    # 派生版本尚未生成 (或无法生成) 时回退到原图，并且不做长期缓存
+    async def get_response(self, path: str, scope):
+        match = VARIANT_PATH.match(path)
+        if match and not os.path.exists(os.path.join(self.directory, path)):
+            original = self._find_original(match.group(1))
+            if original is None:
+                return await super().get_response(path, scope)
+            response = await super().get_response(original, scope)
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+        response = await super().get_response(path, scope)
+        if response.status_code == 200 and (match or CONTENT_URL.match("/uploads/" + path)):
+            response.headers["Cache-Control"] = IMMUTABLE
+        return response
+
+    def _find_original(self, stem: str):
+        directory, name = os.path.split(stem)
+        try:
+            for entry in os.listdir(os.path.join(self.directory, directory)):
+                if entry.startswith(name) and entry.count(".") <= 1 and not entry.endswith(".tmp"):
+                    return f"{directory}/{entry}"
+        except FileNotFoundError:
+            pass
+        return None
+
+if __name__ == "__main__":
+    # 为已有的内容寻址上传补生成派生版本：按数据库里的引用决定用途 (帖子配图 / 头像)
+    import uploads, models, database
+    db = database.SessionLocal()
+    try:
+        wanted = [(url, "post") for url, in db.query(models.Post.image_url).filter(models.Post.image_url.isnot(None)).distinct()]
+        wanted += [(url, "avatar") for url, in db.query(models.User.avatar_url).filter(models.User.avatar_url.isnot(None)).distinct()]
+    finally:
+        db.close()
+    total = 0
+    for url, kind in wanted:
+        rel = image_path(url)
+        if rel and os.path.exists(os.path.join(uploads.UPLOAD_DIR, rel)):
+            total += generate_variants(uploads.UPLOAD_DIR, rel, missing_variants(uploads.UPLOAD_DIR, rel, kind))
+    print(f"已生成 {total} 个派生图片。")
@@ -0,0 +1,51 @@
+from sqlalchemy import inspect, text, types
+from sqlalchemy.schema import CreateColumn
+import models
+import database
+
+# 增量同步表结构：create_all 只会建新表，这里为已有表补齐新增的列和索引
+# 不删除任何列/索引，可重复执行
+
+# 已有列的类型变更：(列, 根据数据库反射出的类型判断是否需要修改)，只在 MySQL 上执行
+# (SQLite 的浮点数本来就是双精度，字符串默认按二进制比较)
+ALTERED_COLUMNS = [
+    (models.PostScore.__table__.c.score, lambda current: not isinstance(current, types.Double)),
+    (models.SearchPosting.__table__.c.term, lambda current: getattr(current, "collation", None) != "utf8mb4_bin"),
+]
+
+def _alter_columns(engine):
+    if engine.dialect.name != "mysql":
+        return
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for column, needs_change in ALTERED_COLUMNS:
+            current = next(c["type"] for c in inspector.get_columns(column.table.name) if c["name"] == column.name)
+            if needs_change(current):
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                print(f"修改 {column.table.name}.{column.name} 的类型 ...")
+                conn.execute(text(f"ALTER TABLE {column.table.name} MODIFY COLUMN {ddl}"))
+
+def upgrade_schema(engine=None):
+    engine = engine or database.engine
+    models.Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in models.Base.metadata.sorted_tables:
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    print(f"为 {table.name} 添加列 {column.name} ...")
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+    _alter_columns(engine)
+    inspector = inspect(engine)
+    for table in models.Base.metadata.sorted_tables:
+        existing = {idx["name"] for idx in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                print(f"为 {table.name} 创建索引 {index.name} ...")
+                index.create(bind=engine)
+
+if __name__ == "__main__":
+    upgrade_schema()
+    print("表结构已是最新。")
@@ -0,0 +1,13 @@
+import database
+import tag_crud
+from migrate import upgrade_schema
+
+# 把 posts.tags (逗号分隔字符串) 回填到规范化的 tags / post_tags 表
+if __name__ == "__main__":
+    upgrade_schema()
+    db = database.SessionLocal()
+    try:
+        total = tag_crud.backfill(db)
+        print(f"标签迁移完成，共处理 {total} 篇帖子。")
+    finally:
+        db.close()
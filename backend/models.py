@@ -1,5 +1,6 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime, Table
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime, Double, Table, Index
 from sqlalchemy.orm import relationship
+from sqlalchemy.dialects import mysql
 from datetime import datetime
 from database import Base
 
@@ -15,6 +16,14 @@ post_collections = Table('post_collections', Base.metadata,
     Column('post_id', Integer, ForeignKey('posts.id'), primary_key=True)
 )
 
+# 多对多关系表：帖子标签 (created_at 冗余自帖子，便于按标签做游标分页)
+post_tags = Table('post_tags', Base.metadata,
+    Column('post_id', Integer, ForeignKey('posts.id'), primary_key=True),
+    Column('tag_id', Integer, ForeignKey('tags.id'), primary_key=True),
+    Column('created_at', DateTime, default=datetime.utcnow),
+    Index('ix_post_tags_feed', 'tag_id', 'created_at', 'post_id'),
+)
+
 # 多对多关系表：关注
 user_follows = Table('user_follows', Base.metadata,
     Column('follower_id', Integer, ForeignKey('users.id'), primary_key=True),
@@ -38,6 +47,10 @@ class User(Base):
     location = Column(String(100), nullable=True) # 所在地
     website = Column(String(255), nullable=True) # 个人网站
 
+    # 冗余计数 (由写路径原子增减，reconcile_counters.py 可全量重建)
+    followers_count = Column(Integer, default=0, server_default="0", nullable=False)
+    following_count = Column(Integer, default=0, server_default="0", nullable=False)
+
     posts = relationship("Post", back_populates="owner")
     comments = relationship("Comment", back_populates="owner")
     
@@ -70,12 +83,31 @@ class Post(Base):
     is_pinned = Column(Boolean, default=False) # 置顶
     is_original = Column(Boolean, default=True) # 是否原创
 
+    # 冗余计数 (由写路径原子增减，reconcile_counters.py 可全量重建)
+    likes_count = Column(Integer, default=0, server_default="0", nullable=False)
+    comments_count = Column(Integer, default=0, server_default="0", nullable=False)
+    collections_count = Column(Integer, default=0, server_default="0", nullable=False)
+
     owner = relationship("User", back_populates="posts")
     comments = relationship("Comment", back_populates="post", cascade="all, delete-orphan")
     
     liked_by_users = relationship("User", secondary=post_likes, back_populates="liked_posts")
     collected_by_users = relationship("User", secondary=post_collections, back_populates="collected_posts")
 
+    # 游标分页使用的复合索引，与各列表的排序键一致
+    __table_args__ = (
+        Index("ix_posts_feed", "is_pinned", "created_at", "id"),
+        Index("ix_posts_category_feed", "category", "is_pinned", "created_at", "id"),
+        Index("ix_posts_owner_created", "owner_id", "created_at", "id"),
+    )
+
+class Tag(Base):
+    __tablename__ = "tags"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(50), unique=True, index=True) # 规范化后的标签名
+    post_count = Column(Integer, default=0, server_default="0", nullable=False, index=True)
+
 class Comment(Base):
     __tablename__ = "comments"
 
@@ -84,6 +116,83 @@ class Comment(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     owner_id = Column(Integer, ForeignKey("users.id"))
     post_id = Column(Integer, ForeignKey("posts.id"))
+    # 一层回复：指向顶层评论 (不加外键约束，避免删除帖子时级联删除评论的顺序问题)
+    parent_id = Column(Integer, nullable=True)
+    reply_count = Column(Integer, default=0, server_default="0", nullable=False)
 
     owner = relationship("User", back_populates="comments")
     post = relationship("Post", back_populates="comments")
+
+    # 按帖子 + 父评论 + 时间做游标分页
+    __table_args__ = (
+        Index("ix_comments_thread", "post_id", "parent_id", "created_at", "id"),
+    )
+
+# 全文搜索倒排索引 (由 search_index.py 维护)
+class SearchDocument(Base):
+    __tablename__ = "search_documents"
+
+    doc_type = Column(String(16), primary_key=True) # post / comment
+    doc_id = Column(Integer, primary_key=True)
+    post_id = Column(Integer, index=True) # 评论所属帖子，删除帖子时一并清理
+    length = Column(Integer, default=0) # 词元总数，用于 BM25 长度归一化
+
+class SearchPosting(Base):
+    __tablename__ = "search_postings"
+
+    # 词元按二进制比较：MySQL 默认排序规则 (utf8mb4_0900_ai_ci) 把 ハハ/はは、は/ば 视为相同，
+    # 分词器保留的不同词元会在主键上冲突
+    term = Column(String(64).with_variant(mysql.VARCHAR(64, collation="utf8mb4_bin"), "mysql"), primary_key=True)
+    doc_type = Column(String(16), primary_key=True)
+    doc_id = Column(Integer, primary_key=True)
+    tf = Column(Integer, default=1) # 词频 (标题词元加权)
+    doc_length = Column(Integer, default=0) # 冗余文档长度，打分时无需再查 search_documents
+
+    __table_args__ = (
+        Index("ix_search_postings_term_tf", "term", "tf"),
+    )
+
+# 关注动态时间线 (由 timeline.py 推送维护)：每个用户一份关注作者的帖子索引
+class TimelineEntry(Base):
+    __tablename__ = "timeline_entries"
+
+    user_id = Column(Integer, primary_key=True) # 时间线所属用户
+    post_id = Column(Integer, primary_key=True, index=True)
+    author_id = Column(Integer) # 取消关注时按作者清理
+    created_at = Column(DateTime) # 冗余自帖子，用于排序和游标分页
+
+    __table_args__ = (
+        Index("ix_timeline_feed", "user_id", "created_at", "post_id"),
+        Index("ix_timeline_author", "user_id", "author_id"),
+    )
+
+# 热度排行 (由 ranking.py 定期增量重算)：每个帖子一行物化的热度分
+class PostScore(Base):
+    __tablename__ = "post_scores"
+
+    post_id = Column(Integer, primary_key=True)
+    category = Column(String(50), nullable=True) # 冗余自帖子，用于分类排行
+    score = Column(Double, nullable=False) # 双精度：游标里的分数原样比较，单精度 FLOAT 会因舍入跳过或重复行
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_post_scores_rank", "score", "post_id"),
+        Index("ix_post_scores_category_rank", "category", "score", "post_id"),
+    )
+
+# 通知 (点赞/关注/评论/回复)：每个事件一行，id 同时用作 SSE 的事件 id
+class Notification(Base):
+    __tablename__ = "notifications"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id")) # 接收者
+    type = Column(String(20)) # like / follow / comment / reply
+    actor_id = Column(Integer, ForeignKey("users.id")) # 触发者
+    post_id = Column(Integer, nullable=True)
+    comment_id = Column(Integer, nullable=True)
+    is_read = Column(Boolean, default=False, server_default="0", nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_notifications_user", "user_id", "id"),
+    )
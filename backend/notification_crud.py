@@ -0,0 +1,88 @@
+from sqlalchemy import event, func, update
+from sqlalchemy.orm import Session
+import models, pagination
+from notifications import broker
+from event_bus import bus
+
+# 通知写入与查询。notify() 与触发它的点赞/关注/评论在同一事务中写库，
+# 最外层事务提交后才推送给在线的 SSE 连接，最外层事务回滚时丢弃
+# (保存点的提交/回滚也会触发 after_commit/after_rollback，需要排除)
+
+def notify(db: Session, user_id: int, type: str, actor_id: int, post_id: int = None, comment_id: int = None):
+    if user_id is None or user_id == actor_id:
+        return
+    notification = models.Notification(user_id=user_id, type=type, actor_id=actor_id, post_id=post_id, comment_id=comment_id)
+    db.add(notification)
+    db.flush()
+    actor = db.query(models.User.username, models.User.avatar_url).filter(models.User.id == actor_id).first()
+    # 提交后对象属性会过期，这里先把推送内容取出来
+    db.info.setdefault("pending_notifications", []).append(
+        _payload(notification, actor.username if actor else None, actor.avatar_url if actor else None))
+
+def _payload(n, actor_username, actor_avatar) -> dict:
+    return {
+        "id": n.id, "user_id": n.user_id, "type": n.type, "actor_id": n.actor_id,
+        "actor_username": actor_username, "actor_avatar": actor_avatar,
+        "post_id": n.post_id, "comment_id": n.comment_id, "created_at": n.created_at.isoformat(),
+    }
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session):
+    if session.in_nested_transaction():
+        return # 释放保存点，外层事务还没有提交
+    for payload in session.info.pop("pending_notifications", ()):
+        broker.publish(payload["user_id"], payload)
+        # 接收者的 SSE 连接可能在其它 worker 上
+        bus.publish("notification", payload)
+
+bus.subscribe("notification", lambda payload: broker.publish(payload["user_id"], payload))
+bus.on_reset(broker.resync)
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_pending(session, transaction):
+    # 提交时 after_commit 已经取走；这里只处理最外层事务回滚/关闭的情况
+    if transaction.parent is None:
+        session.info.pop("pending_notifications", None)
+
+def _with_actors(query):
+    return query.add_columns(models.User.username, models.User.avatar_url) \
+        .outerjoin(models.User, models.User.id == models.Notification.actor_id)
+
+def get_notifications(db: Session, user_id: int, cursor: str = None, limit: int = 20):
+    # 最新的在前，按 id 游标翻页
+    query = _with_actors(db.query(models.Notification)).filter(models.Notification.user_id == user_id)
+    if cursor:
+        (last_id,) = pagination.decode_cursor(cursor, int)
+        query = query.filter(models.Notification.id < last_id)
+    rows = query.order_by(models.Notification.id.desc()).limit(limit).all()
+    items = []
+    for n, username, avatar_url in rows:
+        n.actor_username = username
+        n.actor_avatar = avatar_url
+        items.append(n)
+    return items, pagination.next_cursor(items, limit, lambda n: (n.id,))
+
+def get_since(db: Session, user_id: int, last_id: int, limit: int) -> list:
+    # 断线重连补发：id 大于 last_id 的通知 (按 id 升序)，返回推送用的 dict
+    rows = _with_actors(db.query(models.Notification)).filter(
+        models.Notification.user_id == user_id, models.Notification.id > last_id) \
+        .order_by(models.Notification.id).limit(limit).all()
+    return [_payload(n, username, avatar_url) for n, username, avatar_url in rows]
+
+def get_latest_id(db: Session, user_id: int) -> int:
+    return db.query(func.max(models.Notification.id)).filter(models.Notification.user_id == user_id).scalar() or 0
+
+def unread_count(db: Session, user_id: int, up_to_id: int = None) -> int:
+    query = db.query(func.count(models.Notification.id)).filter(
+        models.Notification.user_id == user_id, models.Notification.is_read == False)
+    if up_to_id is not None:
+        query = query.filter(models.Notification.id <= up_to_id)
+    return query.scalar()
+
+def mark_read(db: Session, user_id: int, up_to_id: int = None) -> int:
+    stmt = update(models.Notification).where(models.Notification.user_id == user_id, models.Notification.is_read == False)
+    if up_to_id is not None:
+        stmt = stmt.where(models.Notification.id <= up_to_id)
+    db.execute(stmt.values(is_read=True))
+    db.commit()
+    return unread_count(db, user_id)
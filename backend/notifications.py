@@ -0,0 +1,185 @@
+import os
+import json
+import asyncio
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# 通知的实时推送：进程内的 asyncio 消息代理，/api/notifications/stream 的每个 SSE 连接是一个订阅者
+# - 合并：收到第一条事件后等 NOTIFY_COALESCE_SECONDS 再发送，期间同一帖子的同类通知合并成一条
+#   ("37 人赞了你的帖子")，每条合并事件带上最多 NOTIFY_MAX_ACTORS 个触发者
+# - 背压：每个连接的队列有上限，慢客户端队列满了不再入队，改为下次发送时从数据库补读，内存不会无限增长
+# - 断线续传：SSE 事件 id 为通知的数据库 id，重连时按 Last-Event-ID 从数据库补发；
+#   未读数在补发之后才查询并推送，并注明它统计到哪个 id 为止，客户端不会把补发的通知重复计入
+
+NOTIFY_COALESCE_SECONDS = float(os.getenv("NOTIFY_COALESCE_SECONDS", "1.0"))
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", "256"))
+NOTIFY_MAX_ACTORS = 3
+NOTIFY_BACKLOG_LIMIT = 500 # 断线续传/溢出补读一次最多取的条数
+HEARTBEAT_SECONDS = 15 # 空闲时发送注释行，防止 Nginx/浏览器断开长连接
+RESYNC = {"id": 0} # 唤醒连接用的占位事件，配合 overflowed 触发从数据库补读
+
+class Subscriber:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+        self.overflowed = False # 队列曾经满过，需要从数据库补读
+
+class Broker:
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._loop = None
+        self.published = 0
+        self.dropped = 0
+
+    def start(self):
+        # 在事件循环里调用 (lifespan)；publish 可能来自线程池，需要借助 loop 切回事件循环
+        self._loop = asyncio.get_running_loop()
+
+    def stop(self):
+        # 通知所有连接结束
+        for subscribers in list(self._subscribers.values()):
+            for sub in subscribers:
+                self._put(sub, None)
+        self._loop = None
+
+    def publish(self, user_id: int, payload: dict):
+        # 线程安全；接收者不在线时直接忽略 (通知已落库，上线后可查询或续传)
+        if self._loop is None or user_id not in self._subscribers:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._dispatch, user_id, payload)
+        except RuntimeError:
+            pass # 事件循环已关闭
+
+    def _dispatch(self, user_id: int, payload: dict):
+        self.published += 1
+        for sub in self._subscribers.get(user_id, ()):
+            self._put(sub, payload)
+
+    def _put(self, sub: Subscriber, payload):
+        try:
+            sub.queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            sub.overflowed = True
+            self.dropped += 1
+
+    def resync(self):
+        # 线程安全；其它 worker 发来的事件可能丢失时 (事件总线序号缺口)，让所有连接从数据库补读
+        if self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(self._resync_all)
+        except RuntimeError:
+            pass
+
+    def _resync_all(self):
+        for subscribers in list(self._subscribers.values()):
+            for sub in subscribers:
+                sub.overflowed = True
+                self._put(sub, RESYNC)
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        sub = Subscriber(user_id)
+        self._subscribers[user_id].add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        subscribers = self._subscribers.get(sub.user_id)
+        if subscribers is not None:
+            subscribers.discard(sub)
+            if not subscribers:
+                del self._subscribers[sub.user_id]
+
+    def stats(self) -> dict:
+        return {"users": len(self._subscribers), "connections": sum(len(s) for s in self._subscribers.values()),
+                "published": self.published, "dropped": self.dropped}
+
+broker = Broker()
+
+def coalesce(payloads: list) -> list:
+    # 同一 (类型, 帖子) 的通知合并为一条；按每组最大 id 升序返回，保证客户端记录的 Last-Event-ID 单调递增
+    groups = {}
+    for p in payloads:
+        key = (p["type"], p["post_id"])
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = {"type": p["type"], "post_id": p["post_id"], "count": 0, "actors": [], "ids": []}
+        group["count"] += 1
+        group["ids"].append(p["id"])
+        group["comment_id"] = p["comment_id"]
+        group["created_at"] = p["created_at"]
+        actor = {"id": p["actor_id"], "username": p["actor_username"], "avatar": p["actor_avatar"]}
+        if actor not in group["actors"]:
+            group["actors"].insert(0, actor)
+            del group["actors"][NOTIFY_MAX_ACTORS:]
+    events = sorted(groups.values(), key=lambda g: max(g["ids"]))
+    for group in events:
+        group["id"] = max(group.pop("ids"))
+    return events
+
+def format_event(event: str, data, event_id: int = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+async def _backlog(load_since, last_id: int):
+    # 分批补读数据库中 id > last_id 的通知，直到读完
+    while True:
+        rows = await load_since(last_id, NOTIFY_BACKLOG_LIMIT)
+        if rows:
+            last_id = rows[-1]["id"]
+            yield rows
+        if len(rows) < NOTIFY_BACKLOG_LIMIT:
+            return
+
+async def stream(user_id: int, last_id: int, load_since, is_disconnected, load_unread=None):
+    # SSE 响应体生成器。load_since(last_id, limit) -> 数据库中 id > last_id 的通知 (异步函数，按 id 升序)
+    # load_unread(up_to_id) -> id <= up_to_id 的未读数 (异步函数)，补发完成后推送一次
+    # 先订阅再补读，两者之间不会漏；重叠的部分按 id 去重
+    sub = broker.subscribe(user_id)
+    try:
+        yield "retry: 3000\n\n"
+        async for rows in _backlog(load_since, last_id):
+            last_id = rows[-1]["id"]
+            for item in coalesce(rows):
+                yield format_event("notification", item, item["id"])
+        if load_unread is not None:
+            # 之后推送的通知 id 都大于 last_id，客户端在此基础上累加即可
+            yield format_event("unread", {"count": await load_unread(last_id), "last_id": last_id})
+        while True:
+            try:
+                first = await asyncio.wait_for(sub.queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    return
+                yield ": ping\n\n"
+                continue
+            if first is None:
+                return
+            await asyncio.sleep(NOTIFY_COALESCE_SECONDS)
+            batch = [first]
+            while not sub.queue.empty():
+                batch.append(sub.queue.get_nowait())
+            closing = None in batch
+            if sub.overflowed:
+                # 期间有事件被丢弃，以数据库为准补读
+                sub.overflowed = False
+                async for rows in _backlog(load_since, last_id):
+                    last_id = rows[-1]["id"]
+                    for item in coalesce(rows):
+                        yield format_event("notification", item, item["id"])
+            else:
+                batch = [p for p in batch if p is not None and p["id"] > last_id]
+                if batch:
+                    last_id = max(p["id"] for p in batch)
+                    for item in coalesce(batch):
+                        yield format_event("notification", item, item["id"])
+            if closing:
+                return
+    finally:
+        broker.unsubscribe(sub)
@@ -0,0 +1,39 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+# 游标分页 (keyset pagination) 工具
+# 游标是最后一行排序键的 base64 编码，对客户端不透明；翻到任意深度的代价都与第一页相同
+
+MAX_PAGE_SIZE = 100
+
+def encode_cursor(*values) -> str:
+    raw = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(raw, separators=(",", ":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str, *types) -> list:
+    # types 与 encode_cursor 的参数一一对应，如 (bool, datetime, int)；格式不对时抛出 ValueError
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(raw, list) or len(raw) != len(types):
+        raise ValueError("Invalid cursor")
+    try:
+        return [datetime.fromisoformat(v) if t is datetime else t(v) for t, v in zip(types, raw)]
+    except (TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+def after(columns, values, descending: bool = True):
+    # 所有排序列均为降序时，"排在游标之后" 等价于行值比较 (a, b, c) < (x, y, z)；升序时为 >
+    if descending:
+        return tuple_(*columns) < tuple_(*values)
+    return tuple_(*columns) > tuple_(*values)
+
+def next_cursor(rows, limit: int, key):
+    # 本页取满时才返回下一页游标
+    if len(rows) < limit or not rows:
+        return None
+    return encode_cursor(*key(rows[-1]))
@@ -1,88 +1,215 @@
-from sqlalchemy.orm import Session
-import models, schemas
+from sqlalchemy import select
+from sqlalchemy.orm import Session, object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from datetime import datetime
+import models, schemas, crud, database, pagination, media, search_index, tag_crud, timeline, ranking, notification_crud
+from view_counter import view_counter
+from response_cache import response_cache
 
 def enrich_post(post, current_user_id: int = None):
     if not post:
         return
-    post.owner_username = post.owner.username if post.owner else "Unknown"
-    post.owner_avatar = post.owner.avatar_url if post.owner else None
-    post.likes_count = len(post.liked_by_users)
-    post.comments_count = len(post.comments)
-    
+    enrich_posts(object_session(post), [post], current_user_id)
+
+# 快速序列化路径 (fast_json) 只查询这些列，不构造 ORM 对象
+POST_ROW_COLUMNS = (
+    models.Post.id, models.Post.title, models.Post.content, models.Post.image_url, models.Post.category,
+    models.Post.tags, models.Post.is_original, models.Post.is_pinned, models.Post.owner_id, models.Post.created_at,
+    models.Post.views, models.Post.likes_count, models.Post.comments_count, models.Post.collections_count,
+)
+
+def _post_query(db: Session, as_rows: bool = False):
+    return db.query(*POST_ROW_COLUMNS) if as_rows else db.query(models.Post)
+
+def _viewer_state(db: Session, posts, current_user_id: int = None):
+    # 批量查询作者信息和当前用户的点赞/收藏状态 (计数直接读 posts 表上的冗余列)
+    # 整页帖子只发出固定数量的查询，不再逐条懒加载 owner/liked_by_users/collected_by_users
+    post_ids = [p.id for p in posts]
+    owner_ids = {p.owner_id for p in posts if p.owner_id is not None}
+
+    owners = {}
+    if owner_ids:
+        rows = db.query(models.User.id, models.User.username, models.User.avatar_url) \
+            .filter(models.User.id.in_(owner_ids)).all()
+        owners = {row.id: row for row in rows}
+
+    liked, collected = set(), set()
     if current_user_id:
-        post.is_liked = any(u.id == current_user_id for u in post.liked_by_users)
-        post.is_collected = any(u.id == current_user_id for u in post.collected_by_users)
-    else:
-        post.is_liked = False
-        post.is_collected = False
-
-def get_posts(db: Session, skip: int = 0, limit: int = 100, current_user_id: int = None, category: str = None):
-    query = db.query(models.Post)
+        liked = {row[0] for row in db.query(models.post_likes.c.post_id).filter(
+            models.post_likes.c.user_id == current_user_id,
+            models.post_likes.c.post_id.in_(post_ids)).all()}
+        collected = {row[0] for row in db.query(models.post_collections.c.post_id).filter(
+            models.post_collections.c.user_id == current_user_id,
+            models.post_collections.c.post_id.in_(post_ids)).all()}
+    return owners, liked, collected
+
+def enrich_posts(db: Session, posts, current_user_id: int = None):
+    if not posts:
+        return posts
+    owners, liked, collected = _viewer_state(db, posts, current_user_id)
+    for post in posts:
+        owner = owners.get(post.owner_id)
+        post.owner_username = owner.username if owner else "Unknown"
+        post.owner_avatar = owner.avatar_url if owner else None
+        post.is_liked = post.id in liked
+        post.is_collected = post.id in collected
+        post.image_variants = media.variant_urls(post.image_url, "post")
+    return posts
+
+def post_rows(db: Session, rows, current_user_id: int = None) -> list:
+    # POST_ROW_COLUMNS 查询结果 -> 与 schemas.Post 字段顺序一致的 dict
+    if not rows:
+        return []
+    owners, liked, collected = _viewer_state(db, rows, current_user_id)
+    result = []
+    for r in rows:
+        owner = owners.get(r.owner_id)
+        result.append({
+            "title": r.title, "content": r.content, "image_url": r.image_url, "category": r.category,
+            "tags": r.tags, "is_original": r.is_original, "is_pinned": r.is_pinned,
+            "id": r.id, "owner_id": r.owner_id, "created_at": r.created_at,
+            "owner_username": owner.username if owner else "Unknown",
+            "owner_avatar": owner.avatar_url if owner else None,
+            "views": r.views, "likes_count": r.likes_count, "comments_count": r.comments_count,
+            "collections_count": r.collections_count,
+            "is_liked": r.id in liked, "is_collected": r.id in collected,
+            "image_variants": media.variant_urls(r.image_url, "post"),
+        })
+    return result
+
+def _finish(db: Session, posts, current_user_id: int, as_rows: bool):
+    return post_rows(db, posts, current_user_id) if as_rows else enrich_posts(db, posts, current_user_id)
+
+def _posts_in_order(db: Session, ids: list, as_rows: bool = False):
+    # 按给定 id 顺序取帖子 (排序由索引表决定的列表用)，已删除的跳过
+    if not ids:
+        return []
+    posts_by_id = {p.id: p for p in _post_query(db, as_rows).filter(models.Post.id.in_(ids))}
+    return [posts_by_id[i] for i in ids if i in posts_by_id]
+
+def feed_key(post):
+    return (post.is_pinned, post.created_at, post.id)
+
+def get_posts(db: Session, skip: int = 0, limit: int = 100, current_user_id: int = None, category: str = None, cursor: str = None, as_rows: bool = False):
+    # 返回 (帖子列表, 下一页游标)；skip 仅为兼容旧客户端保留，传 cursor 时忽略
+    # as_rows=True 时返回 dict 列表 (fast_json 路径)，下同
+    query = _post_query(db, as_rows)
     if category:
         query = query.filter(models.Post.category == category)
-        
+
     # Sort by pinned first, then date
-    posts = query.order_by(models.Post.is_pinned.desc(), models.Post.created_at.desc()).offset(skip).limit(limit).all()
-    
-    for post in posts:
-        enrich_post(post, current_user_id)
-    return posts
+    columns = (models.Post.is_pinned, models.Post.created_at, models.Post.id)
+    query = query.order_by(*(col.desc() for col in columns))
+    if cursor:
+        query = query.filter(pagination.after(columns, pagination.decode_cursor(cursor, bool, datetime, int)))
+    elif skip:
+        query = query.offset(skip)
+    posts = query.limit(limit).all()
+    return _finish(db, posts, current_user_id, as_rows), pagination.next_cursor(posts, limit, feed_key)
 
-def get_posts_by_user(db: Session, user_id: int, current_user_id: int = None):
-    posts = db.query(models.Post).filter(models.Post.owner_id == user_id).order_by(models.Post.created_at.desc()).all()
-    for post in posts:
-        enrich_post(post, current_user_id)
-    return posts
+def get_hot_posts(db: Session, limit: int = 20, current_user_id: int = None, category: str = None, cursor: str = None, as_rows: bool = False):
+    # 热度排行：直接按 post_scores 上的 (score, post_id) 索引分页
+    query = db.query(models.PostScore.score, models.PostScore.post_id)
+    if category:
+        query = query.filter(models.PostScore.category == category)
+    columns = (models.PostScore.score, models.PostScore.post_id)
+    if cursor:
+        query = query.filter(pagination.after(columns, pagination.decode_cursor(cursor, float, int)))
+    rows = query.order_by(*(col.desc() for col in columns)).limit(limit).all()
+    posts = _posts_in_order(db, [r.post_id for r in rows], as_rows)
+    return _finish(db, posts, current_user_id, as_rows), pagination.next_cursor(rows, limit, lambda r: (r.score, r.post_id))
+
+def get_posts_by_user(db: Session, user_id: int, current_user_id: int = None, cursor: str = None, limit: int = 100, as_rows: bool = False):
+    columns = (models.Post.created_at, models.Post.id)
+    query = _post_query(db, as_rows).filter(models.Post.owner_id == user_id).order_by(*(col.desc() for col in columns))
+    if cursor:
+        query = query.filter(pagination.after(columns, pagination.decode_cursor(cursor, datetime, int)))
+    posts = query.limit(limit).all()
+    return _finish(db, posts, current_user_id, as_rows), pagination.next_cursor(posts, limit, lambda p: (p.created_at, p.id))
+
+def get_posts_by_tag(db: Session, tag: str, current_user_id: int = None, cursor: str = None, limit: int = 20, as_rows: bool = False):
+    # 返回 (帖子列表, 下一页游标)；标签不存在时返回 (None, None)
+    tag_id = db.query(models.Tag.id).filter(models.Tag.name == tag_crud.normalize_tag(tag)).scalar()
+    if tag_id is None:
+        return None, None
+    # 直接在 post_tags 的 (tag_id, created_at, post_id) 索引上翻页
+    columns = (models.post_tags.c.created_at, models.post_tags.c.post_id)
+    query = select(*columns).where(models.post_tags.c.tag_id == tag_id).order_by(*(col.desc() for col in columns))
+    if cursor:
+        query = query.where(pagination.after(columns, pagination.decode_cursor(cursor, datetime, int)))
+    rows = db.execute(query.limit(limit)).all()
+    posts = _posts_in_order(db, [r.post_id for r in rows], as_rows)
+    return _finish(db, posts, current_user_id, as_rows), pagination.next_cursor(rows, limit, lambda r: (r.created_at, r.post_id))
+
+def get_following_feed(db: Session, user_id: int, cursor: str = None, limit: int = 20, as_rows: bool = False):
+    # 关注动态：时间线 (推) 与大V帖子 (拉) 合并后的一页
+    page, next_cursor = timeline.read_page(db, user_id, cursor, limit)
+    posts = _posts_in_order(db, [post_id for _, post_id in page], as_rows)
+    return _finish(db, posts, user_id, as_rows), next_cursor
 
 def get_post(db: Session, post_id: int, current_user_id: int = None):
     post = db.query(models.Post).filter(models.Post.id == post_id).first()
     if post:
-        # Increase view count
-        post.views += 1
-        db.commit()
-        enrich_post(post, current_user_id)
+        # 阅读量先记在内存里，由 view_counter 批量写回；返回值叠加未落库的增量
+        view_counter.incr(post.id)
+        set_committed_value(post, "views", (post.views or 0) + view_counter.pending(post.id))
+        enrich_posts(db, [post], current_user_id)
     return post
 
+def get_post_owner(db: Session, post_id: int):
+    # 只取 (id, owner_id)，用于删除前的权限检查
+    return db.query(models.Post.id, models.Post.owner_id).filter(models.Post.id == post_id).first()
+
 def delete_post(db: Session, post_id: int):
     post = db.query(models.Post).filter(models.Post.id == post_id).first()
     if post:
+        search_index.remove_post(db, post_id)
+        tag_crud.remove_post_tags(db, post_id)
+        timeline.remove_post(db, post_id)
+        ranking.remove_post(db, post_id)
         db.delete(post)
         db.commit()
+        # 删除的帖子在过载降级时也不能再从旧版本副本里返回
+        response_cache.invalidate("feed", f"post:{post_id}", purge=True)
         return True
     return False
 
 def create_user_post(db: Session, post: schemas.PostCreate, user_id: int):
     db_post = models.Post(**post.dict(), owner_id=user_id)
     db.add(db_post)
+    db.flush()
+    search_index.index_post(db, db_post)
+    tag_crud.set_post_tags(db, db_post)
     db.commit()
     db.refresh(db_post)
-    enrich_post(db_post, user_id)
+    response_cache.invalidate("feed")
+    ranking.hot_ranker.mark(db_post.id)
+    timeline.timeline_worker.submit("fanout", db_post.id, user_id, db_post.created_at)
+    enrich_posts(db, [db_post], user_id)
     return db_post
 
-def like_post(db: Session, post_id: int, user_id: int):
-    post = db.query(models.Post).filter(models.Post.id == post_id).first()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if post and user:
-        if user not in post.liked_by_users:
-            post.liked_by_users.append(user)
-            db.commit()
-            return True
-        else:
-            post.liked_by_users.remove(user)
-            db.commit()
-            return False # Unliked
-    return None
-
-def collect_post(db: Session, post_id: int, user_id: int):
-    post = db.query(models.Post).filter(models.Post.id == post_id).first()
-    user = db.query(models.User).filter(models.User.id == user_id).first()
-    if post and user:
-        if user not in post.collected_by_users:
-            post.collected_by_users.append(user)
-            db.commit()
-            return True
-        else:
-            post.collected_by_users.remove(user)
-            db.commit()
-            return False # Uncollected
-    return None
+def like_post(db: Session, post_id: int, user_id: int, commit: bool = True):
+    post = get_post_owner(db, post_id)
+    if post is None:
+        return None
+    state, changed = crud.toggle_link(
+        db, models.post_likes, {"user_id": user_id, "post_id": post_id},
+        [(models.Post, post_id, models.Post.likes_count)], commit=False,
+    )
+    if state and changed:
+        notification_crud.notify(db, post.owner_id, "like", user_id, post_id=post_id)
+    database.on_commit(db, response_cache.invalidate, f"post:{post_id}")
+    database.on_commit(db, ranking.hot_ranker.mark, post_id)
+    if commit:
+        db.commit()
+    return state # False 表示取消点赞
+
+def collect_post(db: Session, post_id: int, user_id: int, commit: bool = True):
+    if db.query(models.Post.id).filter(models.Post.id == post_id).first() is None:
+        return None
+    database.on_commit(db, response_cache.invalidate, f"post:{post_id}")
+    state, _ = crud.toggle_link(
+        db, models.post_collections, {"user_id": user_id, "post_id": post_id},
+        [(models.Post, post_id, models.Post.collections_count)], commit=commit,
+    )
+    return state # False 表示取消收藏
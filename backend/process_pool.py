@@ -0,0 +1,10 @@
+import multiprocessing
+
+# 服务进程里的工作进程池 (密码哈希、图片派生版本) 共用的启动方式
+# 不用默认的 fork：进程池在第一次使用时才创建，那时事件循环、数据库连接池、浏览计数/时间线/热度/总线线程
+# 都已在运行，fork 出的子进程会继承它们的状态 (其它线程持有的锁、共享的连接和套接字)。
+# forkserver/spawn 的工作进程从干净的解释器启动，只导入任务函数所在的模块，这些模块不应在导入时连接数据库
+
+def mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
@@ -0,0 +1,133 @@
+import os
+import math
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import delete, insert, update
+from sqlalchemy.orm import Session
+import models, database
+from response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+# 热度排行：score = log10(互动量) + 发布时间 / HOT_DECAY_SECONDS
+# 与 Reddit 的 hot 算法相同，时间衰减体现为新帖的基础分更高，已算好的分数不会随时间过期，
+# 因此只需重算互动量有变化的帖子。点赞/评论/阅读写路径调用 mark()，后台线程每隔
+# HOT_RANK_INTERVAL 秒把这些帖子的分数写入 post_scores，/api/posts/?sort=hot 直接按索引分页
+
+HOT_RANK_INTERVAL = float(os.getenv("HOT_RANK_INTERVAL", "30"))
+HOT_DECAY_SECONDS = 45000 # 约 12.5 小时，发布时间每晚这么久，需要 10 倍的互动量才能排在同一位置
+VIEW_WEIGHT = 0.1
+LIKE_WEIGHT = 2
+COMMENT_WEIGHT = 3
+EPOCH = datetime(2024, 1, 1)
+BATCH_SIZE = 500
+
+def hot_score(views: int, likes: int, comments: int, created_at: datetime) -> float:
+    engagement = (views or 0) * VIEW_WEIGHT + (likes or 0) * LIKE_WEIGHT + (comments or 0) * COMMENT_WEIGHT
+    age = ((created_at or EPOCH) - EPOCH).total_seconds()
+    return round(math.log10(max(engagement, 1)) + age / HOT_DECAY_SECONDS, 7)
+
+def score_posts(db: Session, post_ids) -> int:
+    # 重算并写入指定帖子的分数；已删除的帖子顺带清掉
+    post_ids = list(post_ids)
+    for i in range(0, len(post_ids), BATCH_SIZE):
+        chunk = post_ids[i:i + BATCH_SIZE]
+        rows = db.query(models.Post.id, models.Post.category, models.Post.views, models.Post.likes_count,
+                        models.Post.comments_count, models.Post.created_at).filter(models.Post.id.in_(chunk)).all()
+        existing = {row[0] for row in db.query(models.PostScore.post_id).filter(models.PostScore.post_id.in_(chunk))}
+        now = datetime.utcnow()
+        values = [{"post_id": r.id, "category": r.category, "updated_at": now,
+                   "score": hot_score(r.views, r.likes_count, r.comments_count, r.created_at)} for r in rows]
+        updates = [v for v in values if v["post_id"] in existing]
+        if updates:
+            # 按主键批量 UPDATE (executemany)
+            db.execute(update(models.PostScore), updates)
+        inserts = [v for v in values if v["post_id"] not in existing]
+        if inserts:
+            db.execute(insert(models.PostScore), inserts)
+        gone = set(chunk) - {r.id for r in rows}
+        if gone:
+            db.execute(delete(models.PostScore).where(models.PostScore.post_id.in_(gone)))
+        db.commit()
+    return len(post_ids)
+
+def remove_post(db: Session, post_id: int):
+    db.execute(delete(models.PostScore).where(models.PostScore.post_id == post_id))
+
+class HotRanker:
+    def __init__(self, interval: float = HOT_RANK_INTERVAL):
+        self.interval = interval
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def mark(self, *post_ids):
+        with self._lock:
+            self._dirty.update(post_ids)
+
+    def refresh(self) -> int:
+        with self._lock:
+            batch = self._dirty
+            self._dirty = set()
+        if not batch:
+            return 0
+        db = database.SessionLocal()
+        try:
+            score_posts(db, batch)
+        except Exception:
+            db.rollback()
+            # 失败时放回去，下次再试
+            self.mark(*batch)
+            raise
+        finally:
+            db.close()
+        response_cache.invalidate("hot")
+        return len(batch)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("热度排行更新失败")
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="hot-ranker", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.refresh()
+
+hot_ranker = HotRanker()
+
+def rebuild(db: Session = None) -> int:
+    # 全量重算 (首次上线或调整权重后运行)
+    own = db is None
+    db = db or database.SessionLocal()
+    try:
+        total, last_id = 0, 0
+        while True:
+            ids = [row[0] for row in db.query(models.Post.id).filter(models.Post.id > last_id)
+                   .order_by(models.Post.id).limit(BATCH_SIZE)]
+            if not ids:
+                break
+            score_posts(db, ids)
+            total += len(ids)
+            last_id = ids[-1]
+        return total
+    finally:
+        if own:
+            db.close()
+
+if __name__ == "__main__":
+    from migrate import upgrade_schema
+    upgrade_schema()
+    print(f"热度排行重建完成，共 {rebuild()} 个帖子。")
@@ -0,0 +1,39 @@
+from sqlalchemy import func, select, update
+import models
+import database
+from migrate import upgrade_schema
+
+# 用关联表的真实数据全量重建 posts/users 上的冗余计数列
+# 每个计数一条 UPDATE ... SET col = (SELECT COUNT(*) ...)，全部在数据库侧完成
+# comments.reply_count 统计的是 comments 表自身，MySQL 不允许在 UPDATE 的子查询里引用目标表 (错误 1093)，
+# 改为先清零，再与按 parent_id 分组计数的派生表做多表 UPDATE (带 GROUP BY 的派生表会先物化)
+def reconcile_counters():
+    post_id = models.Post.id
+    user_id = models.User.id
+    replies = select(models.Comment.parent_id, func.count().label("count")) \
+        .where(models.Comment.parent_id.isnot(None)).group_by(models.Comment.parent_id).subquery("replies")
+    statements = [
+        ("posts.likes_count", update(models.Post).values(likes_count=select(func.count())
+            .where(models.post_likes.c.post_id == post_id).scalar_subquery())),
+        ("posts.collections_count", update(models.Post).values(collections_count=select(func.count())
+            .where(models.post_collections.c.post_id == post_id).scalar_subquery())),
+        ("posts.comments_count", update(models.Post).values(comments_count=select(func.count())
+            .where(models.Comment.post_id == post_id).scalar_subquery())),
+        ("comments.reply_count (清零)", update(models.Comment).values(reply_count=0)),
+        ("comments.reply_count", update(models.Comment).values(reply_count=replies.c.count)
+            .where(models.Comment.id == replies.c.parent_id)),
+        ("users.followers_count", update(models.User).values(followers_count=select(func.count())
+            .where(models.user_follows.c.followed_id == user_id).scalar_subquery())),
+        ("users.following_count", update(models.User).values(following_count=select(func.count())
+            .where(models.user_follows.c.follower_id == user_id).scalar_subquery())),
+    ]
+    with database.engine.begin() as conn:
+        for name, stmt in statements:
+            result = conn.execute(stmt)
+            print(f"已重建 {name} ({result.rowcount} 行)")
+
+if __name__ == "__main__":
+    # 确保计数列存在 (旧库升级)
+    upgrade_schema()
+    reconcile_counters()
+    print("计数重建完成。")
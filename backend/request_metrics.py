@@ -0,0 +1,245 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import Counter, defaultdict
+from sqlalchemy import event
+import fastapi.routing
+import database
+
+logger = logging.getLogger("luntan.requests")
+
+# 请求级性能埋点：每个请求统计 SQL 条数、数据库总耗时、最慢语句、等待连接池时间和响应序列化时间，
+# 通过 Server-Timing 响应头 (浏览器开发者工具可直接查看) 和结构化日志输出，并聚合成
+# Prometheus 格式的 /api/metrics。REQUEST_METRICS=1 时才注册中间件和引擎事件，关闭时没有额外开销；
+# SQL_DEBUG=1 时额外检测 N+1：同一条语句在一个请求中重复执行 N_PLUS_ONE_THRESHOLD 次以上
+
+REQUEST_METRICS = os.getenv("REQUEST_METRICS", "0") == "1"
+SQL_DEBUG = os.getenv("SQL_DEBUG", "0") == "1"
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "1.0"))
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+class RequestStats:
+    __slots__ = ("statements", "db_time", "slowest", "slowest_time", "pool_wait", "serialize_time", "shapes")
+
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+        self.slowest = None
+        self.slowest_time = 0.0
+        self.pool_wait = 0.0
+        self.serialize_time = 0.0
+        self.shapes = Counter() if SQL_DEBUG else None
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+def current() -> RequestStats:
+    return _current.get()
+
+# --- 引擎事件 ---
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    starts = conn.info.get("query_start")
+    if stats is None or not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats.statements += 1
+    stats.db_time += elapsed
+    if elapsed > stats.slowest_time:
+        stats.slowest, stats.slowest_time = statement, elapsed
+    if stats.shapes is not None:
+        stats.shapes[statement] += 1
+
+def _observe_pool_wait(seconds: float):
+    stats = _current.get()
+    if stats is not None:
+        stats.pool_wait += seconds
+
+def _instrument_serialization():
+    # FastAPI 把 response_model 校验 + 序列化集中在 fastapi.routing.serialize_response
+    original = fastapi.routing.serialize_response
+
+    async def serialize_response(**kwargs):
+        stats = _current.get()
+        if stats is None:
+            return await original(**kwargs)
+        start = time.perf_counter()
+        try:
+            return await original(**kwargs)
+        finally:
+            stats.serialize_time += time.perf_counter() - start
+
+    fastapi.routing.serialize_response = serialize_response
+
+def time_serialization(fn, *args):
+    # 手动序列化 (如匿名响应缓存的 dump_json) 时计入序列化时间
+    stats = _current.get()
+    if stats is None:
+        return fn(*args)
+    start = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        stats.serialize_time += time.perf_counter() - start
+
+# --- 聚合 ---
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))] += 1
+        self.sum += value
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = Counter() # (method, route, status) -> 次数
+        self.durations = defaultdict(lambda: Histogram(DURATION_BUCKETS)) # (method, route)
+        self.db_durations = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.n_plus_one = Counter() # (method, route) -> 检测到的次数
+
+    def record(self, method: str, route: str, status: int, duration: float, stats: RequestStats, n_plus_one: bool):
+        key = (method, route)
+        with self._lock:
+            self.requests[(method, route, status)] += 1
+            self.durations[key].observe(duration)
+            self.db_durations[key].observe(stats.db_time)
+            self.queries[key].observe(stats.statements)
+            if n_plus_one:
+                self.n_plus_one[key] += 1
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            lines += ["# HELP http_requests_total Requests by route and status.", "# TYPE http_requests_total counter"]
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{{_labels(method=method, route=route, status=status)}}} {count}')
+            for name, help_text, series in (
+                ("http_request_duration_seconds", "Request latency.", self.durations),
+                ("http_request_db_seconds", "Time spent executing SQL per request.", self.db_durations),
+                ("http_request_db_queries", "SQL statements per request.", self.queries),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for (method, route), hist in sorted(series.items()):
+                    lines += _histogram_lines(name, hist.buckets, hist.counts, hist.sum, _labels(method=method, route=route))
+            lines += ["# HELP http_request_n_plus_one_total Requests flagged as N+1 (SQL_DEBUG).",
+                      "# TYPE http_request_n_plus_one_total counter"]
+            for (method, route), count in sorted(self.n_plus_one.items()):
+                lines.append(f'http_request_n_plus_one_total{{{_labels(method=method, route=route)}}} {count}')
+        # 连接池排队时间 (所有请求与后台线程累计)
+        lines += ["# HELP db_pool_wait_seconds Time spent waiting for a pooled connection.",
+                  "# TYPE db_pool_wait_seconds histogram"]
+        for name, info in database.pool_stats().items():
+            wait = info.get("wait")
+            if wait:
+                counts = list(wait["buckets"].values())
+                lines += _histogram_lines("db_pool_wait_seconds", database.POOL_WAIT_BUCKETS, counts,
+                                          wait["total_seconds"], _labels(pool=name))
+        return "\n".join(lines) + "\n"
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels) -> str:
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+
+def _histogram_lines(name, buckets, counts, total, labels) -> list:
+    lines, cumulative = [], 0
+    for bound, count in zip(buckets, counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    cumulative += counts[-1]
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+    lines.append(f"{name}_sum{{{labels}}} {total}")
+    lines.append(f"{name}_count{{{labels}}} {cumulative}")
+    return lines
+
+registry = Registry()
+
+# --- 中间件 ---
+
+_WHITESPACE = re.compile(r"\s+")
+
+def _server_timing(stats: RequestStats, total: float) -> bytes:
+    return (f'db;dur={stats.db_time * 1000:.1f};desc="{stats.statements} queries", '
+            f'pool;dur={stats.pool_wait * 1000:.1f}, ser;dur={stats.serialize_time * 1000:.1f}, '
+            f'total;dur={total * 1000:.1f}').encode()
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", _server_timing(stats, time.perf_counter() - start)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            duration = time.perf_counter() - start
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            repeated = [(s, n) for s, n in stats.shapes.items() if n >= N_PLUS_ONE_THRESHOLD] if stats.shapes else []
+            registry.record(scope["method"], route, status[0], duration, stats, bool(repeated))
+            self._log(scope, route, status[0], duration, stats, repeated)
+
+    def _log(self, scope, route, status, duration, stats, repeated):
+        record = {
+            "method": scope["method"], "path": scope["path"], "route": route, "status": status,
+            "duration_ms": round(duration * 1000, 2), "queries": stats.statements,
+            "db_ms": round(stats.db_time * 1000, 2), "pool_wait_ms": round(stats.pool_wait * 1000, 2),
+            "serialize_ms": round(stats.serialize_time * 1000, 2),
+        }
+        if stats.slowest:
+            record["slowest_ms"] = round(stats.slowest_time * 1000, 2)
+            record["slowest_sql"] = _WHITESPACE.sub(" ", stats.slowest)[:500]
+        if repeated:
+            record["n_plus_one"] = [{"count": n, "sql": _WHITESPACE.sub(" ", s)[:300]} for s, n in repeated]
+            logger.warning(json.dumps(record, ensure_ascii=False))
+        elif duration >= SLOW_REQUEST_SECONDS:
+            logger.warning(json.dumps(record, ensure_ascii=False))
+        else:
+            logger.info(json.dumps(record, ensure_ascii=False))
+
+def install(app):
+    # 在 main.py 中调用；未开启时什么都不注册
+    if not REQUEST_METRICS:
+        return
+    engines = {database.engine, database.replica_engine}
+    if database.DB_ASYNC:
+        engines |= {database.async_engine.sync_engine, database.async_replica_engine.sync_engine}
+    for eng in engines:
+        event.listen(eng, "before_cursor_execute", _before_cursor_execute)
+        event.listen(eng, "after_cursor_execute", _after_cursor_execute)
+    database.pool_wait_observers.append(_observe_pool_wait)
+    _instrument_serialization()
+    app.add_middleware(RequestMetricsMiddleware)
@@ -0,0 +1,187 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+from fastapi import Request, Response
+from cache import TTLCache
+from event_bus import bus
+
+# 匿名请求的响应缓存：缓存序列化好的 JSON 字节，支持 ETag / If-None-Match
+# 失效采用"命名空间版本号"：写操作只需把相关命名空间 (feed、post:<id>、user:<id>) 的版本号加一，
+# 旧版本的键自然不再被命中，由 LRU/TTL 淘汰。后端只需要 get/set/incr 三个操作，Redis 可直接满足
+
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "10"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "2000"))
+# 每个响应另存一份不带版本号的副本，过载降级时 (admission.py) 允许返回这份可能稍旧的数据。
+# 副本放在进程内单独的 LRU 里 (不占用正常缓存的容量，也不写入 Redis)，帖子被删除时立即清除
+RESPONSE_CACHE_STALE_TTL = float(os.getenv("RESPONSE_CACHE_STALE_TTL", "300"))
+RESPONSE_CACHE_STALE_SIZE = int(os.getenv("RESPONSE_CACHE_STALE_SIZE", str(RESPONSE_CACHE_SIZE)))
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL") # 例如 redis://localhost:6379/0，未设置时使用进程内缓存
+# 进程内缓存最多记录多少个命名空间的版本号 (每个被写过的帖子/用户一个)
+RESPONSE_CACHE_MAX_VERSIONS = int(os.getenv("RESPONSE_CACHE_MAX_VERSIONS", "100000"))
+
+class LocalBackend:
+    # 版本号取进程内全局递增的序号，超过上限时淘汰最久未失效的命名空间，并把 floor 抬到被淘汰的版本号：
+    # 没有记录的命名空间一律按 floor 计，只会比它最后一次的版本号大或相等，不会退回到已失效的旧版本
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL,
+                 max_versions: int = RESPONSE_CACHE_MAX_VERSIONS):
+        self.entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.counters = OrderedDict()
+        self.max_versions = max_versions
+        self.seq = 0
+        self.floor = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.entries.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.entries.set(key, value, ttl=ttl)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self.seq += 1
+            self.counters[key] = self.seq
+            self.counters.move_to_end(key)
+            while len(self.counters) > self.max_versions:
+                _, version = self.counters.popitem(last=False)
+                self.floor = max(self.floor, version)
+            return self.seq
+
+    def get_counter(self, key: str) -> int:
+        return self.counters.get(key, self.floor)
+
+class RedisBackend:
+    # 适配 redis-py 风格的客户端 (或任何提供 get/set(ex=)/incr 的兼容实现)
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float):
+        self.client.set(key, value, ex=max(1, int(ttl)))
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+    def get_counter(self, key: str) -> int:
+        return int(self.client.get(key) or 0)
+
+def create_backend():
+    if RESPONSE_CACHE_URL:
+        import redis # 可选依赖，仅在配置了 RESPONSE_CACHE_URL 时需要
+        return RedisBackend(redis.Redis.from_url(RESPONSE_CACHE_URL))
+    return LocalBackend()
+
+class ResponseCache:
+    def __init__(self, backend, ttl: float = RESPONSE_CACHE_TTL, stale_ttl: float = RESPONSE_CACHE_STALE_TTL,
+                 stale_size: int = RESPONSE_CACHE_STALE_SIZE):
+        self.backend = backend
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        # 旧版本副本：stale 键 -> (命名空间集合, 打包的响应)
+        self.stale = TTLCache(maxsize=stale_size, ttl=stale_ttl) if stale_ttl else None
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+
+    def make_key(self, route: str, namespaces, **params) -> str:
+        versions = ",".join(f"{ns}={self.backend.get_counter('ver:' + ns)}" for ns in namespaces)
+        query = "&".join(f"{k}={v}" for k, v in sorted(params.items()) if v is not None)
+        return f"resp:{route}|{versions}|{query}"
+
+    def get(self, key: str):
+        raw = self.backend.get(key)
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return _unpack(raw)
+
+    def store(self, key: str, body: bytes, next_cursor: Optional[str] = None):
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        entry = (etag, next_cursor or "", body)
+        raw = _pack(entry)
+        self.backend.set(key, raw, self.ttl)
+        if self.stale is not None:
+            self.stale.set(_stale_key(key), (_namespaces(key), raw))
+        return entry
+
+    def get_stale(self, key: str):
+        # 同一路由和参数最近一次缓存的响应，不管之后是否失效过 (删除的帖子除外，见 invalidate 的 purge)
+        item = self.stale.get(_stale_key(key)) if self.stale is not None else None
+        if item is None:
+            return None
+        self.stale_hits += 1
+        return _unpack(item[1])
+
+    def invalidate(self, *namespaces, purge: bool = False):
+        # purge=True 时同时丢弃这些命名空间的旧版本副本 (内容已被删除，降级时也不能再返回)
+        self.invalidate_local(*namespaces)
+        if purge:
+            self.purge_stale(*namespaces)
+        # 进程内缓存的版本号只在本 worker 生效，需要广播给其它 worker；Redis 后端是共享的，
+        # 只有清除旧版本副本 (每个 worker 各自一份) 时才需要广播
+        if isinstance(self.backend, LocalBackend) or purge:
+            bus.publish("response_cache", {"namespaces": list(namespaces), "purge": purge})
+
+    def invalidate_local(self, *namespaces):
+        for ns in namespaces:
+            self.backend.incr("ver:" + ns)
+
+    def purge_stale(self, *namespaces):
+        if self.stale is not None:
+            targets = set(namespaces)
+            self.stale.delete_where(lambda key, item: not targets.isdisjoint(item[0]))
+
+    def apply_remote(self, payload: dict):
+        # 其它 worker 的失效消息
+        if isinstance(self.backend, LocalBackend):
+            self.invalidate_local(*payload["namespaces"])
+        if payload.get("purge"):
+            self.purge_stale(*payload["namespaces"])
+
+    def clear_local(self):
+        # 总线丢了消息时不知道哪些命名空间过期了，直接清空本进程缓存 (包括可能漏掉了删除的旧版本副本)
+        if isinstance(self.backend, LocalBackend):
+            self.backend.entries.clear()
+        if self.stale is not None:
+            self.stale.clear()
+
+    def stats(self) -> dict:
+        return {"backend": type(self.backend).__name__, "ttl": self.ttl, "hits": self.hits, "misses": self.misses,
+                "stale_hits": self.stale_hits, "stale_size": self.stale.stats()["size"] if self.stale is not None else 0}
+
+def _stale_key(key: str) -> str:
+    # resp:<route>|<版本号>|<参数> -> stale:<route>|<参数>
+    route, _, query = key.split("|", 2)
+    return "stale:" + route[len("resp:"):] + "|" + query
+
+def _namespaces(key: str) -> frozenset:
+    # resp:<route>|feed=3,post:5=7|<参数> -> {"feed", "post:5"}
+    versions = key.split("|", 2)[1]
+    return frozenset(item.rpartition("=")[0] for item in versions.split(",") if item)
+
+def _pack(entry) -> bytes:
+    etag, next_cursor, body = entry
+    return etag.encode() + b"\n" + next_cursor.encode() + b"\n" + body
+
+def _unpack(raw: bytes):
+    etag, next_cursor, body = raw.split(b"\n", 2)
+    return etag.decode(), next_cursor.decode(), body
+
+def to_response(request: Request, entry) -> Response:
+    etag, next_cursor, body = entry
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+response_cache = ResponseCache(create_backend())
+bus.subscribe("response_cache", response_cache.apply_remote)
+bus.on_reset(response_cache.clear_local)
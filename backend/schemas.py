@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
 from datetime import datetime
 
 # --- Token Schemas ---
@@ -10,6 +10,13 @@ class Token(BaseModel):
 class TokenData(BaseModel):
     username: Optional[str] = None
 
+class Principal(BaseModel):
+    # 认证依赖返回的轻量身份信息 (可缓存)，需要完整资料时再按 id 查询
+    id: int
+    username: str
+    is_superuser: bool = False
+    is_active: bool = True
+
 # --- Post Schemas ---
 class PostBase(BaseModel):
     title: str
@@ -32,23 +39,31 @@ class Post(PostBase):
     views: int = 0
     likes_count: int = 0
     comments_count: int = 0
+    collections_count: int = 0
     is_liked: bool = False # 当前用户是否点赞 (需要后端逻辑填充)
     is_collected: bool = False # 当前用户是否收藏
+    image_variants: Optional[Dict[str, str]] = None # 配图的缩略图/WebP 版本 URL
 
     class Config:
         from_attributes = True
 
+class TagCount(BaseModel):
+    name: str
+    post_count: int
+
 # --- Comment Schemas ---
 class CommentBase(BaseModel):
     content: str
 
 class CommentCreate(CommentBase):
-    pass
+    parent_id: Optional[int] = None # 回复某条评论；回复的回复会归到顶层评论下
 
 class Comment(CommentBase):
     id: int
     owner_id: int
     post_id: int
+    parent_id: Optional[int] = None
+    reply_count: int = 0
     created_at: datetime
     owner_username: Optional[str] = None
     owner_avatar: Optional[str] = None
@@ -75,6 +90,10 @@ class UserUpdate(BaseModel):
     website: Optional[str] = None
     avatar_url: Optional[str] = None
 
+class AdminUserUpdate(BaseModel):
+    is_active: Optional[bool] = None
+    is_superuser: Optional[bool] = None
+
 class User(UserBase):
     id: int
     is_active: bool
@@ -83,6 +102,49 @@ class User(UserBase):
     followers_count: int = 0
     following_count: int = 0
     is_following: bool = False # 当前用户是否关注
+    avatar_variants: Optional[Dict[str, str]] = None # 头像各尺寸 URL
+
+    class Config:
+        from_attributes = True
+
+# --- Toggle Schemas ---
+class ToggleAction(BaseModel):
+    type: Literal["like", "collect", "follow"]
+    target_id: int
+
+class ToggleBatch(BaseModel):
+    actions: List[ToggleAction]
+
+class ToggleResult(BaseModel):
+    type: str
+    target_id: int
+    state: Optional[bool] = None # 切换后的状态，None 表示失败
+    error: Optional[str] = None
+
+# --- Notification Schemas ---
+class Notification(BaseModel):
+    id: int
+    type: str # like / follow / comment / reply
+    actor_id: int
+    actor_username: Optional[str] = None
+    actor_avatar: Optional[str] = None
+    post_id: Optional[int] = None
+    comment_id: Optional[int] = None
+    is_read: bool = False
+    created_at: datetime
 
     class Config:
         from_attributes = True
+
+class NotificationRead(BaseModel):
+    up_to_id: Optional[int] = None # 把 id 不超过它的通知标为已读，为空时全部标为已读
+
+# --- Search Schemas ---
+class SearchHit(BaseModel):
+    type: str # post / comment
+    post_id: int
+    comment_id: Optional[int] = None
+    title: Optional[str] = None
+    title_highlight: Optional[str] = None
+    snippet: str = "" # 已做 HTML 转义，命中词用 <em> 包裹
+    score: float
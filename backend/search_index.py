@@ -0,0 +1,206 @@
+import re
+import math
+import html
+from collections import Counter, defaultdict
+from sqlalchemy import delete, func, insert
+from sqlalchemy.orm import Session
+import models, schemas, database
+from cache import TTLCache
+
+# 帖子与评论的全文搜索：数据库中的倒排索引 + BM25 打分
+# 分词：中日韩文字切成相邻二元组 (单字成段时保留单字)，拉丁字母/数字按单词切分并转小写，
+# 与 Lucene CJKAnalyzer 的做法一致，不依赖额外的中文分词库
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+TITLE_WEIGHT = 3 # 标题中的词元按 3 倍词频计
+TAG_WEIGHT = 2
+MAX_TERM_LENGTH = 64
+MAX_POSTINGS_PER_TERM = 5000 # 单个词元最多取词频最高的若干文档参与打分
+MAX_QUERY_TERMS = 10 # 每种文档最多用多少个查询词元打分，单次搜索最多读取 2 * 10 * 5000 条倒排记录
+SNIPPET_RADIUS = 40
+
+CJK = r"぀-ヿ㐀-䶿一-鿿豈-﫿가-힯"
+TOKEN_RE = re.compile(rf"[{CJK}]+|[a-z0-9]+(?:[._+#-][a-z0-9]+)*")
+CJK_RE = re.compile(rf"[{CJK}]")
+
+# 全库统计 (文档数、平均长度) 变化缓慢，短时间缓存
+_stats_cache = TTLCache(maxsize=4, ttl=60)
+
+def tokenize(text: str) -> list:
+    tokens = []
+    for match in TOKEN_RE.finditer((text or "").lower()):
+        segment = match.group(0)
+        if CJK_RE.match(segment):
+            if len(segment) == 1:
+                tokens.append(segment)
+            else:
+                tokens.extend(segment[i:i + 2] for i in range(len(segment) - 1))
+        else:
+            tokens.append(segment[:MAX_TERM_LENGTH])
+    return tokens
+
+def _post_terms(post) -> Counter:
+    terms = Counter(tokenize(post.content))
+    for token in tokenize(post.title):
+        terms[token] += TITLE_WEIGHT
+    for token in tokenize((post.tags or "").replace(",", " ")):
+        terms[token] += TAG_WEIGHT
+    return terms
+
+def _write_document(db: Session, doc_type: str, doc_id: int, post_id: int, terms: Counter):
+    length = sum(terms.values())
+    db.execute(insert(models.SearchDocument).values(doc_type=doc_type, doc_id=doc_id, post_id=post_id, length=length))
+    if terms:
+        db.execute(insert(models.SearchPosting), [
+            {"term": term, "doc_type": doc_type, "doc_id": doc_id, "tf": tf, "doc_length": length}
+            for term, tf in terms.items()
+        ])
+
+def _remove_documents(db: Session, doc_type: str, doc_ids: list):
+    if not doc_ids:
+        return
+    db.execute(delete(models.SearchPosting).where(
+        models.SearchPosting.doc_type == doc_type, models.SearchPosting.doc_id.in_(doc_ids)))
+    db.execute(delete(models.SearchDocument).where(
+        models.SearchDocument.doc_type == doc_type, models.SearchDocument.doc_id.in_(doc_ids)))
+
+# --- 增量维护 (与业务写操作在同一事务中，由调用方提交) ---
+
+def index_post(db: Session, post):
+    _remove_documents(db, "post", [post.id])
+    _write_document(db, "post", post.id, post.id, _post_terms(post))
+
+def index_comment(db: Session, comment):
+    _remove_documents(db, "comment", [comment.id])
+    _write_document(db, "comment", comment.id, comment.post_id, Counter(tokenize(comment.content)))
+
+def remove_comment(db: Session, comment_id: int):
+    _remove_documents(db, "comment", [comment_id])
+
+def remove_post(db: Session, post_id: int):
+    # 同时清理该帖子下所有评论的索引
+    comment_ids = [row.doc_id for row in db.query(models.SearchDocument.doc_id).filter(
+        models.SearchDocument.doc_type == "comment", models.SearchDocument.post_id == post_id)]
+    _remove_documents(db, "comment", comment_ids)
+    _remove_documents(db, "post", [post_id])
+
+# --- 查询 ---
+
+def _corpus_stats(db: Session, doc_type: str):
+    stats = _stats_cache.get(doc_type)
+    if stats is None:
+        count, avg_length = db.query(func.count(), func.avg(models.SearchDocument.length)) \
+            .filter(models.SearchDocument.doc_type == doc_type).one()
+        stats = (count or 0, float(avg_length or 0) or 1.0)
+        _stats_cache.set(doc_type, stats)
+    return stats
+
+def _document_frequencies(db: Session, terms: list, doc_types: list) -> dict:
+    # 一条 GROUP BY 查出所有词元的文档频率 (只读 (term, doc_type, doc_id) 主键索引)：{(doc_type, term): df}
+    rows = db.query(models.SearchPosting.doc_type, models.SearchPosting.term, func.count()) \
+        .filter(models.SearchPosting.term.in_(terms), models.SearchPosting.doc_type.in_(doc_types)) \
+        .group_by(models.SearchPosting.doc_type, models.SearchPosting.term).all()
+    return {(doc_type, term): df for doc_type, term, df in rows}
+
+def _score(db: Session, terms: list, doc_types: list) -> dict:
+    scores = defaultdict(float)
+    frequencies = _document_frequencies(db, terms, doc_types)
+    for doc_type in doc_types:
+        total_docs, avg_length = _corpus_stats(db, doc_type)
+        if not total_docs:
+            continue
+        # 长查询 (100 个汉字约 99 个二元组) 只取文档频率最低的 MAX_QUERY_TERMS 个词元打分：
+        # 它们的 idf 最高，决定了排序；常见词元的得分贡献小、倒排表却最长
+        matched = sorted((frequencies[(doc_type, term)], term) for term in terms if (doc_type, term) in frequencies)
+        for df, term in matched[:MAX_QUERY_TERMS]:
+            postings = db.query(models.SearchPosting.doc_id, models.SearchPosting.tf, models.SearchPosting.doc_length) \
+                .filter(models.SearchPosting.term == term, models.SearchPosting.doc_type == doc_type) \
+                .order_by(models.SearchPosting.tf.desc()).limit(MAX_POSTINGS_PER_TERM).all()
+            idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf, doc_length in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * (doc_length or 0) / avg_length)
+                scores[(doc_type, doc_id)] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+    return scores
+
+def highlight(text: str, query: str) -> str:
+    # 截取第一个命中位置附近的片段，HTML 转义后用 <em> 标出命中的词
+    text = text or ""
+    needles = sorted(set(TOKEN_RE.findall(query.lower())) | set(tokenize(query)), key=len, reverse=True)
+    lowered = text.lower()
+    positions = [lowered.find(n) for n in needles if lowered.find(n) >= 0]
+    start = max(0, min(positions) - SNIPPET_RADIUS) if positions else 0
+    end = min(len(text), start + SNIPPET_RADIUS * 3)
+    snippet = html.escape(text[start:end])
+    if needles:
+        pattern = re.compile("|".join(re.escape(html.escape(n)) for n in needles), re.IGNORECASE)
+        snippet = pattern.sub(lambda m: f"<em>{m.group(0)}</em>", snippet)
+    return ("…" if start > 0 else "") + snippet + ("…" if end < len(text) else "")
+
+def search(db: Session, query: str, doc_type: str = None, limit: int = 20, offset: int = 0):
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms:
+        return []
+    doc_types = [doc_type] if doc_type else ["post", "comment"]
+    scores = _score(db, terms, doc_types)
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[offset:offset + limit]
+
+    post_ids = [doc_id for (kind, doc_id), _ in ranked if kind == "post"]
+    comment_ids = [doc_id for (kind, doc_id), _ in ranked if kind == "comment"]
+    posts = {p.id: p for p in db.query(models.Post.id, models.Post.title, models.Post.content)
+             .filter(models.Post.id.in_(post_ids))} if post_ids else {}
+    comments = {c.id: c for c in db.query(models.Comment.id, models.Comment.post_id, models.Comment.content)
+                .filter(models.Comment.id.in_(comment_ids))} if comment_ids else {}
+    parent_ids = {c.post_id for c in comments.values()} - set(posts)
+    titles = {p.id: p.title for p in posts.values()}
+    if parent_ids:
+        titles.update(db.query(models.Post.id, models.Post.title).filter(models.Post.id.in_(parent_ids)).all())
+
+    hits = []
+    for (kind, doc_id), score in ranked:
+        if kind == "post" and doc_id in posts:
+            post = posts[doc_id]
+            hits.append(schemas.SearchHit(
+                type="post", post_id=post.id, title=post.title, score=round(score, 4),
+                title_highlight=highlight(post.title, query), snippet=highlight(post.content, query)))
+        elif kind == "comment" and doc_id in comments:
+            comment = comments[doc_id]
+            hits.append(schemas.SearchHit(
+                type="comment", post_id=comment.post_id, comment_id=comment.id, score=round(score, 4),
+                title=titles.get(comment.post_id), snippet=highlight(comment.content, query)))
+    return hits
+
+# --- 全量重建 ---
+
+def rebuild(batch_size: int = 500):
+    db = database.SessionLocal()
+    try:
+        db.execute(delete(models.SearchPosting))
+        db.execute(delete(models.SearchDocument))
+        db.commit()
+        total = 0
+        for model, doc_type in ((models.Post, "post"), (models.Comment, "comment")):
+            last_id = 0
+            while True:
+                rows = db.query(model).filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                for row in rows:
+                    if doc_type == "post":
+                        index_post(db, row)
+                    else:
+                        index_comment(db, row)
+                db.commit()
+                db.expunge_all()
+                total += len(rows)
+                print(f"已索引 {total} 个文档 ...")
+        _stats_cache.clear()
+        return total
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    from migrate import upgrade_schema
+    upgrade_schema()
+    print(f"搜索索引重建完成，共 {rebuild()} 个文档。")
@@ -0,0 +1,89 @@
+import re
+from datetime import datetime
+from sqlalchemy import delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import models
+from cache import TTLCache
+
+# 标签规范化存储：tags 表 + post_tags 关联表，Post.tags 字符串列继续保留给旧客户端
+
+MAX_TAGS_PER_POST = 10
+MAX_TAG_LENGTH = 50
+POPULAR_TAGS_TTL = 60
+POPULAR_TAGS_LIMIT = 50
+
+# 热门标签缓存，过期后下次访问时重新计算
+_popular_cache = TTLCache(maxsize=1, ttl=POPULAR_TAGS_TTL)
+
+def normalize_tag(name: str) -> str:
+    return re.sub(r"\s+", " ", (name or "").strip().lstrip("#")).lower()[:MAX_TAG_LENGTH]
+
+def parse_tags(tags: str) -> list:
+    # 兼容英文/中文逗号、顿号分隔，去重并保持原有顺序
+    names = [normalize_tag(part) for part in re.split(r"[,，、]", tags or "")]
+    return list(dict.fromkeys(name for name in names if name))[:MAX_TAGS_PER_POST]
+
+def get_or_create_tag_ids(db: Session, names: list) -> dict:
+    if not names:
+        return {}
+    ids = dict(db.query(models.Tag.name, models.Tag.id).filter(models.Tag.name.in_(names)).all())
+    for name in names:
+        if name in ids:
+            continue
+        try:
+            with db.begin_nested():
+                ids[name] = db.execute(insert(models.Tag).values(name=name, post_count=0)).inserted_primary_key[0]
+        except IntegrityError:
+            # 并发创建了同名标签
+            ids[name] = db.query(models.Tag.id).filter(models.Tag.name == name).scalar()
+    return ids
+
+def set_post_tags(db: Session, post):
+    # 由调用方提交；重复调用时先清理旧关联
+    remove_post_tags(db, post.id)
+    tag_ids = get_or_create_tag_ids(db, parse_tags(post.tags))
+    if not tag_ids:
+        return
+    db.execute(insert(models.post_tags), [
+        {"post_id": post.id, "tag_id": tag_id, "created_at": post.created_at or datetime.utcnow()}
+        for tag_id in tag_ids.values()
+    ])
+    db.query(models.Tag).filter(models.Tag.id.in_(tag_ids.values())).update(
+        {models.Tag.post_count: models.Tag.post_count + 1}, synchronize_session=False)
+
+def remove_post_tags(db: Session, post_id: int):
+    tag_ids = [row[0] for row in db.execute(
+        select(models.post_tags.c.tag_id).where(models.post_tags.c.post_id == post_id))]
+    if not tag_ids:
+        return
+    db.execute(delete(models.post_tags).where(models.post_tags.c.post_id == post_id))
+    db.query(models.Tag).filter(models.Tag.id.in_(tag_ids)).update(
+        {models.Tag.post_count: models.Tag.post_count - 1}, synchronize_session=False)
+
+def get_popular_tags(db: Session, limit: int = 20):
+    tags = _popular_cache.get("popular")
+    if tags is None:
+        tags = [{"name": name, "post_count": count} for name, count in
+                db.query(models.Tag.name, models.Tag.post_count).filter(models.Tag.post_count > 0)
+                .order_by(models.Tag.post_count.desc()).limit(POPULAR_TAGS_LIMIT)]
+        _popular_cache.set("popular", tags)
+    return tags[:limit]
+
+def backfill(db: Session, batch_size: int = 500):
+    # 把已有帖子的 Post.tags 字符串迁移到 tags/post_tags，可重复执行
+    last_id = 0
+    total = 0
+    while True:
+        posts = db.query(models.Post.id, models.Post.tags, models.Post.created_at) \
+            .filter(models.Post.id > last_id).order_by(models.Post.id).limit(batch_size).all()
+        if not posts:
+            break
+        for post in posts:
+            set_post_tags(db, post)
+        db.commit()
+        last_id = posts[-1].id
+        total += len(posts)
+        print(f"已处理 {total} 篇帖子 ...")
+    _popular_cache.clear()
+    return total
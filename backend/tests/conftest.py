@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# 测试直接导入 backend 下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 需要数据库的测试使用临时目录下的 SQLite，必须在导入 database 之前设置
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="luntan-test-"), "test.db"))
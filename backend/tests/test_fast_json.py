@@ -0,0 +1,108 @@
+from datetime import datetime
+import pytest
+from pydantic import TypeAdapter
+from sqlalchemy import insert
+import models, schemas, database, post_crud, tag_crud, ranking, timeline, fast_json
+
+# FAST_JSON 路径 (post_rows + fast_json.dumps) 与 Pydantic 路径 (ORM 对象 + schemas.Post) 的输出必须逐字节一致
+# 数据覆盖各字段的边界：NULL 配图/标签/头像、非内容寻址的旧 URL、整秒和带微秒的发布时间、置顶
+
+POSTS = TypeAdapter(list[schemas.Post])
+IMAGE = "/uploads/ab/cd/" + "ab" * 32 + ".jpg"
+VIEWER, AUTHOR, BIG_AUTHOR = 1, 2, 3
+
+@pytest.fixture(scope="module")
+def db():
+    models.Base.metadata.drop_all(database.engine)
+    models.Base.metadata.create_all(database.engine)
+    session = database.SessionLocal()
+    session.add_all([
+        models.User(id=VIEWER, username="viewer", email="v@x.com", hashed_password="x"),
+        models.User(id=AUTHOR, username="作者", email="a@x.com", hashed_password="x", avatar_url=IMAGE, followers_count=1),
+        models.User(id=BIG_AUTHOR, username="big", email="b@x.com", hashed_password="x",
+                    avatar_url="http://example.com/a.png", followers_count=10),
+    ])
+    posts = [
+        models.Post(id=1, title="整秒", content="内容 \"引号\" \n换行", owner_id=AUTHOR, image_url=None, tags=None,
+                    category="tech", created_at=datetime(2024, 1, 1, 8, 0, 0)),
+        models.Post(id=2, title="微秒", content="c", owner_id=AUTHOR, image_url=IMAGE, tags="python,fastapi",
+                    category="tech", created_at=datetime(2024, 1, 2, 8, 0, 0, 123456), views=7, likes_count=1,
+                    collections_count=1, comments_count=2),
+        models.Post(id=3, title="置顶", content="c", owner_id=BIG_AUTHOR, image_url="/static/old.png", tags="python",
+                    category="life", is_pinned=True, is_original=False, created_at=datetime(2024, 1, 3, 0, 0, 0, 500)),
+        models.Post(id=4, title="emoji 🎉", content="", owner_id=BIG_AUTHOR, image_url=None, tags="",
+                    category="life", created_at=datetime(2024, 1, 4, 23, 59, 59)),
+    ]
+    session.add_all(posts)
+    session.flush()
+    for post in posts:
+        tag_crud.set_post_tags(session, post)
+    session.execute(insert(models.post_likes), [{"user_id": VIEWER, "post_id": 2}])
+    session.execute(insert(models.post_collections), [{"user_id": VIEWER, "post_id": 2}, {"user_id": VIEWER, "post_id": 3}])
+    session.execute(insert(models.user_follows), [{"follower_id": VIEWER, "followed_id": AUTHOR},
+                                                  {"follower_id": VIEWER, "followed_id": BIG_AUTHOR}])
+    # AUTHOR 推送到时间线，BIG_AUTHOR 读取时拉取
+    session.execute(insert(models.TimelineEntry), [
+        {"user_id": VIEWER, "post_id": p.id, "author_id": AUTHOR, "created_at": p.created_at} for p in posts[:2]])
+    session.commit()
+    ranking.rebuild(session)
+    yield session
+    session.close()
+
+@pytest.fixture(autouse=True)
+def pull_big_authors(monkeypatch):
+    monkeypatch.setattr(timeline, "FANOUT_THRESHOLD", 5)
+
+@pytest.fixture(autouse=True, params=["orjson", "json"])
+def encoder(request, monkeypatch):
+    # 有无 orjson 两种编码都要与 Pydantic 一致
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(fast_json, "orjson", None)
+
+CASES = {
+    "get_posts": lambda db, viewer, as_rows: post_crud.get_posts(db, current_user_id=viewer, as_rows=as_rows),
+    "get_posts_category": lambda db, viewer, as_rows: post_crud.get_posts(
+        db, current_user_id=viewer, category="tech", as_rows=as_rows),
+    "get_hot_posts": lambda db, viewer, as_rows: post_crud.get_hot_posts(db, current_user_id=viewer, as_rows=as_rows),
+    "get_posts_by_user": lambda db, viewer, as_rows: post_crud.get_posts_by_user(
+        db, AUTHOR, current_user_id=viewer, as_rows=as_rows),
+    "get_posts_by_tag": lambda db, viewer, as_rows: post_crud.get_posts_by_tag(
+        db, "python", current_user_id=viewer, as_rows=as_rows),
+}
+
+def _both(db, fetch):
+    expected, cursor_a = fetch(False)
+    # 与 response_model 相同：先校验 ORM 对象，再序列化
+    expected = POSTS.dump_json(POSTS.validate_python(expected))
+    db.expunge_all() # ORM 路径在对象上写了 owner_username 等属性，不让它们影响另一条路径
+    actual, cursor_b = fetch(True)
+    db.expunge_all()
+    return expected, fast_json.dumps(actual), cursor_a, cursor_b
+
+def _assert_parity(expected: bytes, actual: bytes):
+    assert fast_json.diff(expected, actual) == []
+    assert actual == expected
+
+@pytest.mark.parametrize("viewer", [None, VIEWER], ids=["anonymous", "logged_in"])
+@pytest.mark.parametrize("name", CASES)
+def test_post_lists_match_pydantic(db, name, viewer):
+    expected, actual, cursor_a, cursor_b = _both(db, lambda as_rows: CASES[name](db, viewer, as_rows))
+    assert expected.startswith(b"[{") # 有数据可比
+    _assert_parity(expected, actual)
+    assert cursor_a == cursor_b
+
+def test_following_feed_matches_pydantic(db):
+    expected, actual, cursor_a, cursor_b = _both(db, lambda as_rows: post_crud.get_following_feed(db, VIEWER, as_rows=as_rows))
+    assert [p.id for p in POSTS.validate_json(expected)] == [4, 3, 2, 1]
+    _assert_parity(expected, actual)
+    assert cursor_a == cursor_b
+
+def test_second_page_matches_pydantic(db):
+    # 游标来自快速路径的第一页，第二页两条路径结果仍一致
+    _, cursor = post_crud.get_posts(db, limit=2, as_rows=True)
+    expected, actual, cursor_a, cursor_b = _both(
+        db, lambda as_rows: post_crud.get_posts(db, limit=2, cursor=cursor, current_user_id=VIEWER, as_rows=as_rows))
+    _assert_parity(expected, actual)
+    assert cursor_a == cursor_b
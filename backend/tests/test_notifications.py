@@ -0,0 +1,111 @@
+import json
+import asyncio
+import pytest
+import notifications
+
+# notifications.stream 的合并、溢出补读和断线续传；数据库用内存列表代替
+
+USER_ID = 1
+
+@pytest.fixture(autouse=True)
+def fresh_broker(monkeypatch):
+    monkeypatch.setattr(notifications, "broker", notifications.Broker())
+    monkeypatch.setattr(notifications, "NOTIFY_COALESCE_SECONDS", 0.05)
+
+class FakeStore:
+    def __init__(self):
+        self.rows = []
+
+    def add(self, type="like", post_id=10, actor_id=2, publish=True):
+        payload = {
+            "id": len(self.rows) + 1, "user_id": USER_ID, "type": type, "actor_id": actor_id,
+            "actor_username": f"u{actor_id}", "actor_avatar": None, "post_id": post_id,
+            "comment_id": None, "created_at": "2024-01-01T00:00:00",
+        }
+        self.rows.append(payload)
+        if publish:
+            notifications.broker.publish(USER_ID, payload)
+        return payload
+
+    async def load_since(self, last_id, limit):
+        return [p for p in self.rows if p["id"] > last_id][:limit]
+
+    async def load_unread(self, up_to_id):
+        return sum(1 for p in self.rows if p["id"] <= up_to_id)
+
+async def never_disconnected():
+    return False
+
+def parse(chunk: str):
+    fields = dict(line.split(": ", 1) for line in chunk.strip().split("\n") if not line.startswith(":"))
+    return fields.get("event"), json.loads(fields["data"]) if "data" in fields else None
+
+class Client:
+    # 在后台消费 SSE 流，按事件类型收集
+    def __init__(self, store, last_id):
+        self.events = []
+        self.gen = notifications.stream(USER_ID, last_id, store.load_since, never_disconnected, store.load_unread)
+
+    async def run(self):
+        async for chunk in self.gen:
+            event, data = parse(chunk)
+            if event:
+                self.events.append((event, data))
+
+    def of(self, event):
+        return [data for name, data in self.events if name == event]
+
+async def run_client(store, last_id, scenario):
+    notifications.broker.start()
+    client = Client(store, last_id)
+    task = asyncio.create_task(client.run())
+    await asyncio.sleep(0.01) # 订阅完成
+    await scenario()
+    await asyncio.sleep(0.2)
+    notifications.broker.stop()
+    await asyncio.wait_for(task, 1)
+    return client
+
+def test_coalesces_same_post_events():
+    store = FakeStore()
+
+    async def scenario():
+        for actor in (2, 3, 4, 5):
+            store.add(actor_id=actor)
+        store.add(type="comment", post_id=11, actor_id=6)
+
+    client = asyncio.run(run_client(store, 0, scenario))
+    events = client.of("notification")
+    assert [(e["type"], e["count"], e["id"]) for e in events] == [("like", 4, 4), ("comment", 1, 5)]
+    # 最近的触发者在前，最多 NOTIFY_MAX_ACTORS 个
+    assert [a["id"] for a in events[0]["actors"]] == [5, 4, 3]
+
+def test_overflow_resyncs_from_store(monkeypatch):
+    monkeypatch.setattr(notifications, "NOTIFY_QUEUE_SIZE", 2)
+    store = FakeStore()
+
+    async def scenario():
+        for post_id in range(5):
+            store.add(post_id=post_id)
+
+    client = asyncio.run(run_client(store, 0, scenario))
+    assert notifications.broker.dropped == 3
+    # 丢弃的事件从数据库补读，每条都送达且 id 递增
+    assert [e["id"] for e in client.of("notification")] == [1, 2, 3, 4, 5]
+
+def test_resume_replays_backlog_before_unread():
+    store = FakeStore()
+    for post_id in (1, 2, 2):
+        store.add(post_id=post_id, publish=False)
+
+    async def scenario():
+        # 补读期间已在数据库里的通知再次经由代理到达，按 id 去重
+        notifications.broker.publish(USER_ID, store.rows[-1])
+        store.add(post_id=3)
+
+    client = asyncio.run(run_client(store, 1, scenario))
+    names = [name for name, _ in client.events]
+    assert names[0] == "notification" and names.index("unread") == 1
+    assert client.of("unread") == [{"count": 3, "last_id": 3}]
+    # 补发的是 id > 1 的通知，之后的推送 id 都大于未读数统计到的 last_id
+    assert [(e["id"], e["count"]) for e in client.of("notification")] == [(3, 2), (4, 1)]
@@ -0,0 +1,49 @@
+import pytest
+from sqlalchemy import event
+import models, database, search_index
+
+# 长查询的打分代价有上限：词元再多，也只用文档频率最低的 MAX_QUERY_TERMS 个
+
+LONG_TEXT = "数据库连接池的大小应当根据并发请求数与单次查询耗时来估算，过大反而会增加锁竞争和上下文切换的开销，" \
+            "过小则请求排队等待连接，延迟升高。一般从核心数的两倍开始压测，观察等待时间再调整参数，直到吞吐稳定为止。"
+
+@pytest.fixture(scope="module")
+def db():
+    models.Base.metadata.drop_all(database.engine)
+    models.Base.metadata.create_all(database.engine)
+    session = database.SessionLocal()
+    session.add(models.User(id=1, username="u", email="u@x.com", hashed_password="x"))
+    posts = [models.Post(id=1, title="连接池调优", content=LONG_TEXT, owner_id=1),
+             models.Post(id=2, title="前端入门", content="组件与响应式", owner_id=1),
+             models.Post(id=3, title="转载", content=LONG_TEXT, owner_id=1)]
+    session.add_all(posts)
+    session.flush()
+    for post in posts:
+        search_index.index_post(session, post)
+    session.commit()
+    search_index._stats_cache.clear()
+    yield session
+    session.close()
+
+def count_queries(fn):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(database.engine, "before_cursor_execute", listener)
+    try:
+        return fn(), statements
+    finally:
+        event.remove(database.engine, "before_cursor_execute", listener)
+
+def test_long_query_is_capped(db):
+    query = LONG_TEXT[:100]
+    assert len(set(search_index.tokenize(query))) > search_index.MAX_QUERY_TERMS * 5
+    hits, statements = count_queries(lambda: search_index.search(db, query))
+    assert {h.post_id for h in hits} == {1, 3}
+    postings = [s for s in statements if "FROM search_postings" in s and "GROUP BY" not in s]
+    assert len(postings) <= search_index.MAX_QUERY_TERMS * 2
+
+def test_rare_terms_are_kept(db):
+    # 只在帖子 2 出现的词元排在常见词元前面，不会被上限截掉
+    query = LONG_TEXT[:60] + "响应式"
+    hits = search_index.search(db, query, doc_type="post")
+    assert {h.post_id for h in hits} == {1, 2, 3}
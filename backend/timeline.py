@@ -0,0 +1,206 @@
+import os
+import queue
+import logging
+import threading
+from datetime import datetime
+from collections import defaultdict
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+import models, database, pagination
+
+logger = logging.getLogger(__name__)
+
+# 关注动态：推拉结合
+# - 普通作者发帖后，由后台线程把帖子推送 (写扩散) 到所有粉丝的时间线
+# - 粉丝数超过 FANOUT_THRESHOLD 的作者不推送，读取时再从其帖子中拉取合并 (读扩散)
+# 时间线长度上限 TIMELINE_MAX_LENGTH，关注时回填作者近期帖子，取消关注时清理
+
+FANOUT_THRESHOLD = int(os.getenv("TIMELINE_FANOUT_THRESHOLD", "5000"))
+TIMELINE_MAX_LENGTH = int(os.getenv("TIMELINE_MAX_LENGTH", "1000"))
+BACKFILL_POSTS = int(os.getenv("TIMELINE_BACKFILL_POSTS", "20"))
+FANOUT_BATCH = 1000
+TRIM_EVERY = 50 # 每个用户累计推送这么多条后检查一次长度
+
+def _insert_entries(db: Session, rows: list):
+    if not rows:
+        return
+    try:
+        with db.begin_nested():
+            db.execute(insert(models.TimelineEntry), rows)
+    except IntegrityError:
+        # 批量里有已存在的条目 (重复投递/回填重叠)，退回逐条插入并跳过重复
+        for row in rows:
+            try:
+                with db.begin_nested():
+                    db.execute(insert(models.TimelineEntry).values(**row))
+            except IntegrityError:
+                pass
+
+def trim(db: Session, user_id: int):
+    # 只保留最新的 TIMELINE_MAX_LENGTH 条
+    cutoff = db.query(models.TimelineEntry.created_at, models.TimelineEntry.post_id) \
+        .filter(models.TimelineEntry.user_id == user_id) \
+        .order_by(models.TimelineEntry.created_at.desc(), models.TimelineEntry.post_id.desc()) \
+        .offset(TIMELINE_MAX_LENGTH).first()
+    if cutoff is not None:
+        columns = (models.TimelineEntry.created_at, models.TimelineEntry.post_id)
+        db.execute(delete(models.TimelineEntry).where(
+            models.TimelineEntry.user_id == user_id,
+            ~pagination.after(columns, (cutoff.created_at, cutoff.post_id), descending=False)))
+
+def is_pull_author(db: Session, author_id: int) -> bool:
+    count = db.query(models.User.followers_count).filter(models.User.id == author_id).scalar()
+    return (count or 0) > FANOUT_THRESHOLD
+
+class TimelineWorker:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pushes = defaultdict(int)
+
+    def submit(self, task, *args):
+        # 任务在后台线程里用独立会话执行，不阻塞请求；start() 之前提交的任务会在启动后处理
+        self._queue.put((task, args))
+
+    def _execute(self, task, *args):
+        db = database.SessionLocal()
+        try:
+            getattr(self, task)(db, *args)
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception("时间线任务失败: %s", task)
+        finally:
+            db.close()
+
+    def fanout(self, db: Session, post_id: int, author_id: int, created_at):
+        if is_pull_author(db, author_id):
+            return
+        last_id = 0
+        while True:
+            follower_ids = [row[0] for row in db.execute(
+                select(models.user_follows.c.follower_id)
+                .where(models.user_follows.c.followed_id == author_id, models.user_follows.c.follower_id > last_id)
+                .order_by(models.user_follows.c.follower_id).limit(FANOUT_BATCH))]
+            if not follower_ids:
+                break
+            _insert_entries(db, [{"user_id": uid, "post_id": post_id, "author_id": author_id, "created_at": created_at}
+                                 for uid in follower_ids])
+            for uid in follower_ids:
+                self._pushes[uid] += 1
+                if self._pushes[uid] >= TRIM_EVERY:
+                    self._pushes[uid] = 0
+                    trim(db, uid)
+            db.commit()
+            last_id = follower_ids[-1]
+
+    def follow(self, db: Session, follower_id: int, author_id: int):
+        # 关注后回填作者最近的帖子；读扩散作者在读取时拉取，无需回填
+        if is_pull_author(db, author_id):
+            return
+        posts = db.query(models.Post.id, models.Post.created_at).filter(models.Post.owner_id == author_id) \
+            .order_by(models.Post.created_at.desc(), models.Post.id.desc()).limit(BACKFILL_POSTS).all()
+        _insert_entries(db, [{"user_id": follower_id, "post_id": p.id, "author_id": author_id, "created_at": p.created_at}
+                             for p in posts])
+
+    def unfollow(self, db: Session, follower_id: int, author_id: int):
+        db.execute(delete(models.TimelineEntry).where(
+            models.TimelineEntry.user_id == follower_id, models.TimelineEntry.author_id == author_id))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            task, args = item
+            self._execute(task, *args)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="timeline-fanout", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # 处理完队列中剩余的任务后退出
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+timeline_worker = TimelineWorker()
+
+def backfill(db: Session = None) -> int:
+    # 为已有的关注关系整体回填时间线 (批量导入后运行，导入的关注没有经过 follow 任务)
+    # 按作者处理：每个作者的近期帖子只查一次，再分批写给其所有粉丝；已存在的条目跳过，可重复运行
+    own = db is None
+    db = db or database.SessionLocal()
+    follows = models.user_follows.c
+    try:
+        total, last_author = 0, 0
+        while True:
+            authors = db.query(models.User.id).filter(
+                models.User.id > last_author, models.User.followers_count > 0,
+                models.User.followers_count <= FANOUT_THRESHOLD).order_by(models.User.id).limit(FANOUT_BATCH).all()
+            if not authors:
+                break
+            last_author = authors[-1].id
+            for (author_id,) in authors:
+                posts = db.query(models.Post.id, models.Post.created_at).filter(models.Post.owner_id == author_id) \
+                    .order_by(models.Post.created_at.desc(), models.Post.id.desc()).limit(BACKFILL_POSTS).all()
+                if not posts:
+                    continue
+                last_follower = 0
+                while True:
+                    follower_ids = [row[0] for row in db.execute(
+                        select(follows.follower_id)
+                        .where(follows.followed_id == author_id, follows.follower_id > last_follower)
+                        .order_by(follows.follower_id).limit(FANOUT_BATCH // len(posts) + 1))]
+                    if not follower_ids:
+                        break
+                    last_follower = follower_ids[-1]
+                    existing = set(db.query(models.TimelineEntry.user_id, models.TimelineEntry.post_id).filter(
+                        models.TimelineEntry.user_id.in_(follower_ids), models.TimelineEntry.author_id == author_id))
+                    rows = [{"user_id": uid, "post_id": p.id, "author_id": author_id, "created_at": p.created_at}
+                            for uid in follower_ids for p in posts if (uid, p.id) not in existing]
+                    _insert_entries(db, rows)
+                    db.commit()
+                    total += len(rows)
+        # 关注了很多作者的用户可能超出长度上限
+        for (user_id,) in db.query(models.TimelineEntry.user_id).group_by(models.TimelineEntry.user_id) \
+                .having(func.count() > TIMELINE_MAX_LENGTH).all():
+            trim(db, user_id)
+        db.commit()
+        return total
+    finally:
+        if own:
+            db.close()
+
+def remove_post(db: Session, post_id: int):
+    db.execute(delete(models.TimelineEntry).where(models.TimelineEntry.post_id == post_id))
+
+def read_page(db: Session, user_id: int, cursor: str = None, limit: int = 20):
+    # 返回按 (created_at, post_id) 倒序合并后的一页 [(created_at, post_id), ...] 和下一页游标
+    key = pagination.decode_cursor(cursor, datetime, int) if cursor else None
+
+    entries = db.query(models.TimelineEntry.created_at, models.TimelineEntry.post_id) \
+        .filter(models.TimelineEntry.user_id == user_id)
+    if key:
+        entries = entries.filter(pagination.after((models.TimelineEntry.created_at, models.TimelineEntry.post_id), key))
+    merged = {row.post_id: row.created_at for row in entries.order_by(
+        models.TimelineEntry.created_at.desc(), models.TimelineEntry.post_id.desc()).limit(limit)}
+
+    # 拉取：关注的大V作者
+    pull_authors = [row[0] for row in db.execute(
+        select(models.user_follows.c.followed_id)
+        .join(models.User, models.User.id == models.user_follows.c.followed_id)
+        .where(models.user_follows.c.follower_id == user_id, models.User.followers_count > FANOUT_THRESHOLD))]
+    if pull_authors:
+        posts = db.query(models.Post.created_at, models.Post.id).filter(models.Post.owner_id.in_(pull_authors))
+        if key:
+            posts = posts.filter(pagination.after((models.Post.created_at, models.Post.id), key))
+        for row in posts.order_by(models.Post.created_at.desc(), models.Post.id.desc()).limit(limit):
+            merged[row.id] = row.created_at
+
+    page = sorted(((created_at, post_id) for post_id, created_at in merged.items()), reverse=True)[:limit]
+    return page, pagination.next_cursor(page, limit, lambda item: item)
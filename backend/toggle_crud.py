@@ -0,0 +1,21 @@
+from sqlalchemy.orm import Session
+import schemas, crud, post_crud
+
+# 一次请求内批量执行点赞/收藏/关注切换，所有操作在同一事务中提交
+def apply_toggles(db: Session, actions: list, user_id: int):
+    results = []
+    for action in actions:
+        error = None
+        if action.type == "like":
+            state = post_crud.like_post(db, action.target_id, user_id, commit=False)
+        elif action.type == "collect":
+            state = post_crud.collect_post(db, action.target_id, user_id, commit=False)
+        elif action.target_id == user_id:
+            state, error = None, "Cannot follow yourself"
+        else:
+            state = crud.follow_user(db, user_id, action.target_id, commit=False)
+        if state is None and error is None:
+            error = "Post not found" if action.type != "follow" else "User not found"
+        results.append(schemas.ToggleResult(type=action.type, target_id=action.target_id, state=state, error=error))
+    db.commit()
+    return results
@@ -0,0 +1,125 @@
+import os
+import re
+import uuid
+import json
+import hashlib
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+import media
+
+# 上传文件按内容寻址存储：uploads/<哈希前2位>/<哈希3-4位>/<sha256><扩展名>
+# 相同内容只保存一份，URL 由内容决定，不会因同名文件互相覆盖
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+CHUNK_SIZE = 1024 * 1024
+# 临时文件不能放在 UPLOAD_DIR 里 (整个目录经 /uploads 公开访问)，默认放在同级目录，
+# 与 UPLOAD_DIR 在同一文件系统上，os.replace 才是原子的
+TMP_DIR = os.getenv("UPLOAD_TMP_DIR", os.path.normpath(UPLOAD_DIR) + ".tmp")
+# multipart 请求体比文件本身多出的边界和字段头
+MULTIPART_OVERHEAD = 64 * 1024
+UPLOAD_PATHS = {"/api/upload"}
+
+class UploadTooLarge(Exception):
+    pass
+
+def safe_extension(filename: str) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    return ext if re.fullmatch(r"\.[a-z0-9]{1,8}", ext) else ""
+
+def relative_path(digest: str, ext: str) -> str:
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+def _store(source, filename: str):
+    # 在线程池中执行：分块读取、边写临时文件边计算哈希，超过大小上限立即中止
+    os.makedirs(TMP_DIR, exist_ok=True)
+    tmp_path = os.path.join(TMP_DIR, uuid.uuid4().hex)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, "wb") as out:
+            while True:
+                chunk = source.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                out.write(chunk)
+        rel = relative_path(digest.hexdigest(), safe_extension(filename))
+        final_path = os.path.join(UPLOAD_DIR, rel)
+        if os.path.exists(final_path):
+            # 重复上传：内容已存在，直接复用
+            os.remove(tmp_path)
+            return rel, False
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+        return rel, True
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+async def save_upload(file: UploadFile, kind: str = "post") -> str:
+    # 返回可直接访问的 URL，如 /uploads/ab/cd/abcd....png；kind 为图片用途 (media.KINDS)
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise UploadTooLarge()
+    rel, _ = await run_in_threadpool(_store, file.file, file.filename)
+    # 交给后台进程池生成该用途的派生版本，不等待其完成；重复上传时只补缺少的版本
+    media.submit(UPLOAD_DIR, rel, kind)
+    return f"/uploads/{rel}"
+
+def ensure_variants(url: str, kind: str):
+    # 已上传的图片换了用途 (例如把帖子配图设为头像) 时补生成对应的派生版本
+    rel = media.image_path(url)
+    if rel is not None and os.path.exists(os.path.join(UPLOAD_DIR, rel)):
+        media.submit(UPLOAD_DIR, rel, kind)
+
+class UploadLimitMiddleware:
+    # Starlette 会先把整个 multipart 请求体读完 (落到临时文件) 才进入路由，路由里的大小检查为时已晚：
+    # 这里按 Content-Length 直接拒绝，没有 Content-Length (分块传输) 时边收边计数，超出即中止读取
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in UPLOAD_PATHS:
+            return await self.app(scope, receive, send)
+        limit = MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > limit:
+                return await _reject(send)
+        received = 0
+        too_large = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    too_large = True
+                    raise UploadTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # 中止后路由层会把读取失败转成 400，丢弃它，改为返回 413
+            if not too_large:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except UploadTooLarge:
+            pass
+        if too_large:
+            await _reject(send)
+
+async def _reject(send):
+    body = json.dumps({"detail": f"File too large (max {MAX_UPLOAD_BYTES} bytes)"}).encode()
+    await send({"type": "http.response.start", "status": 413, "headers": [
+        (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), (b"connection", b"close")]})
+    await send({"type": "http.response.body", "body": body})
+
+def install(app):
+    # 在 main.py 中于 CORS 之前调用，使 413 响应也带上 CORS 头
+    app.add_middleware(UploadLimitMiddleware)
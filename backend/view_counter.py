@@ -0,0 +1,100 @@
+import os
+import logging
+import threading
+from collections import defaultdict
+from sqlalchemy import case, update
+import models, database
+from ranking import hot_ranker
+
+logger = logging.getLogger(__name__)
+
+# 阅读量写回配置：每隔 VIEW_FLUSH_INTERVAL 秒，或累计 VIEW_FLUSH_THRESHOLD 次阅读时批量落库
+VIEW_FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", "5"))
+VIEW_FLUSH_THRESHOLD = int(os.getenv("VIEW_FLUSH_THRESHOLD", "1000"))
+
+class ViewCounter:
+    # 进程内阅读量聚合器：读帖子时只在内存里计数，由后台线程定期用一条 UPDATE 批量写回，
+    # 热门帖子的阅读不再逐次争抢 posts 行锁
+    def __init__(self, interval: float = VIEW_FLUSH_INTERVAL, threshold: int = VIEW_FLUSH_THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self._pending = defaultdict(int)
+        self._total = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def incr(self, post_id: int, amount: int = 1):
+        # 在请求路径上调用 (包括事件循环里的缓存命中路径)，只计数；达到阈值时唤醒后台线程写回，
+        # 自身不访问数据库，也不会因为写回失败而抛出异常
+        with self._lock:
+            self._pending[post_id] += amount
+            self._total += amount
+            should_flush = self._total >= self.threshold
+        if should_flush:
+            self._wake.set()
+
+    def pending(self, post_id: int) -> int:
+        # 尚未落库的增量，用于返回近似实时的阅读量
+        return self._pending.get(post_id, 0)
+
+    def flush(self) -> int:
+        with self._lock:
+            batch = dict(self._pending)
+            self._pending.clear()
+            self._total = 0
+        if not batch:
+            return 0
+        db = database.SessionLocal()
+        try:
+            # UPDATE posts SET views = views + CASE id WHEN ... END WHERE id IN (...)
+            db.execute(
+                update(models.Post)
+                .where(models.Post.id.in_(batch))
+                .values(views=models.Post.views + case(batch, value=models.Post.id, else_=0))
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            # 写回失败时把增量放回去，下次再试
+            with self._lock:
+                for post_id, amount in batch.items():
+                    self._pending[post_id] += amount
+                    self._total += amount
+            raise
+        finally:
+            db.close()
+        hot_ranker.mark(*batch)
+        return len(batch)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("阅读量写回失败")
+                # 数据库暂时不可用时不要被阈值唤醒反复重试
+                if self._stop.wait(self.interval):
+                    break
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="view-counter", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # 应用关闭时调用：停止后台线程并把剩余增量全部写回
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+view_counter = ViewCounter()
@@ -62,18 +62,21 @@ export const createComment = (postId, content) => {
     return api.post(`/posts/${postId}/comments/`, { content });
 };
 
-export const uploadFile = (file) => {
+// kind: 'post' (帖子配图) 或 'avatar' (头像)，决定服务端生成哪些尺寸的图片
+export const uploadFile = (file, kind = 'post') => {
     const formData = new FormData();
     formData.append('file', file);
     return api.post('/upload', formData, {
+        params: { kind },
         headers: {
             'Content-Type': 'multipart/form-data'
         }
     });
 };
 
-export const getAllUsers = (skip = 0, limit = 100) => {
-    return api.get(`/admin/users?skip=${skip}&limit=${limit}`);
+// 管理员用户列表：params 可含 limit、cursor (上一页响应头 X-Next-Cursor)、sort、is_active、is_superuser、username_prefix
+export const getAllUsers = (params = {}) => {
+    return api.get('/admin/users', { params });
 };
 
 export const deletePost = (postId) => {
@@ -108,4 +111,19 @@ export const collectPost = (postId) => {
     return api.post(`/posts/${postId}/collect`);
 };
 
+export const getPopularTags = (limit = 20) => {
+    return api.get('/tags/popular', { params: { limit } });
+};
+
+// 通知推送 (Server-Sent Events)：EventSource 不能带请求头，token 放在查询参数里
+// 断线后浏览器会自动重连并带上 Last-Event-ID，由后端补发漏掉的通知
+export const openNotificationStream = () => {
+    const token = localStorage.getItem('token');
+    return new EventSource(`/api/notifications/stream?token=${encodeURIComponent(token)}`);
+};
+
+export const markNotificationsRead = (upToId = null) => {
+    return api.post('/notifications/read', { up_to_id: upToId });
+};
+
 export default api;